@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+
+"""
+Revise the resources of bcbio_system.yaml from what jobs actually used
+
+Read sacct output recorded by slurm/scripts/sacct_efficiency.py --export, and print the revised resources as a diff:
+tune_bcbio_resources.py --sacct-file sacct_2021-06.txt
+
+Each job is put down to a tool by its name: the first tool (a key of the resources section, or one of BCBIO_TOOLS)
+named in it, or as mapped with --map 'REGEX=TOOL'. Jobs that match no tool (i.e cromwell copy tasks) are left out,
+'default' is only revised from jobs mapped to it explicitly, i.e --map 'bcbio-e=default'.
+For each tool with at least --min-jobs jobs
+* cores:    the --cores-percentile of the cores jobs kept busy (TotalCPU / Elapsed), rounded up
+* memory:   the --memory-percentile of peak RSS (largest step) plus --headroom, per core as bcbio expects, rounded up to 1G
+* jvm_opts: for JVM_TOOLS and tools with their own jvm_opts, -Xmx kept at the same fraction of memory as set
+            alongside it (JVM_HEAP_FRACTION otherwise), -Xms no larger than -Xmx
+
+Alongside the diff, how many of each tool's jobs fit on each instance type (by cores and by memory) before and after.
+Write the revised configuration with --output.
+"""
+
+import os
+import re
+import sys
+import math
+import difflib
+import logging
+import argparse
+from pathlib import Path
+
+import yaml
+
+logger = logging.getLogger("bcbio")
+
+DEFAULT_BCBIO_SYSTEM = Path(__file__).absolute().parent.parent / "config" / "bcbio_system.yaml"
+
+# Tools bcbio takes resources for, looked for in job names alongside those already configured
+BCBIO_TOOLS = ["bcftools", "bowtie2", "bwa", "fastqc", "freebayes", "gatk", "gemini", "hisat2", "macs2", "multiqc",
+               "mutect2", "picard", "qualimap", "salmon", "sambamba", "samtools", "seqcluster", "snpeff", "star",
+               "vardict", "vcfanno", "express", "dexseq"]
+
+# Tools that run on the JVM, and so are given jvm_opts in step with their memory
+JVM_TOOLS = ["gatk", "mutect2", "picard", "qualimap", "snpeff", "varscan"]
+
+# Instance types of the compute partitions, RealMemory as set by enable_mem_on_slurm in bootstrap/post_install.sh
+INSTANCE_TYPES = {
+    "c5.4xlarge": {"cores": 16, "memory": 30000},
+    "m5.4xlarge": {"cores": 16, "memory": 62000}
+}
+
+DEFAULT_MEMORY_PERCENTILE = 95
+DEFAULT_CORES_PERCENTILE = 90
+DEFAULT_HEADROOM = 0.2
+DEFAULT_MIN_JOBS = 5
+
+# -Xmx as a fraction of memory for tools that don't set one, leaves room for the JVM's own overheads
+JVM_HEAP_FRACTION = 0.85
+
+REQUIRED_SACCT_FIELDS = ["JobID", "JobName", "ElapsedRaw", "AllocCPUS", "TotalCPU", "MaxRSS"]
+MEMORY_UNITS = {"K": 1 / 1024, "M": 1, "G": 1024, "T": 1024 * 1024}
+MEMORY_REGEX = re.compile(r"^([\d.]+)([KMGTkmgt]?)[cn]?$")
+TOTAL_CPU_REGEX = re.compile(r"^(?:(?:(\d+)-)?(\d+):)?(\d+):(\d+(?:\.\d+)?)$")
+JVM_MEMORY_REGEX = re.compile(r"^-Xm([sx])(\d+(?:\.\d+)?)([kmgKMG]?)$")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Revise bcbio_system.yaml resources from observed job usage")
+    parser.add_argument("--sacct-file",
+                        nargs="+",
+                        required=True,
+                        help="sacct output recorded with sacct_efficiency.py --export")
+    parser.add_argument("--bcbio-system",
+                        required=False, default=DEFAULT_BCBIO_SYSTEM,
+                        help="bcbio_system.yaml to revise")
+    parser.add_argument("--output",
+                        required=False,
+                        help="Write the revised bcbio_system.yaml here")
+    parser.add_argument("--map",
+                        nargs="+",
+                        required=False, default=[],
+                        help="Put jobs whose name matches REGEX down to TOOL, given as REGEX=TOOL")
+    parser.add_argument("--memory-percentile",
+                        type=float,
+                        required=False, default=DEFAULT_MEMORY_PERCENTILE,
+                        help="Percentile of peak memory to provide for")
+    parser.add_argument("--cores-percentile",
+                        type=float,
+                        required=False, default=DEFAULT_CORES_PERCENTILE,
+                        help="Percentile of busy cores to provide for")
+    parser.add_argument("--headroom",
+                        type=float,
+                        required=False, default=DEFAULT_HEADROOM,
+                        help="Fraction of memory to add on top of the percentile")
+    parser.add_argument("--min-jobs",
+                        type=int,
+                        required=False, default=DEFAULT_MIN_JOBS,
+                        help="Only revise tools with at least this many jobs")
+
+    args = parser.parse_args()
+
+    for percentile_arg in ["memory_percentile", "cores_percentile"]:
+        if not 0 < getattr(args, percentile_arg) <= 100:
+            parser.error("--{} must be between 0 and 100".format(percentile_arg.replace("_", "-")))
+
+    if args.headroom < 0:
+        parser.error("--headroom can't be negative")
+
+    job_name_maps = []
+    for job_name_map in args.map:
+        if "=" not in job_name_map:
+            parser.error("--map must be given as REGEX=TOOL")
+        job_name_regex, tool = job_name_map.rsplit("=", 1)
+        try:
+            job_name_maps.append((re.compile(job_name_regex), tool))
+        except re.error as regex_error:
+            parser.error("Bad --map regex \"{}\": {}".format(job_name_regex, regex_error))
+    setattr(args, "map", job_name_maps)
+
+    return args
+
+
+def parse_memory(memory_value, default_unit="M"):
+    """
+    sacct / bcbio memory, i.e 1234K, 3500Mc, 14G, as MB
+    :param memory_value:
+    :param default_unit: unit of values without one
+    :return: None if not a memory value
+    """
+
+    memory_match = MEMORY_REGEX.match(str(memory_value).strip())
+    if memory_match is None:
+        return None
+
+    number, unit = memory_match.groups()
+
+    return float(number) * MEMORY_UNITS[(unit or default_unit).upper()]
+
+
+def parse_total_cpu(total_cpu_value):
+    """
+    TotalCPU, [DD-[HH:]]MM:SS.mmm, in seconds
+    :param total_cpu_value:
+    :return: None if not a time
+    """
+
+    total_cpu_match = TOTAL_CPU_REGEX.match(total_cpu_value)
+    if total_cpu_match is None:
+        return None
+
+    days, hours, minutes, seconds = total_cpu_match.groups()
+
+    return int(days or 0) * 86400 + int(hours or 0) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def read_sacct_jobs(sacct_file_path):
+    """
+    Cores kept busy and peak RSS of each finished job in a sacct export
+    :param sacct_file_path:
+    :return: list of dicts of job_name, alloc_cpus, busy_cores, max_rss (MB)
+    """
+
+    jobs = {}
+    step_max_rss = {}
+
+    try:
+        with open(sacct_file_path, 'r') as sacct_h:
+            header = sacct_h.readline().rstrip("\n").split("|")
+            missing_fields = [field for field in REQUIRED_SACCT_FIELDS if field not in header]
+            if len(missing_fields) > 0:
+                logger.error("sacct file \"{}\" is missing {}".format(sacct_file_path, ", ".join(missing_fields)))
+                sys.exit(1)
+
+            for line in sacct_h:
+                row = dict(zip(header, line.rstrip("\n").split("|")))
+                if not len(row) == len(header):
+                    continue
+
+                # MaxRSS is recorded against the steps of a job, i.e 1234.batch
+                job_id, _, step = row["JobID"].partition(".")
+                if not step == "":
+                    max_rss = parse_memory(row["MaxRSS"], default_unit="K")
+                    if max_rss is not None:
+                        step_max_rss[job_id] = max(step_max_rss.get(job_id, 0), max_rss)
+                    continue
+
+                if not row["ElapsedRaw"].isdigit() or int(row["ElapsedRaw"]) == 0 or not row["AllocCPUS"].isdigit():
+                    continue
+
+                # Jobs still running ('Unknown' end) haven't reached their peak yet
+                if "End" in row and not row["End"][:1].isdigit():
+                    continue
+
+                total_cpu = parse_total_cpu(row["TotalCPU"])
+                if total_cpu is None:
+                    continue
+
+                jobs[job_id] = {
+                    "job_name": row["JobName"],
+                    "alloc_cpus": int(row["AllocCPUS"]),
+                    "busy_cores": total_cpu / int(row["ElapsedRaw"])
+                }
+    except OSError as os_error:
+        logger.error("Could not read sacct file \"{}\": {}".format(sacct_file_path, os_error))
+        sys.exit(1)
+
+    return [dict(job, max_rss=step_max_rss[job_id]) for job_id, job in jobs.items() if job_id in step_max_rss]
+
+
+def get_tool(job_name, tools, job_name_maps):
+    """
+    Tool a job is put down to
+    :param job_name:
+    :param tools: tool names to look for in the job name
+    :param job_name_maps: list of (compiled regex, tool) from --map, tried first
+    :return: None if no tool matches
+    """
+
+    for job_name_regex, tool in job_name_maps:
+        if job_name_regex.search(job_name) is not None:
+            return tool
+
+    job_name_words = re.split(r"[^a-z0-9]+", job_name.lower())
+    for tool in tools:
+        if tool.lower() in job_name_words:
+            return tool
+
+    return None
+
+
+def get_percentile(values, percentile):
+    """
+    Nearest rank percentile
+    :param values:
+    :param percentile: 0 - 100
+    :return:
+    """
+
+    sorted_values = sorted(values)
+
+    return sorted_values[max(math.ceil(percentile / 100 * len(sorted_values)) - 1, 0)]
+
+
+def get_resources(resources, tool):
+    """
+    Resources a tool runs with, its own settings over the defaults
+    :param resources: resources section of bcbio_system.yaml
+    :param tool:
+    :return: dict of cores, memory (MB per core) and jvm_opts
+    """
+
+    tool_resources = dict(resources.get("default", {}), **resources.get(tool, {}))
+
+    return {
+        "cores": int(tool_resources.get("cores", 1)),
+        "memory": parse_memory(tool_resources.get("memory", "1G"), default_unit="G"),
+        "jvm_opts": tool_resources.get("jvm_opts")
+    }
+
+
+def format_memory(memory):
+    """
+    MB as whole G, rounded up, as written in bcbio_system.yaml
+    :param memory:
+    :return:
+    """
+
+    return "{}G".format(max(math.ceil(memory / 1024), 1))
+
+
+def get_jvm_opts(jvm_opts, memory, old_memory=None):
+    """
+    Scale -Xmx with memory, keeping the fraction of memory it was, and keep -Xms no larger than -Xmx
+    :param jvm_opts: current jvm_opts
+    :param memory: revised memory, MB per core
+    :param old_memory: memory set alongside jvm_opts, MB per core, JVM_HEAP_FRACTION is used if not given
+    :return: revised jvm_opts
+    """
+
+    jvm_memory = {}
+    for jvm_opt in jvm_opts:
+        jvm_memory_match = JVM_MEMORY_REGEX.match(jvm_opt)
+        if jvm_memory_match is not None:
+            jvm_memory[jvm_memory_match.group(1)] = parse_memory(jvm_memory_match.group(2) + jvm_memory_match.group(3))
+
+    heap_fraction = jvm_memory["x"] / old_memory if "x" in jvm_memory and old_memory else JVM_HEAP_FRACTION
+    heap = int(math.floor(memory * min(heap_fraction, 1)))
+
+    revised_jvm_opts = []
+    for jvm_opt in jvm_opts:
+        jvm_memory_match = JVM_MEMORY_REGEX.match(jvm_opt)
+        if jvm_memory_match is None:
+            revised_jvm_opts.append(jvm_opt)
+        elif jvm_memory_match.group(1) == "x":
+            revised_jvm_opts.append("-Xmx{}m".format(heap))
+        else:
+            revised_jvm_opts.append("-Xms{}m".format(int(min(jvm_memory["s"], heap))))
+
+    if "x" not in jvm_memory:
+        revised_jvm_opts.append("-Xmx{}m".format(heap))
+
+    return revised_jvm_opts
+
+
+def tune_resources(resources, tool_jobs, memory_percentile, cores_percentile, headroom, min_jobs):
+    """
+    Revised resources section
+    :param resources: current resources section
+    :param tool_jobs: dict of tool to its jobs, from read_sacct_jobs
+    :param memory_percentile:
+    :param cores_percentile:
+    :param headroom:
+    :param min_jobs:
+    :return: revised resources section, dict of each revised tool to its (old, new) get_resources
+    """
+
+    revised_resources = {tool: dict(tool_resources) for tool, tool_resources in resources.items()}
+    revisions = {}
+
+    for tool, jobs in sorted(tool_jobs.items()):
+        if len(jobs) < min_jobs:
+            logger.info("Leaving {}, only {} jobs found".format(tool, len(jobs)))
+            continue
+
+        old_resources = get_resources(resources, tool)
+        max_cores = max(instance_type["cores"] for instance_type in INSTANCE_TYPES.values())
+
+        cores = min(max(math.ceil(get_percentile([job["busy_cores"] for job in jobs], cores_percentile)), 1),
+                    max_cores)
+        memory = get_percentile([job["max_rss"] for job in jobs], memory_percentile) * (1 + headroom) / cores
+        memory = max(math.ceil(memory / 1024), 1) * 1024
+
+        tool_resources = revised_resources.setdefault(tool, {})
+        tool_resources["cores"] = cores
+        tool_resources["memory"] = format_memory(memory)
+
+        # Only where -Xmx and memory were set together does their ratio mean anything
+        if "jvm_opts" in resources.get(tool, {}) or tool in JVM_TOOLS or tool == "default":
+            own_resources = resources.get(tool, {})
+            tool_resources["jvm_opts"] = get_jvm_opts(
+                old_resources["jvm_opts"] or [], memory,
+                old_memory=parse_memory(own_resources["memory"], default_unit="G")
+                if "jvm_opts" in own_resources and "memory" in own_resources else None
+            )
+
+        revisions[tool] = (old_resources, get_resources(revised_resources, tool))
+
+    return revised_resources, revisions
+
+
+def get_jobs_per_instance(tool_resources, instance_type):
+    """
+    How many jobs of a tool fit on an instance, by both cores and memory
+    :param tool_resources: from get_resources
+    :param instance_type: INSTANCE_TYPES value
+    :return:
+    """
+
+    return min(instance_type["cores"] // tool_resources["cores"],
+               int(instance_type["memory"] // (tool_resources["cores"] * tool_resources["memory"])))
+
+
+def print_packing(revisions, tool_jobs):
+    """
+    Print the jobs of each revised tool that fit on each instance type, before and after
+    :param revisions: from tune_resources
+    :param tool_jobs:
+    :return:
+    """
+
+    columns = [("Tool", 12), ("Jobs", 6), ("Cores", 7), ("Memory", 9)] + \
+              [(instance_type, 14) for instance_type in INSTANCE_TYPES.keys()]
+
+    print("  ".join(column.ljust(width) for column, width in columns).rstrip())
+
+    for tool, (old_resources, new_resources) in revisions.items():
+        row = [tool, str(len(tool_jobs[tool])),
+               "{}->{}".format(old_resources["cores"], new_resources["cores"]),
+               "{}->{}".format(format_memory(old_resources["memory"]), format_memory(new_resources["memory"]))]
+        for instance_type in INSTANCE_TYPES.values():
+            old_jobs = get_jobs_per_instance(old_resources, instance_type)
+            new_jobs = get_jobs_per_instance(new_resources, instance_type)
+            row.append("{}->{} ({:+d})".format(old_jobs, new_jobs, new_jobs - old_jobs))
+        print("  ".join(value.ljust(width) for value, (_, width) in zip(row, columns)).rstrip())
+
+
+def main():
+    logging.basicConfig(level=os.environ.get("BCBIO_LOG_LEVEL", "INFO"),
+                        format="%(asctime)s %(levelname)-8s %(message)s")
+
+    args = get_args()
+
+    try:
+        with open(args.bcbio_system, 'r') as bcbio_system_h:
+            bcbio_system = yaml.safe_load(bcbio_system_h)
+    except (OSError, yaml.YAMLError) as bcbio_system_error:
+        logger.error("Could not read \"{}\": {}".format(args.bcbio_system, bcbio_system_error))
+        sys.exit(1)
+
+    resources = bcbio_system.get("resources", {})
+    tools = [tool for tool in resources.keys() if tool not in ["machine", "default"]] + \
+            [tool for tool in BCBIO_TOOLS if tool not in resources]
+
+    tool_jobs = {}
+    unmatched_jobs = 0
+    for sacct_file_path in args.sacct_file:
+        for job in read_sacct_jobs(sacct_file_path):
+            tool = get_tool(job["job_name"], tools, args.map)
+            if tool is None:
+                unmatched_jobs += 1
+                continue
+            tool_jobs.setdefault(tool, []).append(job)
+
+    if unmatched_jobs > 0:
+        logger.info("Leaving out {} jobs that match no tool, use --map to put them down to one".format(unmatched_jobs))
+
+    if len(tool_jobs) == 0:
+        logger.error("No finished jobs of any bcbio tool found in {}".format(", ".join(args.sacct_file)))
+        sys.exit(1)
+
+    revised_resources, revisions = tune_resources(resources, tool_jobs,
+                                                  memory_percentile=args.memory_percentile,
+                                                  cores_percentile=args.cores_percentile,
+                                                  headroom=args.headroom,
+                                                  min_jobs=args.min_jobs)
+
+    revised_bcbio_system = dict(bcbio_system, resources=revised_resources)
+
+    # Diff the yaml as dumped both times, so only the resources that changed show up
+    sys.stdout.writelines(difflib.unified_diff(
+        yaml.safe_dump(bcbio_system, default_flow_style=False, sort_keys=False).splitlines(keepends=True),
+        yaml.safe_dump(revised_bcbio_system, default_flow_style=False, sort_keys=False).splitlines(keepends=True),
+        fromfile=str(args.bcbio_system), tofile=str(args.output or "revised")
+    ))
+    print()
+
+    print_packing(revisions, tool_jobs)
+
+    if args.output is not None:
+        with open(args.output, 'w') as output_h:
+            yaml.safe_dump(revised_bcbio_system, output_h, default_flow_style=False, sort_keys=False)
+
+
+if __name__ == "__main__":
+    main()
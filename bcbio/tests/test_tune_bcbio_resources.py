@@ -0,0 +1,69 @@
+"""
+Tests of tune_bcbio_resources.py against the recorded sacct export of slurm/tests/data
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+import yaml
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent / "scripts"))
+
+from tune_bcbio_resources import read_sacct_jobs, get_tool, tune_resources, BCBIO_TOOLS, \
+    DEFAULT_BCBIO_SYSTEM  # noqa: E402
+
+SACCT_FIXTURE = Path(__file__).absolute().parent.parent.parent / "slurm" / "tests" / "data" / "sacct_parsable2.txt"
+
+
+@pytest.fixture
+def resources():
+    with open(DEFAULT_BCBIO_SYSTEM, 'r') as bcbio_system_h:
+        return yaml.safe_load(bcbio_system_h)["resources"]
+
+
+@pytest.fixture
+def tool_jobs():
+    tool_jobs = {}
+    for job in read_sacct_jobs(SACCT_FIXTURE):
+        tool = get_tool(job["job_name"], BCBIO_TOOLS, [])
+        if tool is not None:
+            tool_jobs.setdefault(tool, []).append(job)
+    return tool_jobs
+
+
+def test_read_sacct_jobs():
+    jobs = read_sacct_jobs(SACCT_FIXTURE)
+
+    # The job still running is left out, the rest carry the MaxRSS of their largest step
+    assert [job["job_name"] for job in jobs] == ["bwa_mem", "samtools_sort", "gatk-haplotype", "copy_s3"]
+    assert [job["busy_cores"] for job in jobs] == pytest.approx([3, 1, 8, 0.2])
+    assert [job["max_rss"] for job in jobs] == pytest.approx([4000, 2048, 28000, 1000])
+
+
+def test_unmatched_jobs_are_left_out(tool_jobs):
+    assert sorted(tool_jobs.keys()) == ["bwa", "gatk", "samtools"]
+    assert get_tool("copy_s3", BCBIO_TOOLS, []) is None
+
+
+def test_tune_resources(resources, tool_jobs):
+    revised_resources, revisions = tune_resources(resources, tool_jobs, memory_percentile=95, cores_percentile=90,
+                                                  headroom=0.2, min_jobs=1)
+
+    # 4000M * 1.2 over 3 cores, rounded up to 2G a core, no jvm for bwa
+    assert revised_resources["bwa"] == {"cores": 3, "memory": "2G"}
+    # 28000M * 1.2 over 8 cores -> 5G a core, -Xmx at 0.85 of that, -Xms kept from the defaults
+    assert revised_resources["gatk"] == {"cores": 8, "memory": "5G", "jvm_opts": ["-Xms2000m", "-Xmx4352m"]}
+    assert revised_resources["samtools"] == {"cores": 1, "memory": "3G"}
+
+    # Nothing was mapped to default, so it is left as it was
+    assert revised_resources["default"] == resources["default"]
+    assert sorted(revisions.keys()) == ["bwa", "gatk", "samtools"]
+
+
+def test_min_jobs(resources, tool_jobs):
+    revised_resources, revisions = tune_resources(resources, tool_jobs, memory_percentile=95, cores_percentile=90,
+                                                  headroom=0.2, min_jobs=2)
+
+    assert revisions == {}
+    assert revised_resources == resources
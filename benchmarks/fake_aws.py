@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+"""
+Answer boto3 api calls from the simulated clusters in fake_state, without going near aws
+
+Hooks botocore's before-call event on the shared session (the same mechanism botocore's Stubber uses),
+so every client made through umccr_utils.aws_clients gets its responses from here.
+Each call sleeps for the given latency and is counted by service and operation.
+
+Covers the calls made by the cluster scripts:
+sts GetCallerIdentity, ssm GetParameters / GetParametersByPath,
+ec2 DescribeImages / DescribeInstances / DescribeTags,
+cloudformation DescribeStacks / DescribeStackEvents / ListStackResources / DeleteStack
+"""
+
+import re
+import time
+import threading
+from datetime import datetime, timezone
+from botocore.awsrequest import AWSResponse
+from fake_state import FAKE_PCLUSTER_VERSION
+
+# One of the accounts in AWS_ACCOUNT_MAPPING, so the network settings resolve
+FAKE_ACCOUNT_ID = "843407916570"
+
+FAKE_SSM_PARAMETERS = {
+    "/parallel_cluster/main/s3_config_root": "s3://fake-bucket/parallel-cluster"
+}
+
+# Number of stacks describe_stacks returns per page
+DESCRIBE_STACKS_PAGE_SIZE = 100
+
+STACK_PREFIX = "parallelcluster-"
+STACK_NAME_REGEX = re.compile(r"^(?:arn:.*:stack/)?parallelcluster-(.+?)(?:/.*)?$")
+
+FAKE_CREATION_TIME = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeAWSError(Exception):
+    """
+    Turned into an aws error response
+    """
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class FakeAWS(object):
+    """
+    Respond to boto3 calls from the simulated state
+    """
+
+    def __init__(self, fake_state, latency=0.0, ami_versions=None):
+        """
+        :param fake_state: FakeState
+        :param latency: seconds each call takes
+        :param ami_versions: versions to create a parallel cluster ami for, i.e ['0.1.0-2.10.3']
+        """
+        self.fake_state = fake_state
+        self.latency = latency
+        self.ami_versions = ami_versions if ami_versions is not None else []
+        self.call_counts = {}
+        self.call_counts_lock = threading.Lock()
+
+    def install(self):
+        """
+        Answer every call made by clients created from now on
+        :return:
+        """
+
+        from umccr_utils.aws_clients import get_session, configure_clients
+
+        # Clients take a copy of the session's event hooks when they are created
+        configure_clients()
+        session_events = get_session().events
+        session_events.register("before-parameter-build.*.*", self.capture_params)
+        session_events.register_first("before-call.*.*", self.handle)
+
+    def handle(self, model, params, **kwargs):
+        """
+        botocore before-call handler, returning a response stops botocore from making the request
+        :param model: botocore OperationModel
+        :param params: the serialised request, the parameters as given are kept by capture_params
+        :return: http response, parsed response
+        """
+
+        service_name = model.service_model.service_name
+        operation_name = model.name
+        call_name = "{}.{}".format(service_name, operation_name)
+
+        with self.call_counts_lock:
+            self.call_counts[call_name] = self.call_counts.get(call_name, 0) + 1
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        handler = getattr(self, "{}_{}".format(service_name, operation_name), None)
+
+        try:
+            if handler is None:
+                raise FakeAWSError("NotImplemented", "{} is not simulated".format(call_name))
+            parsed = handler(kwargs["context"]["fake_aws_params"])
+        except FakeAWSError as fake_error:
+            return AWSResponse(None, 400, {}, None), {
+                "Error": {"Code": fake_error.code, "Message": fake_error.message},
+                "ResponseMetadata": {"HTTPStatusCode": 400, "RetryAttempts": 0}
+            }
+
+        parsed["ResponseMetadata"] = {"HTTPStatusCode": 200, "RetryAttempts": 0}
+
+        return AWSResponse(None, 200, {}, None), parsed
+
+    def capture_params(self, params, context, **kwargs):
+        """
+        botocore before-parameter-build handler, keep the parameters as given by the caller
+        :return:
+        """
+
+        context["fake_aws_params"] = dict(params)
+
+    def get_cluster(self, stack_name):
+        """
+        Find the cluster behind a stack name / id
+        :param stack_name:
+        :return: cluster name, cluster dict
+        """
+
+        stack_name_match = STACK_NAME_REGEX.match(stack_name)
+        clusters = self.fake_state.read()["clusters"]
+
+        if stack_name_match is None or stack_name_match.group(1) not in clusters:
+            raise FakeAWSError("ValidationError", "Stack with id {} does not exist".format(stack_name))
+
+        return stack_name_match.group(1), clusters[stack_name_match.group(1)]
+
+    @staticmethod
+    def get_stack(cluster_name, cluster):
+        return {
+            "StackId": "arn:aws:cloudformation:ap-southeast-2:{}:stack/{}{}/fake".format(
+                FAKE_ACCOUNT_ID, STACK_PREFIX, cluster_name
+            ),
+            "StackName": STACK_PREFIX + cluster_name,
+            "StackStatus": cluster["status"],
+            "CreationTime": FAKE_CREATION_TIME,
+            "Tags": [
+                {"Key": "Version", "Value": cluster["version"]},
+                {"Key": "Creator", "Value": cluster["creator"]}
+            ],
+            "Outputs": [
+                {"OutputKey": "MasterPrivateIP", "OutputValue": "10.0.0.1"}
+            ]
+        }
+
+    # sts
+
+    def sts_GetCallerIdentity(self, params):
+        return {
+            "UserId": "AIDAFAKEUSERID",
+            "Account": FAKE_ACCOUNT_ID,
+            "Arn": "arn:aws:iam::{}:user/benchmark".format(FAKE_ACCOUNT_ID)
+        }
+
+    # ssm
+
+    def ssm_GetParameters(self, params):
+        return {
+            "Parameters": [{"Name": name, "Type": "String", "Value": FAKE_SSM_PARAMETERS[name]}
+                           for name in params["Names"] if name in FAKE_SSM_PARAMETERS],
+            "InvalidParameters": [name for name in params["Names"] if name not in FAKE_SSM_PARAMETERS]
+        }
+
+    def ssm_GetParametersByPath(self, params):
+        return {
+            "Parameters": [{"Name": name, "Type": "String", "Value": value}
+                           for name, value in FAKE_SSM_PARAMETERS.items()
+                           if name.startswith(params["Path"])]
+        }
+
+    # ec2
+
+    def ec2_DescribeImages(self, params):
+        return {
+            "Images": [{
+                "ImageId": "ami-{:017x}".format(image_index),
+                "Name": "parallel-cluster-{}".format(ami_version),
+                "CreationDate": "2021-01-01T00:00:00.000Z",
+                "Tags": [
+                    {"Key": "Stack", "Value": "ParallelCluster"},
+                    {"Key": "Version", "Value": ami_version}
+                ]
+            } for image_index, ami_version in enumerate(self.ami_versions)]
+        }
+
+    def get_instances(self, instance_ids):
+        instances = {cluster["head_node"]: cluster
+                     for cluster in self.fake_state.read()["clusters"].values()}
+        return [(instance_id, instances[instance_id]) for instance_id in instance_ids if instance_id in instances]
+
+    @staticmethod
+    def get_filter_values(params, filter_name):
+        for ec2_filter in params.get("Filters", []):
+            if ec2_filter["Name"] == filter_name:
+                return ec2_filter["Values"]
+        return None
+
+    def ec2_DescribeTags(self, params):
+        instance_ids = self.get_filter_values(params, "resource-id") or []
+        tag_keys = self.get_filter_values(params, "key")
+
+        return {
+            "Tags": [{"ResourceId": instance_id, "ResourceType": "instance", "Key": "Creator", "Value": cluster["creator"]}
+                     for instance_id, cluster in self.get_instances(instance_ids)
+                     if tag_keys is None or "Creator" in tag_keys]
+        }
+
+    def ec2_DescribeInstances(self, params):
+        instance_ids = params.get("InstanceIds") or self.get_filter_values(params, "instance-id") or []
+
+        return {
+            "Reservations": [{
+                "Instances": [{
+                    "InstanceId": instance_id,
+                    "State": {"Name": "running"},
+                    "Tags": [{"Key": "Creator", "Value": cluster["creator"]}]
+                }]
+            } for instance_id, cluster in self.get_instances(instance_ids)]
+        }
+
+    # cloudformation
+
+    def cloudformation_DescribeStacks(self, params):
+        if params.get("StackName") is not None:
+            return {"Stacks": [self.get_stack(*self.get_cluster(params["StackName"]))]}
+
+        clusters = sorted(self.fake_state.read()["clusters"].items())
+        page_start = int(params.get("NextToken", 0))
+        page_end = page_start + DESCRIBE_STACKS_PAGE_SIZE
+
+        response = {"Stacks": [self.get_stack(cluster_name, cluster)
+                               for cluster_name, cluster in clusters[page_start:page_end]]}
+        if page_end < len(clusters):
+            response["NextToken"] = str(page_end)
+
+        return response
+
+    def cloudformation_DescribeStackEvents(self, params):
+        cluster_name, cluster = self.get_cluster(params["StackName"])
+        stack_name = STACK_PREFIX + cluster_name
+
+        # Newest first
+        return {
+            "StackEvents": [
+                {
+                    "StackId": stack_name, "EventId": "{}-{}".format(stack_name, event_index), "StackName": stack_name,
+                    "LogicalResourceId": logical_resource_id, "ResourceType": resource_type,
+                    "ResourceStatus": resource_status, "Timestamp": FAKE_CREATION_TIME
+                }
+                for event_index, (logical_resource_id, resource_type, resource_status) in enumerate([
+                    (stack_name, "AWS::CloudFormation::Stack", cluster["status"]),
+                    ("MasterServer", "AWS::EC2::Instance", "CREATE_COMPLETE"),
+                    ("MasterServer", "AWS::EC2::Instance", "CREATE_IN_PROGRESS"),
+                    (stack_name, "AWS::CloudFormation::Stack", "CREATE_IN_PROGRESS")
+                ])
+            ]
+        }
+
+    def cloudformation_ListStackResources(self, params):
+        cluster_name, cluster = self.get_cluster(params["StackName"])
+
+        return {
+            "StackResourceSummaries": [{
+                "LogicalResourceId": "MasterServer",
+                "PhysicalResourceId": cluster["head_node"],
+                "ResourceType": "AWS::EC2::Instance",
+                "ResourceStatus": "CREATE_COMPLETE",
+                "LastUpdatedTimestamp": FAKE_CREATION_TIME
+            }]
+        }
+
+    def cloudformation_DeleteStack(self, params):
+        cluster_name, _ = self.get_cluster(params["StackName"])
+
+        with self.fake_state.update() as state:
+            state["clusters"].pop(cluster_name, None)
+
+        return {}
+
+
+def get_fake_ami_versions(umccr_version_str):
+    """
+    The ami versions to simulate, one for the version being benchmarked and a couple of older ones
+    :param umccr_version_str: i.e '0.1.0-2.10.3'
+    :return:
+    """
+
+    return [umccr_version_str, "0.0.1-{}".format(FAKE_PCLUSTER_VERSION), "0.0.2-{}".format(FAKE_PCLUSTER_VERSION)]
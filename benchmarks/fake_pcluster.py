@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+Stand in for the pcluster (2.x) cli, backed by the simulated clusters in fake_state
+
+Supports version, list, instances, create and delete, each call sleeps for $FAKE_PCLUSTER_LATENCY seconds
+(create sleeps for $FAKE_PCLUSTER_CREATE_LATENCY when not given --nowait) and is logged in the state directory.
+
+Usage (via the wrapper written by cli_benchmark.py):
+FAKE_STATE_DIR=/tmp/state pcluster list --region ap-southeast-2
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from fake_state import FakeState, FAKE_PCLUSTER_VERSION
+
+
+def get_args():
+    parser = argparse.ArgumentParser(prog="pcluster")
+    subparsers = parser.add_subparsers(dest="subcommand", required=True)
+
+    subparsers.add_parser("version")
+
+    list_parser = subparsers.add_parser("list")
+    list_parser.add_argument("--region")
+
+    instances_parser = subparsers.add_parser("instances")
+    instances_parser.add_argument("--region")
+    instances_parser.add_argument("cluster_name")
+
+    create_parser = subparsers.add_parser("create")
+    create_parser.add_argument("--config")
+    create_parser.add_argument("--cluster-template")
+    create_parser.add_argument("--extra-parameters")
+    create_parser.add_argument("--tags")
+    create_parser.add_argument("--norollback", action="store_true")
+    create_parser.add_argument("--nowait", action="store_true")
+    create_parser.add_argument("--region")
+    create_parser.add_argument("cluster_name")
+
+    delete_parser = subparsers.add_parser("delete")
+    delete_parser.add_argument("--region")
+    delete_parser.add_argument("cluster_name")
+
+    return parser.parse_args()
+
+
+def main():
+    fake_state = FakeState(os.environ["FAKE_STATE_DIR"])
+    fake_state.log_pcluster_call(sys.argv[1:])
+
+    args = get_args()
+
+    time.sleep(float(os.environ.get("FAKE_PCLUSTER_LATENCY", "0")))
+
+    if args.subcommand == "version":
+        print(FAKE_PCLUSTER_VERSION)
+
+    elif args.subcommand == "list":
+        for cluster_name, cluster in fake_state.read()["clusters"].items():
+            print("{:<30}  {:<24}  {}".format(cluster_name, cluster["status"], cluster["version"]))
+
+    elif args.subcommand == "instances":
+        cluster = fake_state.read()["clusters"].get(args.cluster_name)
+        if cluster is None:
+            print("ERROR: Stack with id parallelcluster-{} does not exist".format(args.cluster_name), file=sys.stderr)
+            sys.exit(1)
+        print("MasterServer         {}".format(cluster["head_node"]))
+
+    elif args.subcommand == "create":
+        tags = json.loads(args.tags) if args.tags is not None else {}
+        print("Beginning cluster creation for cluster: {}".format(args.cluster_name))
+        print("Creating stack named: parallelcluster-{}".format(args.cluster_name))
+        with fake_state.update() as state:
+            if args.cluster_name in state["clusters"]:
+                print("ERROR: Stack parallelcluster-{} already exists".format(args.cluster_name), file=sys.stderr)
+                sys.exit(1)
+            fake_state.add_cluster(state, args.cluster_name, tags.get("Creator", "benchmark"))
+        if not args.nowait:
+            time.sleep(float(os.environ.get("FAKE_PCLUSTER_CREATE_LATENCY", "0")))
+            print("Status: parallelcluster-{} - CREATE_COMPLETE".format(args.cluster_name))
+
+    elif args.subcommand == "delete":
+        with fake_state.update() as state:
+            if state["clusters"].pop(args.cluster_name, None) is None:
+                print("ERROR: Cluster {} doesn't exist".format(args.cluster_name), file=sys.stderr)
+                sys.exit(1)
+        print("Deleting: {}".format(args.cluster_name))
+        print("Cluster deleted successfully.")
+
+
+if __name__ == "__main__":
+    main()
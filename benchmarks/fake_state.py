@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+"""
+State of the simulated parallel clusters, shared by the fake pcluster executable and the fake aws backend
+
+Lives in <state-dir>/state.json, every change is made under an exclusive lock on <state-dir>/state.lock
+so concurrent 'pcluster create' processes don't trample each other.
+
+{
+  "clusters": {
+    "<cluster-name>": {"status": "CREATE_COMPLETE", "version": "2.10.3", "head_node": "i-...", "creator": "..."}
+  },
+  "instance_count": 0
+}
+"""
+
+import os
+import json
+import fcntl
+from pathlib import Path
+from contextlib import contextmanager
+
+STATE_FILE_NAME = "state.json"
+STATE_LOCK_FILE_NAME = "state.lock"
+PCLUSTER_CALLS_FILE_NAME = "pcluster_calls.log"
+
+# Version reported by the fake pcluster and stamped on each simulated cluster
+FAKE_PCLUSTER_VERSION = "2.10.3"
+
+
+class FakeState(object):
+    """
+    Read and update the simulated clusters
+    """
+
+    def __init__(self, state_dir):
+        self.state_dir = Path(state_dir)
+        self.state_path = self.state_dir / STATE_FILE_NAME
+        self.lock_path = self.state_dir / STATE_LOCK_FILE_NAME
+        # Cache of the last state read, and the (mtime, size) of the file it was read from
+        self._state = None
+        self._state_stat = None
+
+    @contextmanager
+    def locked(self):
+        with open(self.lock_path, 'a') as lock_h:
+            fcntl.flock(lock_h, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_h, fcntl.LOCK_UN)
+
+    def _read(self):
+        try:
+            state_stat = os.stat(self.state_path)
+        except FileNotFoundError:
+            return {"clusters": {}, "instance_count": 0}
+
+        state_stat = (state_stat.st_mtime_ns, state_stat.st_size)
+        if self._state is None or not state_stat == self._state_stat:
+            with open(self.state_path, 'r') as state_h:
+                self._state = json.load(state_h)
+            self._state_stat = state_stat
+
+        return self._state
+
+    def _write(self, state):
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with open(tmp_path, 'w') as state_h:
+            json.dump(state, state_h)
+        os.replace(tmp_path, self.state_path)
+        self._state = None
+
+    def read(self):
+        """
+        Current state, only re-read from disk when the file has changed
+        :return:
+        """
+
+        with self.locked():
+            return self._read()
+
+    @contextmanager
+    def update(self):
+        """
+        Change the state, i.e
+
+        with fake_state.update() as state:
+            state["clusters"].pop(cluster_name)
+        """
+
+        with self.locked():
+            state = json.loads(json.dumps(self._read()))
+            yield state
+            self._write(state)
+
+    def add_cluster(self, state, cluster_name, creator, status="CREATE_COMPLETE"):
+        """
+        Add a cluster, with a new head node, to a state being updated
+        :return:
+        """
+
+        state["instance_count"] += 1
+        state["clusters"][cluster_name] = {
+            "status": status,
+            "version": FAKE_PCLUSTER_VERSION,
+            "head_node": "i-{:017x}".format(state["instance_count"]),
+            "creator": creator
+        }
+
+    def seed(self, cluster_count, creator="benchmark", prefix="bench-"):
+        """
+        Start from cluster_count running clusters
+        :return: list of the cluster names
+        """
+
+        cluster_names = ["{}{:04d}".format(prefix, cluster_index) for cluster_index in range(cluster_count)]
+
+        with self.update() as state:
+            state["clusters"] = {}
+            for cluster_name in cluster_names:
+                self.add_cluster(state, cluster_name, creator)
+
+        return cluster_names
+
+    def log_pcluster_call(self, argv):
+        """
+        Record a call of the fake pcluster
+        :param argv:
+        :return:
+        """
+
+        with open(self.state_dir / PCLUSTER_CALLS_FILE_NAME, 'a') as calls_h:
+            calls_h.write(" ".join(argv) + "\n")
+
+    def get_pcluster_call_counts(self):
+        """
+        Number of calls of each pcluster subcommand
+        :return:
+        """
+
+        call_counts = {}
+
+        try:
+            with open(self.state_dir / PCLUSTER_CALLS_FILE_NAME, 'r') as calls_h:
+                for call_line in calls_h:
+                    subcommand = call_line.split(" ", 1)[0].strip()
+                    call_counts[subcommand] = call_counts.get(subcommand, 0) + 1
+        except FileNotFoundError:
+            pass
+
+        return call_counts
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+"""
+Measure how long it takes to import each of the cluster scripts
+
+Runs 'python -X importtime -c "import <script>"' in a fresh interpreter, which is what the user pays
+for every time they run a command, before any work is done.
+
+Exits non-zero if a script takes longer than the budget to import,
+or pulls in a module that should only ever be imported on demand (pandas / numpy).
+
+Usage:
+python benchmarks/import_time.py [--budget-ms 1000] [--repeats 3] [--top 10]
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+from pathlib import Path
+
+BIN_DIR = Path(__file__).absolute().parent.parent / "bin"
+
+DEFAULT_SCRIPTS = ["list_clusters", "start_cluster", "stop_cluster"]
+
+# Modules that must never be imported at start up
+FORBIDDEN_MODULES = ["pandas", "numpy"]
+
+# import time:       self [us] |  cumulative | imported package
+IMPORT_TIME_REGEX = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Benchmark the import time of the cluster scripts")
+    parser.add_argument("--scripts",
+                        nargs="+",
+                        default=DEFAULT_SCRIPTS,
+                        help="Scripts (module names under bin/) to import")
+    parser.add_argument("--budget-ms",
+                        type=float,
+                        default=1000,
+                        help="Fail if the best total import time of a script exceeds this many milliseconds")
+    parser.add_argument("--repeats",
+                        type=int,
+                        default=3,
+                        help="Number of times to import each script, the best run is reported")
+    parser.add_argument("--top",
+                        type=int,
+                        default=10,
+                        help="Number of slowest imports made by each script to show")
+    parser.add_argument("--json",
+                        help="Also write the results to this json file")
+    return parser.parse_args()
+
+
+def run_importtime(module_name):
+    """
+    Import a module in a fresh interpreter with -X importtime
+    :param module_name:
+    :return: list of (self_us, cumulative_us, depth, imported_module)
+    """
+
+    import_proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import {}".format(module_name)],
+                                 cwd=BIN_DIR,
+                                 env=dict(os.environ, PYTHONDONTWRITEBYTECODE="1"),
+                                 capture_output=True)
+
+    import_rows = []
+    for line in import_proc.stderr.decode().splitlines():
+        match_obj = IMPORT_TIME_REGEX.match(line)
+        if match_obj is None:
+            continue
+        self_us, cumulative_us, indent, imported_module = match_obj.groups()
+        # Each level of nesting adds two spaces to the indent
+        import_rows.append((int(self_us), int(cumulative_us), (len(indent) - 1) // 2, imported_module))
+
+    if not import_proc.returncode == 0:
+        print(import_proc.stderr.decode(), file=sys.stderr)
+        raise RuntimeError("Could not import {}".format(module_name))
+
+    return import_rows
+
+
+def summarise(module_name, import_rows, top):
+    """
+    Collect the total time, the slowest imports made by the script and any forbidden imports
+    :param module_name:
+    :param import_rows:
+    :param top:
+    :return:
+    """
+
+    top_level_rows = [row for row in import_rows if row[2] == 0]
+    # Modules imported directly by the script (or by site etc)
+    direct_rows = [row for row in import_rows if row[2] == 1]
+
+    imported_modules = set(row[3].split(".")[0] for row in import_rows)
+
+    return {
+        "script": module_name,
+        "total_ms": sum(row[1] for row in top_level_rows) / 1000,
+        "slowest": [{"module": row[3], "cumulative_ms": row[1] / 1000}
+                    for row in sorted(direct_rows, key=lambda row: row[1], reverse=True)[:top]],
+        "forbidden": sorted(imported_modules.intersection(FORBIDDEN_MODULES))
+    }
+
+
+def main():
+    args = get_args()
+
+    results = []
+    failed = False
+
+    for module_name in args.scripts:
+        summaries = [summarise(module_name, run_importtime(module_name), args.top)
+                     for _ in range(args.repeats)]
+        best = min(summaries, key=lambda summary: summary["total_ms"])
+        results.append(best)
+
+        print("{}: {:.1f} ms".format(module_name, best["total_ms"]))
+        for slow_import in best["slowest"]:
+            print("    {:<40} {:>8.1f} ms".format(slow_import["module"], slow_import["cumulative_ms"]))
+
+        if best["total_ms"] > args.budget_ms:
+            print("FAIL: {} took longer than the {} ms budget to import".format(module_name, args.budget_ms))
+            failed = True
+        if len(best["forbidden"]) > 0:
+            print("FAIL: {} imports {} at start up".format(module_name, ", ".join(best["forbidden"])))
+            failed = True
+
+    if args.json is not None:
+        with open(args.json, 'w') as json_h:
+            json.dump(results, json_h, indent=2)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
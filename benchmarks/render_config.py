@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""
+Measure how long it takes to render a pcluster configuration with many queues and compute resources
+
+Renders configurations for synthetic sets of queues, each with its own compute resources,
+offline and without touching aws, then writes each one to the content addressed store
+(twice, the second write should be a cache hit).
+
+Usage:
+python benchmarks/render_config.py [--queues 10 100 500] [--compute-resources-per-queue 4] [--repeats 5]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+BIN_DIR = Path(__file__).absolute().parent.parent / "bin"
+
+sys.path.insert(0, str(BIN_DIR))
+
+from umccr_utils.pcluster_config import render_pcluster_config, write_pcluster_config  # noqa: E402
+
+CONFIGURATION_INPUTS = {
+    "s3_config_root": "s3://bucket/parallel-cluster",
+    "ami_id": "ami-0123456789abcdef0",
+    "network": {
+        "vpc_id": "vpc-0123456789abcdef0",
+        "master_subnet_id": "subnet-0123456789abcdef0"
+    }
+}
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Benchmark rendering of the pcluster configuration")
+    parser.add_argument("--queues",
+                        nargs="+",
+                        type=int,
+                        default=[10, 100, 500],
+                        help="Numbers of queues to render configurations for")
+    parser.add_argument("--compute-resources-per-queue",
+                        type=int,
+                        default=4,
+                        help="Number of compute resources in each queue")
+    parser.add_argument("--repeats",
+                        type=int,
+                        default=5,
+                        help="Number of times to render each configuration, the best run is reported")
+    parser.add_argument("--json",
+                        help="Also write the results to this json file")
+    return parser.parse_args()
+
+
+def get_synthetic_queues(queue_count, compute_resources_per_queue):
+    """
+    Queues with their own compute resources, alternating between spot and on demand
+    :param queue_count:
+    :param compute_resources_per_queue:
+    :return: partition queues and compute resources, laid out as AWS_PARTITION_QUEUES and AWS_COMPUTE_RESOURCES
+    """
+
+    partition_queues = {}
+    compute_resources = {}
+
+    for queue_index in range(queue_count):
+        compute_resource_names = ["q{}_cr{}".format(queue_index, compute_resource_index)
+                                  for compute_resource_index in range(compute_resources_per_queue)]
+        partition_queues["queue-{}".format(queue_index)] = {
+            "compute_resource_settings": compute_resource_names,
+            "compute_type": "spot" if queue_index % 2 == 0 else "ondemand"
+        }
+        for compute_resource_name in compute_resource_names:
+            compute_resources[compute_resource_name] = {
+                "instance_type": "m5.4xlarge",
+                "max_count": "10"
+            }
+
+    return partition_queues, compute_resources
+
+
+def time_call(repeats, func, *args, **kwargs):
+    """
+    Best wall time in milliseconds of calling func repeats times
+    :return: best time, result of the last call
+    """
+
+    best_ms = None
+    result = None
+
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        best_ms = elapsed_ms if best_ms is None else min(best_ms, elapsed_ms)
+
+    return best_ms, result
+
+
+def main():
+    args = get_args()
+
+    # Keep the benchmark's configurations out of the user's cache
+    os.environ["XDG_CACHE_HOME"] = tempfile.mkdtemp(prefix="render_config_benchmark_")
+
+    results = []
+
+    for queue_count in args.queues:
+        partition_queues, compute_resources = get_synthetic_queues(queue_count, args.compute_resources_per_queue)
+
+        render_ms, pcluster_config_str = time_call(args.repeats, render_pcluster_config,
+                                                   cluster_name="benchmark",
+                                                   file_system_type="efs",
+                                                   configuration_inputs=CONFIGURATION_INPUTS,
+                                                   partition_queues=partition_queues,
+                                                   compute_resources=compute_resources)
+
+        first_write_ms, _ = time_call(1, write_pcluster_config, pcluster_config_str)
+        cached_write_ms, _ = time_call(args.repeats, write_pcluster_config, pcluster_config_str)
+
+        result = {
+            "queues": queue_count,
+            "compute_resources": len(compute_resources),
+            "config_kib": len(pcluster_config_str.encode()) / 1024,
+            "render_ms": render_ms,
+            "first_write_ms": first_write_ms,
+            "cached_write_ms": cached_write_ms
+        }
+        results.append(result)
+
+        print("{queues:>5} queues {compute_resources:>6} compute resources {config_kib:>8.1f} KiB: "
+              "render {render_ms:>8.2f} ms, write {first_write_ms:>6.2f} ms, "
+              "cached write {cached_write_ms:>6.2f} ms".format(**result))
+
+    if args.json is not None:
+        with open(args.json, 'w') as json_h:
+            json.dump(results, json_h, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+"""
+List the parallel cluster amis available to this account
+"""
+
+import argparse
+from umccr_utils.aws_wrappers import get_ami_catalog
+from umccr_utils.table import FixedWidthTableWriter
+from umccr_utils.logger import get_logger
+from umccr_utils.help import print_extended_help
+from umccr_utils.checks import check_env
+import sys
+
+logger = get_logger()
+
+AMI_COLUMNS = ["Version", "ImageId", "CreationDate", "Name"]
+AMI_COLUMN_WIDTHS = [20, 21, 24, 40]
+
+
+def get_args():
+    """
+    Get arguments from CLI
+    :return:
+    """
+
+    parser = argparse.ArgumentParser(description="List the latest parallel cluster ami for each version")
+
+    parser.add_argument("--refresh",
+                        help="Rebuild the ami catalog from ec2 rather than using the local cache",
+                        action="store_true",
+                        default=False)
+
+    parser.add_argument("--no-cache",
+                        help="Ignore locally cached lookups (env checks, ssm parameters, amis) and run them again",
+                        action="store_true",
+                        default=False)
+
+    parser.add_argument("--help-ext",
+                        help="Print the extended help",
+                        action="store_true",
+                        required=False)
+
+    args = parser.parse_args()
+
+    return args
+
+
+def print_ami_catalog(ami_catalog):
+    """
+    Print the catalog, newest versions first
+    :param ami_catalog:
+    :return:
+    """
+
+    table_writer = FixedWidthTableWriter(columns=AMI_COLUMNS, column_widths=AMI_COLUMN_WIDTHS)
+
+    table_writer.write_header()
+
+    for image_version, image in sorted(ami_catalog.items(),
+                                       key=lambda catalog_item: catalog_item[1]["CreationDate"],
+                                       reverse=True):
+        table_writer.write_row([image_version, image["ImageId"], image["CreationDate"], image["Name"]])
+
+    # Print an empty line to finish
+    print()
+
+
+def main():
+
+    # Print extended help
+    if "--help-ext" in sys.argv:
+        print_extended_help()
+        sys.exit(0)
+
+    # Get args
+    args = get_args()
+
+    # Check the environment
+    check_env(use_cache=not args.no_cache)
+
+    ami_catalog = get_ami_catalog(refresh=args.refresh or args.no_cache)
+
+    if len(ami_catalog) == 0:
+        logger.info("No parallel cluster amis found")
+        sys.exit(0)
+
+    print_ami_catalog(ami_catalog)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,21 +4,34 @@
 List available clusters
 """
 
-import pandas as pd
-import numpy as np
+import time
+import glob
 import argparse
-from umccr_utils.aws_wrappers import check_credentials, get_master_ec2_instance_id_from_pcluster_id
-from umccr_utils.miscell import run_subprocess_proc
+from botocore.exceptions import ClientError, BotoCoreError
+from umccr_utils.aws_wrappers import check_credentials, get_parallel_cluster_records
+from umccr_utils.clusters import resolve_head_nodes, resolve_creators, get_cluster_changes, iter_head_nodes, \
+    set_creators_from_stack_tags, filter_cluster_records, get_cluster_records_without_head_nodes
+from umccr_utils.cluster_records import CLUSTER_COLUMNS
+from umccr_utils.table import FixedWidthTableWriter, get_table_writer, TABLE_FORMATS
 from umccr_utils.logger import get_logger
-from umccr_utils.globals import AWS_REGION, CFN_STATUSES
+from umccr_utils.globals import DEFAULT_MAX_WORKERS, PCLUSTER_BACKENDS, DEFAULT_PCLUSTER_BACKEND, CFN_STATUSES
 from umccr_utils.help import print_extended_help
+from umccr_utils.profiling import start_profiling
 from umccr_utils.checks import check_env
-import boto3
 import sys
 
 
 logger = get_logger()
 
+# Seconds between listings with --watch, if no interval is given
+WATCH_DEFAULT_INTERVAL = 30
+
+# Extra columns, ahead of CLUSTER_COLUMNS, of the table printed with --watch
+WATCH_COLUMNS = [
+    ("Time", 8),
+    ("Change", 8)
+]
+
 
 def get_args():
     """
@@ -29,13 +42,82 @@ def get_args():
 
     parser = argparse.ArgumentParser(description="List the currently running clusters")
 
+    parser.add_argument("--no-cache",
+                        help="Ignore locally cached lookups (env checks, ssm parameters, amis) and run them again",
+                        action="store_true",
+                        default=False)
+
+    parser.add_argument("--profile",
+                        help="Write a chrome trace (chrome://tracing) of where the time was spent to this file",
+                        required=False)
+
     parser.add_argument("--help-ext",
                         help="Print the extended help",
                         action="store_true",
                         required=False)
 
+    parser.add_argument("--max-workers",
+                        help="Maximum number of head node lookups to run at once",
+                        type=int,
+                        default=DEFAULT_MAX_WORKERS,
+                        required=False)
+
+    parser.add_argument("--backend",
+                        help="Read clusters from cloudformation directly (cfn) or through the pcluster cli (cli)",
+                        choices=PCLUSTER_BACKENDS,
+                        default=DEFAULT_PCLUSTER_BACKEND,
+                        required=False)
+
+    parser.add_argument("--creator",
+                        help="Only list clusters created by these users",
+                        nargs="+",
+                        required=False)
+
+    parser.add_argument("--status",
+                        help="Only list clusters with these stack statuses, or status groups ({})".format(
+                            ", ".join(CFN_STATUSES.keys())),
+                        nargs="+",
+                        required=False)
+
+    parser.add_argument("--name-prefix",
+                        help="Only list clusters whose name starts with this prefix",
+                        required=False)
+
+    parser.add_argument("--format",
+                        help="Output format. csv, json and jsonl rows are written as soon as each cluster is resolved, "
+                             "parquet requires pandas",
+                        choices=TABLE_FORMATS + ["parquet"],
+                        default="table",
+                        required=False)
+
+    parser.add_argument("--output",
+                        help="File to write csv / json / jsonl / parquet output to, defaults to stdout",
+                        required=False)
+
+    parser.add_argument("--watch",
+                        help="Keep listing the clusters every WATCH seconds (default {}), "
+                             "printing only the clusters that are new, removed or have changed status".format(
+                                WATCH_DEFAULT_INTERVAL),
+                        nargs="?",
+                        type=float,
+                        const=WATCH_DEFAULT_INTERVAL,
+                        default=None,
+                        required=False)
+
     args = parser.parse_args()
 
+    if args.max_workers < 1:
+        parser.error("--max-workers must be a positive integer")
+
+    if args.watch is not None:
+        if args.watch <= 0:
+            parser.error("--watch interval must be a positive number of seconds")
+        if not args.format == "table":
+            parser.error("--watch can only be used with --format table")
+
+    if args.output is not None and args.format == "table":
+        parser.error("--output can only be used with --format csv, json, jsonl or parquet")
+
     return args
 
 
@@ -48,96 +130,213 @@ def complete_checks():
     check_credentials()
 
 
-def get_cluster_list():
+def get_cluster_list(backend=DEFAULT_PCLUSTER_BACKEND, exit_if_empty=True):
     """
-    Read in cluster list as pandas dataframe
+    Read in cluster list as a list of cluster records
+    :param backend:
+    :param exit_if_empty: Exit straight away if there are no clusters,
+    set to False to carry on and write an empty csv / json / jsonl / parquet
     :return:
     """
 
-    cluster_list_command = ["pcluster", "list",
-                            "--region", AWS_REGION]
+    cluster_records = get_parallel_cluster_records(backend=backend)
 
-    cluster_list_returncode, cluster_list_stdout, cluster_list_stderr = run_subprocess_proc(cluster_list_command,
-                                                                                            capture_output=True)
-
-    cluster_columns = ["Name", "Status", "Version"]
-
-    if cluster_list_stdout is not None and not cluster_list_stdout.strip() == "":
-        clusters_as_df = pd.DataFrame([row.split()
-                                       for row in cluster_list_stdout.strip().split("\n")],
-                                      columns=cluster_columns)
-    else:
+    if len(cluster_records) == 0:
         logger.info("No clusters found")
-        sys.exit(0)
+        if exit_if_empty:
+            sys.exit(0)
 
-    return clusters_as_df
+    return cluster_records
 
 
-def get_creator_tag(master_id):
+def print_table(cluster_records):
     """
-    Retrieve the Creator tag from the master instance id tags
+    Print the table of available clusters
     :return:
     """
-    resource = boto3.resource("ec2")
 
-    ec2instance = resource.Instance(master_id)
+    table_writer = FixedWidthTableWriter(columns=[column for column, _, _ in CLUSTER_COLUMNS],
+                                         column_widths=[width for _, _, width in CLUSTER_COLUMNS])
+
+    table_writer.write_header()
 
-    # Check "tags" is an attribute of the instance.
-    if getattr(ec2instance, "tags", None) is None:
-        return None
+    for cluster_record in cluster_records:
+        table_writer.write_row(cluster_record.to_row())
 
-    # Iterate through the list of tags
-    for tag in ec2instance.tags:
-        if tag["Key"] == "Creator":
-            return tag["Value"]
-    # Found nothing, return
-    return None
+    # Print an empty line to finish
+    print()
 
 
-def print_df(cluster_df):
+def write_with_pandas(cluster_records, output_format, output_path=None):
     """
-    Print the dataframe of available clusters
+    Write the clusters out as parquet through pandas
+    pandas is only imported here so that it isn't needed for any other output
+    :param cluster_records:
+    :param output_format: parquet
+    :param output_path: None to write to stdout
     :return:
     """
-    import sys
 
-    cluster_df.to_string(sys.stdout, index=False, header=True)
-    # Print an empty line to finish
-    print()
+    try:
+        import pandas as pd
+    except ImportError:
+        logger.error("pandas is required for --format {}, please install it first".format(output_format))
+        sys.exit(1)
+
+    cluster_df = pd.DataFrame([cluster_record.to_dict() for cluster_record in cluster_records],
+                              columns=[column for column, _, _ in CLUSTER_COLUMNS])
 
+    cluster_df.to_parquet(output_path if output_path is not None else sys.stdout.buffer, index=False)
 
-def get_headnode_from_pcluster_row(pd_series):
+
+def stream_records(cluster_records, output_format, output_path=None,
+                   max_workers=DEFAULT_MAX_WORKERS, backend=DEFAULT_PCLUSTER_BACKEND):
     """
-    From the cluster list collect the id of the head node, given the pcluster has completed
-    :param pd_series:
+    Write each cluster out as soon as its head node and creator are known, in the order they resolve.
+    Creators come from the stack tags where possible,
+    clusters that have to fall back to their head node's tags are written at the end, after one batched lookup
+    :param cluster_records:
+    :param output_format: csv, json or jsonl
+    :param output_path: None to write to stdout
+    :param max_workers:
+    :param backend:
     :return:
     """
 
-    if pd_series['Status'] in CFN_STATUSES["completed"]:
-        return get_master_ec2_instance_id_from_pcluster_id(pd_series["Name"])
+    output_h = open(output_path, 'w', newline="") if output_path is not None else sys.stdout
+
+    try:
+        table_writer = get_table_writer(output_format,
+                                        columns=[column for column, _, _ in CLUSTER_COLUMNS],
+                                        column_widths=[width for _, _, width in CLUSTER_COLUMNS],
+                                        stream=output_h)
+
+        table_writer.write_header()
+
+        set_creators_from_stack_tags(cluster_records)
+
+        cluster_records_without_creators = []
+
+        for cluster_record in iter_head_nodes(cluster_records, max_workers=max_workers, backend=backend):
+            if cluster_record.creator is None and cluster_record.head_node is not None:
+                cluster_records_without_creators.append(cluster_record)
+            else:
+                table_writer.write_row(cluster_record.to_row())
+
+        resolve_creators(cluster_records_without_creators)
 
-    return np.nan
+        for cluster_record in cluster_records_without_creators:
+            table_writer.write_row(cluster_record.to_row())
 
+        table_writer.write_footer()
+    finally:
+        if output_path is not None:
+            output_h.close()
 
-def get_creator_from_head_node_tag(pd_series):
+
+def resolve_cluster_details(cluster_records, max_workers=DEFAULT_MAX_WORKERS, backend=DEFAULT_PCLUSTER_BACKEND):
     """
-    From the cluster list collect the id of the head node, given the pcluster has completed
-    :param pd_series:
+    Add the head node and creator of each cluster
+    Creators are read from the stack tags, falling back to the head node's tags
+    :param cluster_records: list of ClusterRecords, updated in place
+    :param max_workers:
+    :param backend:
     :return:
     """
 
-    # Check head node exists Head node
-    if not pd.isna(pd_series["Head Node"]):
-        creator = get_creator_tag(pd_series["Head Node"])
-    else:
-        # Return NA if no head node
-        return np.nan
+    # Add head nodes
+    resolve_head_nodes(cluster_records,
+                       max_workers=max_workers,
+                       backend=backend)
+
+    # Add creators, from the stack tags where we can
+    resolve_creators(set_creators_from_stack_tags(cluster_records))
+
 
-    # Check creator also isn't none
-    if creator is not None:
-        return creator
+def watch_clusters(interval, name_patterns=None, creators=None, statuses=None,
+                   max_workers=DEFAULT_MAX_WORKERS, backend=DEFAULT_PCLUSTER_BACKEND):
+    """
+    List the clusters every interval seconds until interrupted.
+    Each listing only reads the stack statuses, the head node and creator are only looked up again
+    for clusters that are new or whose status has changed, and only those clusters are printed.
+    Completed clusters still without a head node are looked up again each time and printed once found.
+    A listing that fails with an aws error is logged and tried again after the next interval
+    :param interval:
+    :param name_patterns: Only watch clusters matching these globs
+    :param creators: Only watch clusters created by these users
+    :param statuses: Only watch clusters with these statuses
+    :param max_workers:
+    :param backend:
+    :return:
+    """
 
-    return np.nan
+    table_writer = FixedWidthTableWriter(
+        columns=[column for column, _ in WATCH_COLUMNS] + [column for column, _, _ in CLUSTER_COLUMNS],
+        column_widths=[width for _, width in WATCH_COLUMNS] + [width for _, _, width in CLUSTER_COLUMNS]
+    )
+
+    table_writer.write_header()
+
+    cluster_records = []
+    is_first_listing = True
+
+    try:
+        while True:
+            try:
+                current_cluster_records = get_parallel_cluster_records(backend=backend)
+
+                if name_patterns is not None or statuses is not None:
+                    current_cluster_records = filter_cluster_records(current_cluster_records,
+                                                                     name_patterns=name_patterns, statuses=statuses)
+
+                added_cluster_records, removed_cluster_records, changed_cluster_records = \
+                    get_cluster_changes(cluster_records, current_cluster_records)
+
+                # Unchanged clusters whose head node lookup failed last time round are looked up again
+                looked_up_names = set(cluster_record.name
+                                      for cluster_record in added_cluster_records + changed_cluster_records)
+                unchanged_cluster_records = [cluster_record for cluster_record in current_cluster_records
+                                             if cluster_record.name not in looked_up_names]
+                updated_cluster_records = get_cluster_records_without_head_nodes(unchanged_cluster_records)
+
+                resolve_cluster_details(added_cluster_records + changed_cluster_records + updated_cluster_records,
+                                        max_workers=max_workers, backend=backend)
+
+                # Only show those that have now been found
+                updated_cluster_records = [cluster_record for cluster_record in updated_cluster_records
+                                           if cluster_record.head_node is not None]
+            except (ClientError, BotoCoreError) as aws_error:
+                # Keep the last listing, so any changes missed here are picked up next time
+                logger.warning("Could not list the clusters, trying again in {} seconds: {}".format(
+                    interval, aws_error))
+                time.sleep(interval)
+                continue
+
+            if creators is not None:
+                # Creators don't change, so clusters filtered out here will be filtered out again next time
+                added_cluster_records, removed_cluster_records, changed_cluster_records, updated_cluster_records = [
+                    [cluster_record for cluster_record in change_cluster_records
+                     if cluster_record.creator in creators]
+                    for change_cluster_records in
+                    [added_cluster_records, removed_cluster_records, changed_cluster_records, updated_cluster_records]
+                ]
+
+            tick_time = time.strftime("%H:%M:%S")
+
+            for change, change_cluster_records in [("listed" if is_first_listing else "new", added_cluster_records),
+                                                   ("changed", changed_cluster_records),
+                                                   ("updated", updated_cluster_records),
+                                                   ("removed", removed_cluster_records)]:
+                for cluster_record in change_cluster_records:
+                    table_writer.write_row([tick_time, change] + cluster_record.to_row())
+
+            cluster_records = current_cluster_records
+            is_first_listing = False
+
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        # Print an empty line to finish
+        print()
 
 
 def main():
@@ -148,23 +347,52 @@ def main():
         sys.exit(0)
 
     # Get args
-    _ = get_args()
+    args = get_args()
 
-    # Check the environment
-    check_env()
-
-    # Get the cluster df
-    cluster_df = get_cluster_list()
-
-    # Add Master column
-    cluster_df["Head Node"] = cluster_df.apply(get_headnode_from_pcluster_row,
-                                                axis="columns")
+    if args.profile is not None:
+        start_profiling(args.profile)
 
-    # Add Creator column
-    cluster_df["Creator"] = cluster_df.apply(get_creator_from_head_node_tag,
-                                             axis="columns")
-
-    print_df(cluster_df)
+    # Check the environment
+    check_env(use_cache=not args.no_cache)
+
+    name_patterns = [glob.escape(args.name_prefix) + "*"] if args.name_prefix is not None else None
+
+    if args.watch is not None:
+        watch_clusters(args.watch, name_patterns=name_patterns, creators=args.creator, statuses=args.status,
+                       max_workers=args.max_workers, backend=args.backend)
+        return
+
+    # Scripts reading csv / json / jsonl / parquet still get a header or an empty list when nothing is found
+    is_table_format = args.format == "table"
+
+    # Get the cluster records
+    cluster_records = get_cluster_list(backend=args.backend, exit_if_empty=is_table_format)
+
+    # Filter before looking up any head nodes
+    if name_patterns is not None or args.creator is not None or args.status is not None:
+        cluster_records = filter_cluster_records(cluster_records,
+                                                 name_patterns=name_patterns,
+                                                 creators=args.creator,
+                                                 statuses=args.status,
+                                                 max_workers=args.max_workers,
+                                                 backend=args.backend)
+        if len(cluster_records) == 0:
+            logger.info("No clusters matched")
+            if is_table_format:
+                return
+
+    if args.format in ["csv", "json", "jsonl"]:
+        stream_records(cluster_records, args.format, output_path=args.output,
+                       max_workers=args.max_workers, backend=args.backend)
+        return
+
+    # Add head nodes and creators
+    resolve_cluster_details(cluster_records, max_workers=args.max_workers, backend=args.backend)
+
+    if args.format == "table":
+        print_table(cluster_records)
+    else:
+        write_with_pandas(cluster_records, args.format, output_path=args.output)
 
 
 if __name__ == "__main__":
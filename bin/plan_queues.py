@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+"""
+Plan the instance types behind each queue from a workload profile
+"""
+
+import argparse
+from umccr_utils.queue_planner import get_workload_queues, plan_queue, get_current_queue_placements, \
+    get_step_placements, get_queue_plan, write_queue_plan, MAX_QUEUE_COMPUTE_RESOURCES
+from umccr_utils.instance_catalog import INSTANCE_CATALOG, INSTANCE_CATALOG_REGION, INSTANCE_CATALOG_SNAPSHOT_DATE
+from umccr_utils.table import FixedWidthTableWriter
+from umccr_utils.logger import get_logger, initialise_logger
+from umccr_utils.help import print_extended_help
+from umccr_utils.errors import QueuePlanError
+import sys
+
+initialise_logger()
+
+logger = get_logger()
+
+# Display name and width of each column of the plan
+PLAN_COLUMNS = [
+    ("Queue", 14),
+    ("Step", 16),
+    ("Instance", 13),
+    ("Jobs/Node", 9),
+    ("Nodes", 5),
+    ("CPU %", 5),
+    ("Mem %", 5),
+    ("Cost ($)", 8),
+    ("Core h/$", 8)
+]
+
+# Display name and width of each column of the cost comparison
+SUMMARY_COLUMNS = [
+    ("Queue", 14),
+    ("Current", 30),
+    ("Current ($)", 11),
+    ("Planned", 40),
+    ("Planned ($)", 11)
+]
+
+
+def get_args():
+    """
+    Get arguments from CLI
+    :return:
+    """
+
+    parser = argparse.ArgumentParser(description="Recommend the instance types behind each queue for a workload")
+
+    parser.add_argument("--workload",
+                        help="yaml or json profile of the steps run on each queue, see --help-ext",
+                        required=True)
+
+    parser.add_argument("--output",
+                        help="Write the plan as json to this file, for start_cluster.py --queue-plan",
+                        required=False)
+
+    parser.add_argument("--instance-types",
+                        help="Only consider these instance types, defaults to the whole catalog",
+                        nargs="+",
+                        choices=sorted(INSTANCE_CATALOG.keys()),
+                        metavar="INSTANCE_TYPE",
+                        required=False)
+
+    parser.add_argument("--max-compute-resources",
+                        help="Most instance types to put behind one queue",
+                        type=int,
+                        default=MAX_QUEUE_COMPUTE_RESOURCES,
+                        required=False)
+
+    parser.add_argument("--top",
+                        help="Also print the cheapest TOP instance types for each step",
+                        type=int,
+                        default=0,
+                        required=False)
+
+    parser.add_argument("--help-ext",
+                        help="Print the extended help",
+                        action="store_true",
+                        required=False)
+
+    args = parser.parse_args()
+
+    if not 1 <= args.max_compute_resources <= MAX_QUEUE_COMPUTE_RESOURCES:
+        parser.error("--max-compute-resources must be between 1 and {}".format(MAX_QUEUE_COMPUTE_RESOURCES))
+
+    if args.top < 0:
+        parser.error("--top must not be negative")
+
+    return args
+
+
+def get_placement_row(queue_name, placement):
+    """
+    Values of the PLAN_COLUMNS for a placement
+    :param queue_name:
+    :param placement:
+    :return:
+    """
+
+    return [
+        queue_name,
+        placement["step"],
+        placement["instance_type"],
+        placement["jobs_per_node"],
+        placement["nodes"],
+        "{:.0f}".format(placement["cpu_efficiency"] * 100),
+        "{:.0f}".format(placement["memory_efficiency"] * 100),
+        "{:.2f}".format(placement["cost"]),
+        "{:.1f}".format(placement["core_hours_per_dollar"])
+    ]
+
+
+def get_placements_cost(placements):
+    """
+    Total cost of a list of placements, None if the queue can't run them
+    :param placements:
+    :return:
+    """
+
+    if placements is None:
+        return None
+
+    return sum(placement["cost"] for placement in placements)
+
+
+def print_plan(workload_queues, queue_placements, top=0, instance_types=None):
+    """
+    Print how each step is placed, then the cost of each queue now against the plan
+    :param workload_queues:
+    :param queue_placements: dict of queue name to placements
+    :param top: also print the cheapest top instance types for each step
+    :param instance_types:
+    :return:
+    """
+
+    plan_writer = FixedWidthTableWriter(columns=[column for column, _ in PLAN_COLUMNS],
+                                        column_widths=[width for _, width in PLAN_COLUMNS])
+
+    plan_writer.write_header()
+
+    for queue_name, placements in queue_placements.items():
+        for placement in placements:
+            plan_writer.write_row(get_placement_row(queue_name, placement))
+
+    if top > 0:
+        print()
+        print("Cheapest {} instance types for each step".format(top))
+        plan_writer.write_header()
+        for queue_name, workload_queue in workload_queues.items():
+            for step in workload_queue["steps"]:
+                for placement in get_step_placements(step, workload_queue["compute_type"],
+                                                     instance_types=instance_types)[:top]:
+                    plan_writer.write_row(get_placement_row(queue_name, placement))
+
+    print()
+
+    summary_writer = FixedWidthTableWriter(columns=[column for column, _ in SUMMARY_COLUMNS],
+                                           column_widths=[width for _, width in SUMMARY_COLUMNS])
+
+    summary_writer.write_header()
+
+    for queue_name, placements in queue_placements.items():
+        current_placements = get_current_queue_placements(queue_name, workload_queues[queue_name])
+        current_cost = get_placements_cost(current_placements)
+        summary_writer.write_row([
+            queue_name,
+            ", ".join(sorted(set(placement["instance_type"] for placement in current_placements)))
+            if current_placements is not None else None,
+            "{:.2f}".format(current_cost) if current_cost is not None else None,
+            ", ".join(sorted(set(placement["instance_type"] for placement in placements))),
+            "{:.2f}".format(get_placements_cost(placements))
+        ])
+
+    print()
+    print("Prices are a snapshot of {} taken {}".format(INSTANCE_CATALOG_REGION, INSTANCE_CATALOG_SNAPSHOT_DATE))
+
+
+def main():
+
+    # Print extended help
+    if "--help-ext" in sys.argv:
+        print_extended_help()
+        sys.exit(0)
+
+    # Get args
+    args = get_args()
+
+    try:
+        workload_queues = get_workload_queues(args.workload)
+        queue_placements = {
+            queue_name: plan_queue(queue_name, workload_queue,
+                                   instance_types=args.instance_types,
+                                   max_compute_resources=args.max_compute_resources)
+            for queue_name, workload_queue in workload_queues.items()
+        }
+    except QueuePlanError:
+        sys.exit(1)
+
+    print_plan(workload_queues, queue_placements, top=args.top, instance_types=args.instance_types)
+
+    if args.output is not None:
+        write_queue_plan(get_queue_plan(workload_queues, queue_placements), args.output)
+        logger.info("Wrote queue plan to \"{}\", launch with start_cluster.py --queue-plan {}".format(
+            args.output, args.output
+        ))
+
+
+if __name__ == "__main__":
+    main()
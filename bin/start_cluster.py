@@ -7,26 +7,39 @@ Start a cluster
 # Imports
 import argparse
 import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from json.decoder import JSONDecodeError
 from umccr_utils.logger import get_logger, initialise_logger
 from umccr_utils.aws_wrappers import get_master_ec2_instance_id_from_pcluster_id, get_aws_account_name, \
-    get_parallel_cluster_s3_path, get_ami_id, get_ami_version_str, get_parallel_cluster_tags
-from umccr_utils.version import version as umccr_version
-import tempfile
+    resolve_ssm_parameter_keys, get_ami_id, get_ami_version_str, get_parallel_cluster_tags, \
+    get_parallel_cluster_stack_name
+from umccr_utils.stack_monitor import wait_for_stack_creation
+from umccr_utils.manifest import get_manifest_clusters
+from umccr_utils.table import FixedWidthTableWriter
+from umccr_utils.pcluster_config import render_pcluster_config, write_pcluster_config
+from umccr_utils.queue_planner import read_queue_plan
 from umccr_utils.checks import check_env
 from umccr_utils.miscell import json_to_str, run_subprocess_proc
 from umccr_utils.help import print_extended_help
-from umccr_utils.errors import PClusterCreateError
-import configparser
-from umccr_utils.globals import \
-    AWS_GLOBAL_SETTINGS, AWS_REGION, AWS_CLUSTER_BASICS, AWS_SSM_PARAMETER_KEYS, AWS_NETWORK, \
-    AWS_PARTITION_QUEUES, AWS_FILESYSTEM, AWS_COMPUTE_RESOURCES, AWS_ALIASES
+from umccr_utils.profiling import start_profiling, profiled
+from umccr_utils.errors import PClusterCreateError, PClusterInstanceError, ManifestError, QueuePlanError
+from umccr_utils.globals import AWS_NETWORK, PCLUSTER_BACKENDS, DEFAULT_PCLUSTER_BACKEND, DEFAULT_MAX_WORKERS
 import sys
 
 initialise_logger()
 
 logger = get_logger()
 
+# Display name and width of each column of the status table printed when launching from a manifest
+LAUNCH_COLUMNS = [
+    ("Name", 30),
+    ("Status", 24),
+    ("Head Node", 21),
+    ("Elapsed", 10)
+]
+
 
 def get_args():
     """
@@ -36,9 +49,13 @@ def get_args():
 
     parser = argparse.ArgumentParser(description="Start up a parallel cluster")
 
-    parser.add_argument("--cluster-name",
-                        help="Name of the cluster you would like to launch",
-                        required=True)
+    cluster_group = parser.add_mutually_exclusive_group(required=True)
+
+    cluster_group.add_argument("--cluster-name",
+                               help="Name of the cluster you would like to launch")
+
+    cluster_group.add_argument("--manifest",
+                               help="yaml or json file of clusters to launch side by side, see --help-ext")
 
     parser.add_argument("--file-system-type",
                         help="The type of file system to use for the cluster",
@@ -58,6 +75,61 @@ def get_args():
                         help="json-as-str key-pair values for tags to be used.",
                         required=False)
 
+    parser.add_argument("--queue-plan",
+                        help="json file of queues and compute resources written by plan_queues.py, "
+                             "used in place of the default queues",
+                        required=False)
+
+    parser.add_argument("--log-file",
+                        help="Append the full output of the pcluster create command to this file. "
+                             "With --manifest, each cluster appends to <log-file>.<cluster-name>",
+                        required=False)
+
+    parser.add_argument("--max-workers",
+                        help="Maximum number of clusters to create at once when using --manifest",
+                        type=int,
+                        default=DEFAULT_MAX_WORKERS,
+                        required=False)
+
+    parser.add_argument("--backend",
+                        help="Follow the creation and find the head node through cloudformation directly (cfn) "
+                             "or through the pcluster cli (cli)",
+                        choices=PCLUSTER_BACKENDS,
+                        default=DEFAULT_PCLUSTER_BACKEND)
+
+    wait_group = parser.add_mutually_exclusive_group()
+
+    wait_group.add_argument("--wait",
+                            help="Follow the stack events until the cluster has been created (default)",
+                            dest="wait",
+                            action="store_true",
+                            default=True)
+
+    wait_group.add_argument("--no-wait",
+                            help="Return as soon as the cluster creation has been submitted",
+                            dest="wait",
+                            action="store_false")
+
+    parser.add_argument("--attach",
+                        help="Don't create anything, just follow a cluster that is already being created",
+                        action="store_true",
+                        default=False)
+
+    parser.add_argument("--dry-run",
+                        help="Print the configuration that would be used to create the cluster(s) and exit, "
+                             "aws is only called for lookups that aren't in the local cache",
+                        action="store_true",
+                        default=False)
+
+    parser.add_argument("--no-cache",
+                        help="Ignore locally cached lookups (env checks, ssm parameters, amis) and run them again",
+                        action="store_true",
+                        default=False)
+
+    parser.add_argument("--profile",
+                        help="Write a chrome trace (chrome://tracing) of where the time was spent to this file",
+                        required=False)
+
     parser.add_argument("--help-ext",
                         help="Print extended help",
                         action="store_true",
@@ -65,6 +137,18 @@ def get_args():
 
     args = parser.parse_args()
 
+    if args.backend == "cli" and (args.attach or not args.wait):
+        parser.error("--attach and --no-wait require the cfn backend")
+
+    if args.manifest is not None and args.attach:
+        parser.error("--attach can only be used with --cluster-name")
+
+    if args.dry_run and args.attach:
+        parser.error("--dry-run has nothing to print when attaching to a cluster")
+
+    if args.max_workers < 1:
+        parser.error("--max-workers must be a positive integer")
+
     return args
 
 
@@ -95,6 +179,18 @@ def set_args(args):
     # Append tag_parameters_json to tags
     setattr(args, "tags_json", get_parallel_cluster_tags(getattr(args, "tag_parameters_json", {})))
 
+    # Read the queues and compute resources planned by plan_queues.py
+    if getattr(args, "queue_plan", None) is not None:
+        try:
+            partition_queues, compute_resources = read_queue_plan(args.queue_plan)
+        except QueuePlanError:
+            sys.exit(1)
+        setattr(args, "partition_queues", partition_queues)
+        setattr(args, "compute_resources", compute_resources)
+    else:
+        setattr(args, "partition_queues", None)
+        setattr(args, "compute_resources", None)
+
     return args
 
 
@@ -109,13 +205,15 @@ def str_to_json(json_str):
     return json_obj
 
 
-def collate_pcluster_create_cli(cluster_name, configuration_file, extra_parameters=None, tags=None, no_rollback=False):
+def collate_pcluster_create_cli(cluster_name, configuration_file, extra_parameters=None, tags=None, no_rollback=False,
+                                no_wait=False):
     """
     Import options to create the pcluster create command
+    :param no_wait: Have pcluster return as soon as the stack creation has been submitted
     :return:
     """
     pcluster_create_command = ["pcluster", "create",
-                               "--config", configuration_file.name,
+                               "--config", str(configuration_file),
                                "--cluster-template", cluster_name]
 
     if extra_parameters is not None:
@@ -127,98 +225,70 @@ def collate_pcluster_create_cli(cluster_name, configuration_file, extra_paramete
     if no_rollback:
         pcluster_create_command.append("--norollback")
 
+    if no_wait:
+        pcluster_create_command.append("--nowait")
+
     pcluster_create_command.append(cluster_name)
 
     return pcluster_create_command
 
 
-def create_configuration_file(args):
+@profiled()
+def resolve_configuration_inputs(args):
     """
-    Given the arguments, on the cli, create the config required for the cluster to be built
-
-    Configuration requires the following components
-    * aws
-    * global
-    * cluster <cluster-name>
-    * vpc <network-name>
-    * <filesystem-type> <filesystem-name>
-    * queue <queue-name> (can be specified multiple times)
-    * compute_resource <resource-name> (can be specified multiple times)
-    * aliases (optional)
-    :return:
+    Collect everything the configuration needs to look up in AWS
+    None of these depend on the cluster itself, so they can be shared when launching many clusters
+    :return: dict with s3_config_root, ami_id and network keys
     """
 
-    configuration_temp_file = tempfile.NamedTemporaryFile(prefix="pcluster-{}".format(getattr(args, "cluster_name", "")),
-                                                          suffix=".conf",
-                                                          delete=False)
+    use_cache = not getattr(args, "no_cache", False)
 
-    pcluster_config = configparser.ConfigParser()
+    # Collect all of the ssm parameters we need in one go
+    ssm_parameters = resolve_ssm_parameter_keys(use_cache=use_cache)
 
-    # Add aws and globals settings
-    pcluster_config["aws"] = {"aws_region_name": AWS_REGION}
-    pcluster_config["globals"] = AWS_GLOBAL_SETTINGS
+    return {
+        "s3_config_root": ssm_parameters["s3_config_root"],
+        "ami_id": get_ami_id(get_ami_version_str(), refresh=not use_cache),
+        "network": AWS_NETWORK[get_aws_account_name()]["network"]
+    }
 
-    # Intialise cluster
-    cluster_basics = AWS_CLUSTER_BASICS.copy()
-    # Add pre-install and post-install attributes
-    cluster_basics["pre_install"] = "{}/{}/bootstrap/pre_install.sh".format(
-        get_parallel_cluster_s3_path(AWS_SSM_PARAMETER_KEYS["s3_config_root"]),
-        umccr_version
-    )
-    cluster_basics["post_install"] = "{}/{}/bootstrap/post_install.sh".format(
-        get_parallel_cluster_s3_path(AWS_SSM_PARAMETER_KEYS["s3_config_root"]),
-        umccr_version
-    )
 
-    # Add ami
-    cluster_basics["custom_ami"] = get_ami_id(get_ami_version_str())
-    pcluster_config["cluster {}".format(args.cluster_name)] = cluster_basics
-
-    # Add in network settings:
-    pcluster_config["vpc {}_network".format(args.cluster_name)] = AWS_NETWORK[get_aws_account_name()]["network"]
-    pcluster_config["cluster {}".format(args.cluster_name)]["vpc_settings"] = "{}_network".format(args.cluster_name)
-
-    # Add in file system settings
-    pcluster_config["{} {}_fs".format(args.file_system_type, args.cluster_name)] = \
-        AWS_FILESYSTEM[args.file_system_type]
-    pcluster_config["cluster {}".format(args.cluster_name)]["{}_settings".format(args.file_system_type)] = \
-        "{}_fs".format(args.cluster_name)
-
-    # Add queue settings to cluster config for each queue
-    for queue_name, queue_dict in AWS_PARTITION_QUEUES.items():
-        # Create a tmp copy
-        modified_queue_dict = queue_dict.copy()
-        # Modify each in the list to match the compute resources below
-        compute_type = queue_dict["compute_type"]
-        extended_compute_resources = []
-        for compute_resource in modified_queue_dict["compute_resource_settings"]:
-            extended_compute_resources.append("{}_{}".format(compute_resource, compute_type))
-        modified_queue_dict["compute_resource_settings"] = ', '.join(extended_compute_resources)
-        pcluster_config["queue {}".format(queue_name)] = modified_queue_dict
-
-    pcluster_config["cluster {}".format(args.cluster_name)]["queue_settings"] = \
-        ", ".join(list(AWS_PARTITION_QUEUES.keys()))
-
-    # Add compute resoures to cluster config
-    for queue_name, queue_dict in AWS_PARTITION_QUEUES.items():
-        compute_type = queue_dict["compute_type"]
-        for compute_resource in queue_dict["compute_resource_settings"]:
-            pcluster_config["compute_resource {}_{}".format(compute_resource, compute_type)] = \
-                AWS_COMPUTE_RESOURCES[compute_resource]
-
-    # Add aliases to cluster config
-    pcluster_config["aliases"] = AWS_ALIASES
-
-    # Write config to file
-    with open(configuration_temp_file.name, 'w') as config_h:
-        pcluster_config.write(config_h)
-
-    return configuration_temp_file
-
-
-def run_pcluster_create(pcluster_create_command):
+def render_configuration(args, configuration_inputs=None):
+    """
+    Given the arguments, on the cli, render the config required for the cluster to be built
+    :param args:
+    :param configuration_inputs: Output of resolve_configuration_inputs, looked up if not given
+    :return: the configuration as a str
+    """
+
+    if configuration_inputs is None:
+        configuration_inputs = resolve_configuration_inputs(args)
+
+    return render_pcluster_config(cluster_name=args.cluster_name,
+                                  file_system_type=args.file_system_type,
+                                  configuration_inputs=configuration_inputs,
+                                  partition_queues=getattr(args, "partition_queues", None),
+                                  compute_resources=getattr(args, "compute_resources", None))
+
+
+def create_configuration_file(args, configuration_inputs=None):
+    """
+    Given the arguments, on the cli, create the config file required for the cluster to be built
+    Identical configurations share the same file, see write_pcluster_config
+    :param args:
+    :param configuration_inputs: Output of resolve_configuration_inputs, looked up if not given
+    :return: Path to the configuration file
+    """
+
+    return write_pcluster_config(render_configuration(args, configuration_inputs=configuration_inputs))
+
+
+@profiled()
+def run_pcluster_create(pcluster_create_command, log_file=None, log_level=logging.INFO):
     """
     Run pcluster create command
+    Output is logged as it arrives, since the command can take a good 15 minutes to complete
+    :param log_level: Level to log each line of output at
     :return:
     """
 
@@ -227,7 +297,7 @@ def run_pcluster_create(pcluster_create_command):
     ))
 
     pcluster_create_returncode, pcluster_create_stdout, pcluster_create_stderr = \
-        run_subprocess_proc(pcluster_create_command, capture_output=True)
+        run_subprocess_proc(pcluster_create_command, stream=True, log_file=log_file, log_level=log_level)
 
     if not pcluster_create_returncode == 0:
         logger.error("Failed to create the stack successfully")
@@ -254,13 +324,190 @@ def log_success_message(ec2_instance):
     return login_message
 
 
+def log_no_wait_message(cluster_name):
+    """
+    Show user how to follow the creation of a cluster they didn't wait for
+    :return:
+    """
+
+    no_wait_message = """
+    
+    Creation of cluster "{0}" has been submitted. You can follow its progress with the following command:
+    
+    start_cluster.py --cluster-name "{0}" --attach
+    
+    """.format(cluster_name)
+
+    return no_wait_message
+
+
+def get_manifest_cluster_args(args, manifest_cluster):
+    """
+    Copy of the cli arguments with the settings of a single manifest cluster laid over the top
+    :param args: cli arguments, after set_args
+    :param manifest_cluster: dict from get_manifest_clusters
+    :return:
+    """
+
+    cluster_args = argparse.Namespace(**vars(args))
+
+    cluster_args.cluster_name = manifest_cluster["cluster_name"]
+
+    # A setting left empty in the manifest (i.e 'no_rollback:') falls back to the cli value
+    for manifest_key, arg_key in [("file_system_type", "file_system_type"),
+                                  ("no_rollback", "no_rollback"),
+                                  ("extra_parameters", "extra_parameters_json")]:
+        if manifest_cluster.get(manifest_key) is not None:
+            setattr(cluster_args, arg_key, manifest_cluster[manifest_key])
+
+    # Manifest tags are laid over any given with --tags
+    tag_parameters_json = dict(args.tag_parameters_json or {}, **(manifest_cluster.get("tags") or {}))
+    cluster_args.tag_parameters_json = tag_parameters_json
+    cluster_args.tags_json = get_parallel_cluster_tags(tag_parameters_json)
+
+    if args.log_file is not None:
+        cluster_args.log_file = "{}.{}".format(args.log_file, cluster_args.cluster_name)
+
+    return cluster_args
+
+
+@profiled()
+def launch_cluster(cluster_args, configuration_inputs):
+    """
+    Create a single cluster from a manifest, following it through to its head node if we're waiting.
+    Runs on a worker thread next to the other clusters in the manifest,
+    so the per line / per event output is logged at debug level to keep the console readable
+    :param cluster_args: from get_manifest_cluster_args
+    :param configuration_inputs: from resolve_configuration_inputs, shared by all clusters
+    :return: tuple of stack status and head node
+    """
+
+    configuration_file = create_configuration_file(cluster_args, configuration_inputs=configuration_inputs)
+
+    pcluster_create_command = collate_pcluster_create_cli(
+        cluster_name=cluster_args.cluster_name,
+        configuration_file=configuration_file,
+        extra_parameters=cluster_args.extra_parameters_json,
+        tags=cluster_args.tags_json,
+        no_rollback=cluster_args.no_rollback,
+        no_wait=cluster_args.backend == "cfn"
+    )
+
+    run_pcluster_create(pcluster_create_command, log_file=cluster_args.log_file, log_level=logging.DEBUG)
+
+    if cluster_args.backend == "cfn":
+        if not cluster_args.wait:
+            return "CREATE_IN_PROGRESS", None
+
+        stack_status = wait_for_stack_creation(get_parallel_cluster_stack_name(cluster_args.cluster_name),
+                                               log_level=logging.DEBUG)
+    else:
+        stack_status = "CREATE_COMPLETE"
+
+    master_node = get_master_ec2_instance_id_from_pcluster_id(cluster_args.cluster_name, backend=cluster_args.backend)
+
+    return stack_status, master_node
+
+
+def launch_manifest_clusters(args):
+    """
+    Create every cluster in the manifest, at most max_workers at a time.
+    The ssm parameters, ami and network are looked up once up front and shared by every cluster.
+    A row of the status table is printed as each cluster finishes, a failure doesn't stop the others.
+    :param args:
+    :return: number of clusters that failed
+    """
+
+    try:
+        manifest_clusters = get_manifest_clusters(args.manifest)
+    except ManifestError:
+        sys.exit(1)
+
+    logger.info("Launching {} clusters from manifest \"{}\"".format(len(manifest_clusters), args.manifest))
+
+    configuration_inputs = resolve_configuration_inputs(args)
+
+    table_writer = FixedWidthTableWriter(columns=[column for column, _ in LAUNCH_COLUMNS],
+                                         column_widths=[column_width for _, column_width in LAUNCH_COLUMNS])
+
+    table_writer.write_header()
+
+    failed_clusters = 0
+    start_time = time.time()
+
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        future_to_cluster_name = {}
+        for manifest_cluster in manifest_clusters:
+            try:
+                cluster_args = get_manifest_cluster_args(args, manifest_cluster)
+            except Exception as args_error:
+                # A bad entry only fails this cluster, the others are still launched
+                logger.error("Could not read the settings of cluster \"{}\": {}".format(
+                    manifest_cluster["cluster_name"], args_error))
+                failed_clusters += 1
+                table_writer.write_row([manifest_cluster["cluster_name"], "CREATE_FAILED", None,
+                                        "{}s".format(int(time.time() - start_time))])
+                continue
+            future = executor.submit(launch_cluster, cluster_args, configuration_inputs)
+            future_to_cluster_name[future] = cluster_args.cluster_name
+
+        for future in as_completed(future_to_cluster_name):
+            cluster_name = future_to_cluster_name[future]
+            try:
+                stack_status, master_node = future.result()
+            except PClusterCreateError:
+                stack_status, master_node = "CREATE_FAILED", None
+                failed_clusters += 1
+            except PClusterInstanceError:
+                logger.warning("Could not retrieve the head node for cluster \"{}\"".format(cluster_name))
+                stack_status, master_node = "CREATE_COMPLETE", None
+            except Exception as launch_error:
+                # Anything else (timeouts, aws errors) only fails this cluster, the others carry on
+                logger.error("Could not launch cluster \"{}\": {}".format(cluster_name, launch_error))
+                stack_status, master_node = "CREATE_FAILED", None
+                failed_clusters += 1
+
+            table_writer.write_row([cluster_name, stack_status, master_node,
+                                    "{}s".format(int(time.time() - start_time))])
+
+    return failed_clusters
+
+
+def print_dry_run(args):
+    """
+    Print the configuration of each cluster we would create, nothing is created.
+    The aws lookups the configuration depends on (caller identity, ssm parameters, ami catalog) are served from
+    the local cache, so with a warm cache no aws call is made at all. Anything not in the cache is looked up.
+    :param args:
+    :return:
+    """
+
+    if args.manifest is not None:
+        try:
+            cluster_args_list = [get_manifest_cluster_args(args, manifest_cluster)
+                                 for manifest_cluster in get_manifest_clusters(args.manifest)]
+        except ManifestError:
+            sys.exit(1)
+    else:
+        cluster_args_list = [args]
+
+    configuration_inputs = resolve_configuration_inputs(args)
+
+    for cluster_args in cluster_args_list:
+        print("# Configuration for cluster \"{}\"".format(cluster_args.cluster_name))
+        print(render_configuration(cluster_args, configuration_inputs=configuration_inputs))
+
+
 def main():
     """
     get args
     set args
+    Print the configuration, if this is a dry run
     check env
+    Launch each cluster in the manifest side by side, if we have one
     Generate config
     Run 'create pcluster'
+    Follow the stack events until the cluster is created
     Log success message
     """
 
@@ -272,27 +519,55 @@ def main():
     # Collect all sys arguments
     args = get_args()
 
+    if args.profile is not None:
+        start_profiling(args.profile)
+
     # Adjust arguments as required
     args = set_args(args)
 
-    # Check environment vars and we're logged in to aws
-    check_env()
-
-    # Generate configuration file
-    configuration_file = create_configuration_file(args)
-
-    # Generate pcluster command to run through subprocess
-    pcluster_create_command = collate_pcluster_create_cli(cluster_name=getattr(args, "cluster_name", None),
-                                                          configuration_file=configuration_file,
-                                                          extra_parameters=getattr(args, "extra_parameters_json", None),
-                                                          tags=getattr(args, "tags_json", None),
-                                                          no_rollback=getattr(args, "no_rollback", None))
+    # Nothing is created, so there is no need to check the environment
+    if args.dry_run:
+        print_dry_run(args)
+        return
 
-    # Run command through subprocess
-    run_pcluster_create(pcluster_create_command)
+    # Check environment vars and we're logged in to aws
+    check_env(use_cache=not args.no_cache)
+
+    if args.manifest is not None:
+        failed_clusters = launch_manifest_clusters(args)
+        if failed_clusters > 0:
+            logger.error("{} clusters could not be created".format(failed_clusters))
+            sys.exit(1)
+        return
+
+    if not args.attach:
+        # Generate configuration file
+        configuration_file = create_configuration_file(args)
+
+        # Generate pcluster command to run through subprocess
+        # With the cfn backend we follow the stack ourselves, so pcluster can return straight away
+        pcluster_create_command = collate_pcluster_create_cli(
+            cluster_name=getattr(args, "cluster_name", None),
+            configuration_file=configuration_file,
+            extra_parameters=getattr(args, "extra_parameters_json", None),
+            tags=getattr(args, "tags_json", None),
+            no_rollback=getattr(args, "no_rollback", None),
+            no_wait=args.backend == "cfn"
+        )
+
+        # Run command through subprocess
+        run_pcluster_create(pcluster_create_command, log_file=getattr(args, "log_file", None))
+
+    if args.backend == "cfn":
+        if not args.wait:
+            logger.info(log_no_wait_message(cluster_name=args.cluster_name))
+            return
+
+        # Follow the stack events until the cluster has been created
+        wait_for_stack_creation(get_parallel_cluster_stack_name(args.cluster_name))
 
     # Get master node of parallel cluster
-    master_node = get_master_ec2_instance_id_from_pcluster_id(args.cluster_name)
+    master_node = get_master_ec2_instance_id_from_pcluster_id(args.cluster_name, backend=args.backend)
 
     # Print success message with master node
     logger.info(log_success_message(ec2_instance=master_node))
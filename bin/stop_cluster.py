@@ -1,59 +1,174 @@
 #!/usr/bin/env python3
 
 """
-Delete/Stop a cluster
+Delete/Stop one or more clusters
 """
 
 import sys
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from umccr_utils import logger
 from umccr_utils.help import print_extended_help
+from umccr_utils.profiling import start_profiling
 from umccr_utils.checks import check_env
-from umccr_utils.miscell import run_subprocess_proc
-from umccr_utils.globals import AWS_REGION
+from umccr_utils.aws_wrappers import delete_parallel_cluster, get_parallel_cluster_records, \
+    get_parallel_cluster_stack_name
+from umccr_utils.clusters import filter_cluster_records
+from umccr_utils.stack_monitor import wait_for_stack_deletions
+from umccr_utils.errors import PClusterDeleteError
+from umccr_utils.globals import PCLUSTER_BACKENDS, DEFAULT_PCLUSTER_BACKEND, DEFAULT_MAX_WORKERS
 logger = logger.get_logger()
 
+# Characters that make a cluster name a glob
+GLOB_CHARACTERS = "*?["
+
 
 def get_args():
     """
-    Cluster name
+    Cluster names and / or filters
     :return:
     """
 
-    parser = argparse.ArgumentParser(description="Stop the cluster")
+    parser = argparse.ArgumentParser(description="Stop one or more clusters")
 
     parser.add_argument("--cluster-name",
-                        help="Name of the cluster to shut down",
-                        required=True)
+                        help="Names of the clusters to shut down, shell style globs (i.e 'training-*') are allowed",
+                        nargs="+",
+                        required=False)
+
+    parser.add_argument("--creator",
+                        help="Only shut down clusters created by these users",
+                        nargs="+",
+                        required=False)
+
+    parser.add_argument("--status",
+                        help="Only shut down clusters with these stack statuses, "
+                             "or status groups (completed, failed, unexpected)",
+                        nargs="+",
+                        required=False)
+
+    parser.add_argument("--max-workers",
+                        help="Maximum number of clusters to delete at once",
+                        type=int,
+                        default=DEFAULT_MAX_WORKERS,
+                        required=False)
+
+    parser.add_argument("--wait",
+                        help="Wait until every cluster has been deleted",
+                        action="store_true",
+                        default=False)
+
+    parser.add_argument("--dry-run",
+                        help="Print the clusters that would be shut down, without shutting them down",
+                        action="store_true",
+                        default=False)
+
+    parser.add_argument("--no-cache",
+                        help="Ignore locally cached lookups (env checks, ssm parameters, amis) and run them again",
+                        action="store_true",
+                        default=False)
+
+    parser.add_argument("--profile",
+                        help="Write a chrome trace (chrome://tracing) of where the time was spent to this file",
+                        required=False)
 
     parser.add_argument("--help-ext",
                         help="Print the extended help",
                         action="store_true",
                         required=False)
 
+    parser.add_argument("--backend",
+                        help="Delete the cloudformation stack directly (cfn) or through the pcluster cli (cli)",
+                        choices=PCLUSTER_BACKENDS,
+                        default=DEFAULT_PCLUSTER_BACKEND,
+                        required=False)
+
     args = parser.parse_args()
 
+    if args.cluster_name is None and args.creator is None and args.status is None:
+        parser.error("At least one of --cluster-name, --creator or --status is required")
+
+    if args.max_workers < 1:
+        parser.error("--max-workers must be a positive integer")
+
     return args
 
 
-def stop_cluster(cluster_name):
+def is_glob(cluster_name):
     """
-    Read in cluster list as pandas dataframe
+    Is this a pattern rather than the name of a single cluster
+    :param cluster_name:
     :return:
     """
 
-    stop_cluster_command = ["pcluster", "delete",
-                            "--region", AWS_REGION,
-                            cluster_name]
+    return any(glob_character in cluster_name for glob_character in GLOB_CHARACTERS)
 
-    cluster_list_returncode, cluster_list_stdout, cluster_list_stderr = run_subprocess_proc(stop_cluster_command,
-                                                                                            capture_output=True)
 
-    if not cluster_list_returncode == 0:
-        logger.error("Could not successfully delete the cluster, exiting")
-        sys.exit(1)
+def get_cluster_names(args):
+    """
+    Work out which clusters to shut down.
+    Plain cluster names are used as is, globs and filters are resolved against the cluster listing
+    :param args:
+    :return: list of cluster names
+    """
+
+    cluster_names = args.cluster_name if args.cluster_name is not None else []
+
+    if args.creator is None and args.status is None and not any(map(is_glob, cluster_names)):
+        return list(dict.fromkeys(cluster_names))
 
-    return cluster_list_stdout
+    cluster_records = get_parallel_cluster_records(backend=args.backend)
+
+    selected_cluster_records = filter_cluster_records(cluster_records,
+                                                      name_patterns=args.cluster_name,
+                                                      creators=args.creator,
+                                                      statuses=args.status,
+                                                      max_workers=args.max_workers,
+                                                      backend=args.backend)
+
+    return [cluster_record.name for cluster_record in selected_cluster_records]
+
+
+def stop_cluster(cluster_name, backend=DEFAULT_PCLUSTER_BACKEND):
+    """
+    Delete the cluster
+    :return:
+    """
+
+    return delete_parallel_cluster(cluster_name, backend=backend)
+
+
+def stop_clusters(cluster_names, backend=DEFAULT_PCLUSTER_BACKEND, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Delete the clusters, at most max_workers at a time.
+    A cluster that can't be deleted is logged and doesn't stop the others
+    :param cluster_names:
+    :param backend:
+    :param max_workers:
+    :return: list of the clusters that could not be deleted
+    """
+
+    failed_cluster_names = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_cluster_name = {
+            executor.submit(stop_cluster, cluster_name, backend=backend): cluster_name
+            for cluster_name in cluster_names
+        }
+
+        for future in as_completed(future_to_cluster_name):
+            cluster_name = future_to_cluster_name[future]
+            try:
+                future.result()
+            except PClusterDeleteError:
+                logger.error("Could not successfully delete the cluster \"{}\"".format(cluster_name))
+                failed_cluster_names.append(cluster_name)
+            except Exception as delete_error:
+                # Anything else (timeouts, aws errors) only fails this cluster, the others carry on
+                logger.error("Could not delete the cluster \"{}\": {}".format(cluster_name, delete_error))
+                failed_cluster_names.append(cluster_name)
+
+    return failed_cluster_names
 
 
 def main():
@@ -64,11 +179,40 @@ def main():
 
     args = get_args()
 
+    if args.profile is not None:
+        start_profiling(args.profile)
+
     # Check we're logged in
-    check_env()
+    check_env(use_cache=not args.no_cache)
+
+    cluster_names = get_cluster_names(args)
 
-    # Stop the cluster
-    stop_cluster(args.cluster_name)
+    if len(cluster_names) == 0:
+        logger.warning("No clusters matched, nothing to shut down")
+        return
+
+    if args.dry_run:
+        print("\n".join(cluster_names))
+        return
+
+    logger.info("Shutting down clusters {}".format(", ".join(cluster_names)))
+
+    # Stop the clusters
+    failed_cluster_names = stop_clusters(cluster_names, backend=args.backend, max_workers=args.max_workers)
+
+    # The pcluster cli already waits for each deletion to complete
+    if args.wait and args.backend == "cfn":
+        stack_name_to_cluster_name = {get_parallel_cluster_stack_name(cluster_name): cluster_name
+                                      for cluster_name in cluster_names
+                                      if cluster_name not in failed_cluster_names}
+        if len(stack_name_to_cluster_name) > 0:
+            failed_stack_names = wait_for_stack_deletions(list(stack_name_to_cluster_name.keys()))
+            failed_cluster_names.extend([stack_name_to_cluster_name[stack_name]
+                                         for stack_name in failed_stack_names])
+
+    if len(failed_cluster_names) > 0:
+        logger.error("Could not successfully delete clusters {}, exiting".format(", ".join(failed_cluster_names)))
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+"""
+Tests of the cloudformation backend in umccr_utils.aws_wrappers, run against botocore Stubber responses
+so no aws credentials or network access are needed
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+from botocore.stub import Stubber
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+from umccr_utils import aws_clients  # noqa: E402
+from umccr_utils.aws_wrappers import (  # noqa: E402
+    get_parallel_cluster_records_from_stacks, get_master_ec2_instance_id_from_stack
+)
+from umccr_utils.errors import PClusterInstanceError  # noqa: E402
+from umccr_utils.globals import AWS_REGION  # noqa: E402
+
+
+def get_stack(stack_name, status="CREATE_COMPLETE", parent_id=None):
+    stack = {
+        "StackName": stack_name,
+        "StackId": "arn:aws:cloudformation:{}:123456789012:stack/{}/abc".format(AWS_REGION, stack_name),
+        "CreationTime": "2020-01-01T00:00:00Z",
+        "StackStatus": status,
+        "Tags": [{"Key": "Version", "Value": "2.5.1"}],
+        "Outputs": [{"OutputKey": "MasterPrivateIP", "OutputValue": "10.0.0.1"}]
+    }
+    if parent_id is not None:
+        stack["ParentId"] = parent_id
+    return stack
+
+
+def get_stack_resource(logical_resource_id, physical_resource_id, resource_type):
+    return {
+        "LogicalResourceId": logical_resource_id,
+        "PhysicalResourceId": physical_resource_id,
+        "ResourceType": resource_type,
+        "LastUpdatedTimestamp": "2020-01-01T00:00:00Z",
+        "ResourceStatus": "CREATE_COMPLETE"
+    }
+
+
+@pytest.fixture
+def cfn_stubber(monkeypatch, tmp_path):
+    # Fake credentials and a fresh registry so the stubbed client is the one the wrappers pick up
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.delenv("AWS_PROFILE", raising=False)
+    monkeypatch.setenv("AWS_CONFIG_FILE", str(tmp_path / "config"))
+    monkeypatch.setenv("AWS_SHARED_CREDENTIALS_FILE", str(tmp_path / "credentials"))
+    monkeypatch.setattr(aws_clients, "SESSION", None)
+    monkeypatch.setattr(aws_clients, "CLIENTS", {})
+
+    cfn = aws_clients.get_client("cloudformation", region_name=AWS_REGION)
+
+    with Stubber(cfn) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+def test_describe_stacks_follows_pagination(cfn_stubber):
+    cfn_stubber.add_response("describe_stacks",
+                             {"Stacks": [get_stack("parallelcluster-alpha"),
+                                         get_stack("some-other-stack")],
+                              "NextToken": "page-2"},
+                             {})
+    cfn_stubber.add_response("describe_stacks",
+                             {"Stacks": [get_stack("parallelcluster-beta", status="CREATE_IN_PROGRESS"),
+                                         get_stack("parallelcluster-beta-MasterServerSubstack-XYZ",
+                                                   parent_id="arn:parent")]},
+                             {"NextToken": "page-2"})
+
+    cluster_records = get_parallel_cluster_records_from_stacks()
+
+    # Stacks not created by pcluster and nested stacks are skipped
+    assert [record.name for record in cluster_records] == ["alpha", "beta"]
+    assert [record.status for record in cluster_records] == ["CREATE_COMPLETE", "CREATE_IN_PROGRESS"]
+    assert cluster_records[0].version == "2.5.1"
+    assert cluster_records[0].stack_name == "parallelcluster-alpha"
+    assert cluster_records[0].outputs == {"MasterPrivateIP": "10.0.0.1"}
+
+
+def test_master_server_resource_lookup(cfn_stubber):
+    cfn_stubber.add_response("list_stack_resources",
+                             {"StackResourceSummaries": [
+                                 get_stack_resource("ComputeFleet", "fleet-asg", "AWS::AutoScaling::AutoScalingGroup")
+                             ],
+                              "NextToken": "page-2"},
+                             {"StackName": "parallelcluster-alpha"})
+    cfn_stubber.add_response("list_stack_resources",
+                             {"StackResourceSummaries": [
+                                 get_stack_resource("MasterServer", "i-0123456789abcdef0", "AWS::EC2::Instance")
+                             ]},
+                             {"StackName": "parallelcluster-alpha", "NextToken": "page-2"})
+
+    assert get_master_ec2_instance_id_from_stack("alpha") == "i-0123456789abcdef0"
+
+
+def test_master_server_resource_missing(cfn_stubber):
+    cfn_stubber.add_response("list_stack_resources",
+                             {"StackResourceSummaries": [
+                                 get_stack_resource("ComputeFleet", "fleet-asg", "AWS::AutoScaling::AutoScalingGroup")
+                             ]},
+                             {"StackName": "parallelcluster-alpha"})
+
+    with pytest.raises(PClusterInstanceError):
+        get_master_ec2_instance_id_from_stack("alpha")
+
+
+def test_master_server_stack_not_found(cfn_stubber):
+    cfn_stubber.add_client_error("list_stack_resources",
+                                 service_error_code="ValidationError",
+                                 service_message="Stack with id parallelcluster-alpha does not exist",
+                                 expected_params={"StackName": "parallelcluster-alpha"})
+
+    with pytest.raises(PClusterInstanceError):
+        get_master_ec2_instance_id_from_stack("alpha")
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+"""
+Process-wide boto3 session and client registry
+
+Creating a boto3 client loads the service model from disk which is slow and memory hungry,
+so every helper should share a single client per (service, region) rather than building their own.
+
+Invoke with the following
+
+from umccr_utils.aws_clients import get_client
+
+ec2 = get_client("ec2")
+"""
+
+import threading
+import boto3
+from botocore.config import Config
+from umccr_utils.globals import AWS_CLIENT_MAX_POOL_CONNECTIONS, AWS_CLIENT_RETRIES
+
+# Boto3 sessions are not thread safe, so all creation goes through this lock
+REGISTRY_LOCK = threading.RLock()
+
+SESSION = None
+CLIENTS = {}
+CLIENT_CONFIG_KWARGS = {
+    "max_pool_connections": AWS_CLIENT_MAX_POOL_CONNECTIONS,
+    "retries": AWS_CLIENT_RETRIES
+}
+
+
+def configure_clients(max_pool_connections=None, retries=None):
+    """
+    Change the connection pool size and / or retry settings of clients.
+    Any clients already created are dropped so that the new settings take effect
+    :param max_pool_connections: number of connections each client keeps open
+    :param retries: botocore retries dict, i.e {"max_attempts": 5, "mode": "standard"}
+    :return:
+    """
+
+    with REGISTRY_LOCK:
+        if max_pool_connections is not None:
+            CLIENT_CONFIG_KWARGS["max_pool_connections"] = max_pool_connections
+        if retries is not None:
+            CLIENT_CONFIG_KWARGS["retries"] = retries
+        CLIENTS.clear()
+
+
+def get_session():
+    """
+    Get the boto3 session shared by this process, created on first use
+    :return:
+    """
+
+    global SESSION
+
+    if SESSION is None:
+        with REGISTRY_LOCK:
+            if SESSION is None:
+                SESSION = boto3.session.Session()
+
+    return SESSION
+
+
+def get_client(service_name, region_name=None):
+    """
+    Get the boto3 client for a service, created on first use and shared thereafter.
+    Boto3 clients are thread safe once created
+    :param service_name: i.e 'ec2'
+    :param region_name: None to use the region of the session
+    :return:
+    """
+
+    client_key = (service_name, region_name)
+
+    client = CLIENTS.get(client_key)
+
+    if client is None:
+        with REGISTRY_LOCK:
+            client = CLIENTS.get(client_key)
+            if client is None:
+                client = get_session().client(service_name,
+                                              region_name=region_name,
+                                              config=Config(**CLIENT_CONFIG_KWARGS))
+                CLIENTS[client_key] = client
+
+    return client
+
+
+def reset_clients():
+    """
+    Drop the session and all clients, the next call to get_client starts afresh
+    :return:
+    """
+
+    global SESSION
+
+    with REGISTRY_LOCK:
+        CLIENTS.clear()
+        SESSION = None
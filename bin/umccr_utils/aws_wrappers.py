@@ -4,17 +4,25 @@
 AWS commands to run and validate outputs from
 """
 
-import boto3
-from botocore.exceptions import UnauthorizedSSOTokenError
+from botocore.exceptions import UnauthorizedSSOTokenError, ClientError
 from umccr_utils.miscell import run_subprocess_proc, get_user
+from umccr_utils.aws_clients import get_client, get_session
+from umccr_utils.cluster_records import ClusterRecord
+from umccr_utils.cache import get_cache_key, read_cache, write_cache
+from umccr_utils.profiling import profiled
 from umccr_utils.version import version as umccr_version
 from umccr_utils.logger import get_logger
 from packaging import version
 from umccr_utils.errors import NoLocalIPError, AWSCredentialsError, AWSBinaryNotFoundError, AWSVersionFailureError, \
-    PClusterBinaryNotFoundError, PClusterVersionFailure, PClusterInstanceError, AMINotFoundError, SSMParameterError
+    PClusterBinaryNotFoundError, PClusterVersionFailure, PClusterInstanceError, PClusterDeleteError, \
+    AMINotFoundError, SSMParameterError
 from umccr_utils.globals import AWS_REGION, AWS_ACCOUNT_MAPPING, \
-    AWS_PARALLEL_CLUSTER_STACK_NAME, UMCCR_VERSION_REGEX_OBJ
+    AWS_PARALLEL_CLUSTER_STACK_NAME, UMCCR_VERSION_REGEX_OBJ, DEFAULT_PCLUSTER_BACKEND, \
+    PCLUSTER_STACK_PREFIX, PCLUSTER_MASTER_LOGICAL_RESOURCE_ID, AWS_SSM_PARAMETER_KEYS, SSM_PARAMETER_CACHE_TTL, \
+    AMI_CATALOG_CACHE_TTL, CALLER_IDENTITY_CACHE_TTL
 from datetime import datetime
+import hashlib
+import threading
 import shlex
 import sys
 
@@ -22,14 +30,73 @@ logger = get_logger()
 
 CREATION_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
 
+# EC2 accepts at most 200 values for a single filter and returns at most 1000 results per page
+EC2_MAX_FILTER_VALUES = 200
+EC2_MAX_RESULTS_PER_PAGE = 1000
 
-def get_aws_account_name():
-    client = boto3.client("sts")
+AMI_CATALOG_CACHE_NAMESPACE = "ami_catalog"
 
-    try:
-        caller_id = client.get_caller_identity()
-    except UnauthorizedSSOTokenError:
-        raise AWSCredentialsError
+# SSM get_parameters accepts at most 10 names per call
+SSM_MAX_PARAMETERS_PER_CALL = 10
+SSM_CACHE_NAMESPACE = "ssm_parameters"
+CALLER_IDENTITY_CACHE_NAMESPACE = "caller_identity"
+
+# Parameter values already retrieved by this process, keyed on (name, encrypted)
+SSM_PARAMETER_VALUES = {}
+SSM_PARAMETER_VALUES_LOCK = threading.Lock()
+
+# The caller identity does not change over the life of the process, so sts is only asked once
+CALLER_IDENTITY = {}
+CALLER_IDENTITY_LOCK = threading.Lock()
+
+
+def get_caller_identity(use_cache=True):
+    """
+    Get the caller identity from sts, memoised for the life of the process.
+    The identity is also kept in the local cache, keyed on the credentials in use, so the cache keys
+    built from the account (ssm parameters, ami catalog) can be worked out without calling aws at all
+    :param use_cache: Set to False to always ask sts, i.e to check the credentials still work
+    :return: dict with UserId, Account and Arn keys
+    """
+
+    with CALLER_IDENTITY_LOCK:
+        if len(CALLER_IDENTITY) > 0 and use_cache:
+            return CALLER_IDENTITY.copy()
+
+        cache_key = get_cache_key(get_credentials_fingerprint())
+
+        if use_cache:
+            caller_id = read_cache(CALLER_IDENTITY_CACHE_NAMESPACE, cache_key, ttl=CALLER_IDENTITY_CACHE_TTL)
+            if caller_id is not None:
+                CALLER_IDENTITY.update(caller_id)
+                return CALLER_IDENTITY.copy()
+
+        try:
+            caller_id = get_client("sts").get_caller_identity()
+        except UnauthorizedSSOTokenError:
+            raise AWSCredentialsError
+
+        CALLER_IDENTITY.clear()
+        CALLER_IDENTITY.update({key: caller_id.get(key) for key in ["UserId", "Account", "Arn"]})
+        write_cache(CALLER_IDENTITY_CACHE_NAMESPACE, cache_key, CALLER_IDENTITY)
+
+        return CALLER_IDENTITY.copy()
+
+
+def set_caller_identity(caller_id):
+    """
+    Seed the memoised caller identity, i.e from a cached check_env result
+    :param caller_id:
+    :return:
+    """
+
+    with CALLER_IDENTITY_LOCK:
+        CALLER_IDENTITY.clear()
+        CALLER_IDENTITY.update(caller_id)
+
+
+def get_aws_account_name():
+    caller_id = get_caller_identity()
 
     account = caller_id['Account']
 
@@ -55,17 +122,38 @@ def check_credentials():
     :return:
     """
 
-    client = boto3.client("sts")
+    # Always ask sts, a cached identity doesn't show the credentials still work
+    caller_id = get_caller_identity(use_cache=False)
+
+    if caller_id.get("UserId") is None:
+        logger.error("Could not find user id after calling 'get_caller_identity' function."
+                     "Got the following keys instead: \"{}\"".format(", ".join(caller_id.keys())))
+        raise AWSCredentialsError
+
+    return caller_id
+
+
+def get_credentials_fingerprint():
+    """
+    Identify the credentials in use without calling AWS.
+    Returns a hash of the access key id along with the profile name, never the secret key
+    :return: tuple of (profile name, access key hash)
+    """
+
+    session = get_session()
+
+    credentials = session.get_credentials()
+
+    if credentials is None:
+        logger.error("Could not find any AWS credentials")
+        raise AWSCredentialsError
 
     try:
-        caller_id = client.get_caller_identity()
+        access_key = credentials.get_frozen_credentials().access_key
     except UnauthorizedSSOTokenError:
         raise AWSCredentialsError
 
-    if "UserId" not in caller_id.keys():
-        logger.error("Could not find user id after calling 'get_caller_identity' function."
-                     "Got the following keys instead: \"{}\"".format(", ".join(caller_id.keys())))
-        raise AWSCredentialsError
+    return session.profile_name, hashlib.sha256(access_key.encode()).hexdigest()
 
 
 def get_aws_version():
@@ -150,9 +238,24 @@ def get_pcluster_version():
     return pcluster_type_stdout
 
 
-def get_master_ec2_instance_id_from_pcluster_id(pcluster_id):
+@profiled()
+def get_master_ec2_instance_id_from_pcluster_id(pcluster_id, backend=DEFAULT_PCLUSTER_BACKEND):
+    """
+    Get the master ec2 instance id from a pcluster id
+    :param pcluster_id: name of the cluster
+    :param backend: one of PCLUSTER_BACKENDS
+    :return:
+    """
+
+    if backend == "cli":
+        return get_master_ec2_instance_id_from_pcluster_cli(pcluster_id)
+
+    return get_master_ec2_instance_id_from_stack(pcluster_id)
+
+
+def get_master_ec2_instance_id_from_pcluster_cli(pcluster_id):
     """
-    Use some jq magic to get the master ec2 instance id from a pcluster id
+    Use the pcluster instances command to get the master ec2 instance id from a pcluster id
     :return:
     """
 
@@ -178,6 +281,227 @@ def get_master_ec2_instance_id_from_pcluster_id(pcluster_id):
     raise PClusterInstanceError
 
 
+def get_parallel_cluster_stack_name(cluster_name):
+    """
+    Get the name of the cloudformation stack that pcluster creates for a cluster
+    :param cluster_name:
+    :return:
+    """
+
+    return "{}{}".format(PCLUSTER_STACK_PREFIX, cluster_name)
+
+
+def get_cluster_record_from_stack(stack):
+    """
+    Convert a stack returned by cloudformation's describe_stacks into a cluster record.
+    Mirrors the pcluster list command, nested stacks and stacks not created by pcluster are skipped.
+    :param stack: dict, a member of the 'Stacks' list returned by describe_stacks
+    :return: ClusterRecord, or None if not a cluster stack
+    """
+
+    stack_name = stack["StackName"]
+
+    if stack.get("ParentId") is not None or not stack_name.startswith(PCLUSTER_STACK_PREFIX):
+        return None
+
+    tags = {tag["Key"]: tag["Value"] for tag in stack.get("Tags", [])}
+    outputs = {output["OutputKey"]: output["OutputValue"] for output in stack.get("Outputs", [])}
+
+    return ClusterRecord(name=stack_name[len(PCLUSTER_STACK_PREFIX):],
+                         status=stack["StackStatus"],
+                         version=tags.get("Version"),
+                         stack_name=stack_name,
+                         tags=tags,
+                         outputs=outputs)
+
+
+def get_parallel_cluster_records_from_stacks():
+    """
+    List the parallel clusters by reading the cloudformation stacks directly
+    :return: list of ClusterRecords
+    """
+
+    cfn = get_client("cloudformation", region_name=AWS_REGION)
+    paginator = cfn.get_paginator("describe_stacks")
+
+    cluster_records = []
+
+    for page in paginator.paginate():
+        for stack in page.get("Stacks", []):
+            cluster_record = get_cluster_record_from_stack(stack)
+            if cluster_record is not None:
+                cluster_records.append(cluster_record)
+
+    return cluster_records
+
+
+def get_parallel_cluster_records_from_pcluster_cli():
+    """
+    List the parallel clusters by parsing the output of the pcluster list command
+    :return: list of ClusterRecords with the name, status and version set
+    """
+
+    cluster_list_command = ["pcluster", "list",
+                            "--region", AWS_REGION]
+
+    cluster_list_returncode, cluster_list_stdout, cluster_list_stderr = run_subprocess_proc(cluster_list_command,
+                                                                                            capture_output=True)
+
+    if cluster_list_stdout is None:
+        return []
+
+    return [ClusterRecord(*row.split()[:3])
+            for row in cluster_list_stdout.strip().split("\n")
+            if not row.strip() == ""]
+
+
+@profiled()
+def get_parallel_cluster_records(backend=DEFAULT_PCLUSTER_BACKEND):
+    """
+    List the parallel clusters in the region
+    :param backend: one of PCLUSTER_BACKENDS
+    :return: list of ClusterRecords
+    """
+
+    if backend == "cli":
+        return get_parallel_cluster_records_from_pcluster_cli()
+
+    return get_parallel_cluster_records_from_stacks()
+
+
+def get_master_ec2_instance_id_from_stack(cluster_name):
+    """
+    Get the master ec2 instance id from the resources of the cluster's cloudformation stack
+    :param cluster_name:
+    :return:
+    """
+
+    cfn = get_client("cloudformation", region_name=AWS_REGION)
+    paginator = cfn.get_paginator("list_stack_resources")
+
+    stack_name = get_parallel_cluster_stack_name(cluster_name)
+
+    try:
+        for page in paginator.paginate(StackName=stack_name):
+            for stack_resource in page.get("StackResourceSummaries", []):
+                if stack_resource["LogicalResourceId"] == PCLUSTER_MASTER_LOGICAL_RESOURCE_ID:
+                    return stack_resource["PhysicalResourceId"]
+    except ClientError as client_error:
+        logger.error("Could not list the resources of stack \"{}\": {}".format(stack_name, client_error))
+        raise PClusterInstanceError
+
+    logger.error("Could not find the {} resource in stack \"{}\"".format(
+        PCLUSTER_MASTER_LOGICAL_RESOURCE_ID, stack_name))
+    raise PClusterInstanceError
+
+
+@profiled()
+def delete_parallel_cluster(cluster_name, backend=DEFAULT_PCLUSTER_BACKEND):
+    """
+    Delete a parallel cluster
+    The cli backend waits for the deletion to complete, the cfn backend returns once the deletion has been submitted
+    :param cluster_name:
+    :param backend: one of PCLUSTER_BACKENDS
+    :return:
+    """
+
+    if backend == "cli":
+        return delete_parallel_cluster_from_pcluster_cli(cluster_name)
+
+    return delete_parallel_cluster_stack(cluster_name)
+
+
+def delete_parallel_cluster_from_pcluster_cli(cluster_name):
+    """
+    Delete a parallel cluster through the pcluster delete command
+    :param cluster_name:
+    :return: stdout of the pcluster delete command
+    """
+
+    stop_cluster_command = ["pcluster", "delete",
+                            "--region", AWS_REGION,
+                            cluster_name]
+
+    stop_cluster_returncode, stop_cluster_stdout, stop_cluster_stderr = run_subprocess_proc(stop_cluster_command,
+                                                                                            capture_output=True)
+
+    if not stop_cluster_returncode == 0:
+        raise PClusterDeleteError
+
+    return stop_cluster_stdout
+
+
+def delete_parallel_cluster_stack(cluster_name):
+    """
+    Delete a parallel cluster by deleting its cloudformation stack
+    :param cluster_name:
+    :return: the name of the stack being deleted
+    """
+
+    cfn = get_client("cloudformation", region_name=AWS_REGION)
+
+    stack_name = get_parallel_cluster_stack_name(cluster_name)
+
+    try:
+        # Raises a ClientError if the stack does not exist
+        cfn.describe_stacks(StackName=stack_name)
+        cfn.delete_stack(StackName=stack_name)
+    except ClientError as client_error:
+        logger.error("Could not delete stack \"{}\": {}".format(stack_name, client_error))
+        raise PClusterDeleteError
+
+    logger.info("Deletion of stack \"{}\" has been submitted".format(stack_name))
+
+    return stack_name
+
+
+def get_ec2_instance_tag_values(instance_ids, tag_key):
+    """
+    Get the value of a tag for many ec2 instances at once.
+    Uses describe_tags filtered on the instance ids and tag key, so the whole set of instances
+    costs one paginated call per EC2_MAX_FILTER_VALUES instances rather than one call per instance.
+    :param instance_ids: list of ec2 instance ids
+    :param tag_key: the tag to retrieve, i.e 'Creator'
+    :return: dict of instance id to tag value, instances without the tag are omitted
+    """
+
+    # Drop duplicates but keep things in order
+    instance_ids = list(dict.fromkeys(instance_ids))
+
+    tag_values = {}
+
+    if len(instance_ids) == 0:
+        return tag_values
+
+    ec2 = get_client("ec2")
+    paginator = ec2.get_paginator("describe_tags")
+
+    for chunk_start in range(0, len(instance_ids), EC2_MAX_FILTER_VALUES):
+        instance_ids_chunk = instance_ids[chunk_start:chunk_start + EC2_MAX_FILTER_VALUES]
+        page_iterator = paginator.paginate(
+            Filters=[
+                {
+                    "Name": "resource-type",
+                    "Values": ["instance"]
+                },
+                {
+                    "Name": "resource-id",
+                    "Values": instance_ids_chunk
+                },
+                {
+                    "Name": "key",
+                    "Values": [tag_key]
+                }
+            ],
+            PaginationConfig={"PageSize": EC2_MAX_RESULTS_PER_PAGE}
+        )
+        for page in page_iterator:
+            for tag in page.get("Tags", []):
+                tag_values[tag["ResourceId"]] = tag["Value"]
+
+    return tag_values
+
+
 def get_local_ip():
     """
     Get the local ip address of the user - ideally two 'accessForms' are created
@@ -197,65 +521,101 @@ def get_local_ip():
     return get_local_ip_stdout
 
 
-def get_parallel_cluster_s3_path(s3_path_ssm_parameter_key):
+def get_parallel_cluster_s3_path(s3_path_ssm_parameter_key, use_cache=True):
     """
     Get the base path for the parallel cluster s3 location
     :return:
     """
 
     s3_path_ssm_parameter_value = ssm_parameter_value(s3_path_ssm_parameter_key,
-                                                      encrypted=False)
+                                                      encrypted=False,
+                                                      use_cache=use_cache)
 
     return s3_path_ssm_parameter_value
 
 
-def get_ami_id(pcluster_version):
+@profiled()
+def get_ami_catalog(refresh=False):
+    """
+    Get the latest parallel cluster ami for each version.
+    Pages through every image tagged with the parallel cluster stack name, keeping the most recently
+    created image for each Version tag. The catalog is kept in the local cache for AMI_CATALOG_CACHE_TTL seconds.
+    :param refresh: Ignore the local cache and rebuild the catalog from ec2
+    :return: dict of version to dict with ImageId, Name and CreationDate keys
+    """
+
+    ami_stack_name = get_parallel_cluster_ami_stack_name()
+
+    cache_key = get_cache_key(get_caller_identity()["Account"], get_session().region_name, ami_stack_name)
+
+    if not refresh:
+        ami_catalog = read_cache(AMI_CATALOG_CACHE_NAMESPACE, cache_key, ttl=AMI_CATALOG_CACHE_TTL)
+        if ami_catalog is not None:
+            return ami_catalog
+
+    ec2 = get_client("ec2")
+    paginator = ec2.get_paginator("describe_images")
+
+    latest_images = {}
+
+    for page in paginator.paginate(Filters=[
+                                       {
+                                           "Name": "tag:Stack",
+                                           "Values": [
+                                               ami_stack_name
+                                           ]
+                                       }
+                                   ],
+                                   Owners=["self"]):
+        for image in page.get("Images", []):
+            tags = {tag["Key"]: tag["Value"] for tag in image.get("Tags", [])}
+            image_version = tags.get("Version")
+            if image_version is None:
+                continue
+            # Parse each creation date just the once
+            creation_date = datetime.strptime(image["CreationDate"], CREATION_TIME_FORMAT)
+            if image_version not in latest_images or creation_date > latest_images[image_version][0]:
+                latest_images[image_version] = (creation_date, image)
+
+    ami_catalog = {
+        image_version: {
+            "ImageId": image["ImageId"],
+            "Name": image.get("Name"),
+            "CreationDate": image["CreationDate"]
+        }
+        for image_version, (_, image) in latest_images.items()
+    }
+
+    write_cache(AMI_CATALOG_CACHE_NAMESPACE, cache_key, ami_catalog)
+
+    return ami_catalog
+
+
+@profiled()
+def get_ami_id(pcluster_version, refresh=False):
     """
     Get the ami id for this version of aws parallel cluster
     Uses a tag based approach to find the correct ami for this parallel cluster version
+    If the version is missing from a cached catalog, the catalog is rebuilt in case the ami is new
     :param pcluster_version:
+    :param refresh: Ignore the local cache of amis
     :return:
     """
 
-    ec2 = boto3.client("ec2")
+    ami_catalog = get_ami_catalog(refresh=refresh)
 
-    images_dict = ec2.describe_images(
-            Filters=[
-                {
-                    "Name": "tag:Stack",
-                    "Values": [
-                        get_parallel_cluster_ami_stack_name()
-                    ]
-                },
-                {
-                    "Name": "tag:Version",
-                    "Values": [
-                        pcluster_version
-                    ]
-                }
-            ],
-            Owners=["self"]
-        )
+    if pcluster_version not in ami_catalog.keys() and not refresh:
+        ami_catalog = get_ami_catalog(refresh=True)
 
-    # Check if there's only one image (which there should be)
-    if len(images_dict["Images"]) == 0:
+    if pcluster_version not in ami_catalog.keys():
         logger.error("Could not retrieve the image id")
         logger.error("No image with the the stack tag '{}' "
                      "and version tags '{}' could be found for this aws user".format(
                         get_parallel_cluster_ami_stack_name(), pcluster_version
                      ))
         raise AMINotFoundError
-    elif len(images_dict["Images"]) == 1:
-        return images_dict["Images"][0]["ImageId"]
-    else:
-        # Get the latest created image
-        latest_creation = None
-        for image in images_dict["Images"]:
-            if latest_creation is None or \
-                datetime.strptime(image["CreationDate"], CREATION_TIME_FORMAT) > \
-                    datetime.strptime(latest_creation["CreationDate"], CREATION_TIME_FORMAT):
-                latest_creation = image
-        return latest_creation["ImageId"]
+
+    return ami_catalog[pcluster_version]["ImageId"]
 
 
 def get_parallel_cluster_tags(tags):
@@ -293,27 +653,119 @@ def get_parallel_cluster_tags(tags):
     return tags
 
 
-def ssm_parameter_value(ssm_parameter_name, encrypted=False):
+def ssm_parameter_value(ssm_parameter_name, encrypted=False, use_cache=True):
     """
     Return the value from ssm parameter store
     :return:
     """
 
-    ssm = boto3.client("ssm")
+    return get_ssm_parameter_values([ssm_parameter_name], encrypted=encrypted, use_cache=use_cache)[ssm_parameter_name]
+
+
+def get_ssm_parameter_cache_key(ssm_parameter_name):
+    """
+    The same parameter name holds different values in different accounts and regions
+    :param ssm_parameter_name:
+    :return:
+    """
 
-    parameter = ssm.get_parameter(Name=ssm_parameter_name,
-                                  WithDecryption=encrypted)
+    return get_cache_key(get_caller_identity()["Account"], get_session().region_name, ssm_parameter_name)
 
-    if "Parameter" not in parameter.keys():
-        logger.error("SSM parameter \"{}\" doesn't exist".format(ssm_parameter_name))
-        raise SSMParameterError
 
-    if "Value" not in parameter["Parameter"].keys():
-        logger.error("SSM parameter \"{}\" doesn't have 'Value' attribute. "
-                     "Check encryption value has been parsed correctly".format(ssm_parameter_name))
-        raise SSMParameterError
+@profiled()
+def get_ssm_parameter_values(ssm_parameter_names, encrypted=False, use_cache=True):
+    """
+    Return the values of many ssm parameters.
+    Values are memoised for the life of the process, and parameters not already known
+    are fetched in batches of SSM_MAX_PARAMETERS_PER_CALL.
+    Non-secret values are also kept in the local cache for SSM_PARAMETER_CACHE_TTL seconds,
+    encrypted values are never written to disk.
+    :param ssm_parameter_names: list of parameter names
+    :param encrypted: decrypt SecureString parameters
+    :param use_cache: Set to False to ignore (but refresh) the local cache
+    :return: dict of parameter name to value
+    """
+
+    ssm_parameter_names = list(dict.fromkeys(ssm_parameter_names))
+
+    with SSM_PARAMETER_VALUES_LOCK:
+        missing_parameter_names = [ssm_parameter_name
+                                   for ssm_parameter_name in ssm_parameter_names
+                                   if (ssm_parameter_name, encrypted) not in SSM_PARAMETER_VALUES]
+
+        # Try the local cache next
+        if use_cache and not encrypted:
+            for ssm_parameter_name in missing_parameter_names.copy():
+                cached_value = read_cache(SSM_CACHE_NAMESPACE, get_ssm_parameter_cache_key(ssm_parameter_name),
+                                          ttl=SSM_PARAMETER_CACHE_TTL)
+                if cached_value is not None:
+                    SSM_PARAMETER_VALUES[(ssm_parameter_name, encrypted)] = cached_value
+                    missing_parameter_names.remove(ssm_parameter_name)
+
+        # Then ask ssm for what's left
+        ssm = get_client("ssm")
+        for chunk_start in range(0, len(missing_parameter_names), SSM_MAX_PARAMETERS_PER_CALL):
+            names_chunk = missing_parameter_names[chunk_start:chunk_start + SSM_MAX_PARAMETERS_PER_CALL]
+
+            parameters = ssm.get_parameters(Names=names_chunk, WithDecryption=encrypted)
+
+            for invalid_parameter_name in parameters.get("InvalidParameters", []):
+                logger.error("SSM parameter \"{}\" doesn't exist".format(invalid_parameter_name))
+                raise SSMParameterError
+
+            for parameter in parameters.get("Parameters", []):
+                if "Value" not in parameter.keys():
+                    logger.error("SSM parameter \"{}\" doesn't have 'Value' attribute. "
+                                 "Check encryption value has been parsed correctly".format(parameter["Name"]))
+                    raise SSMParameterError
+                SSM_PARAMETER_VALUES[(parameter["Name"], encrypted)] = parameter["Value"]
+                # Never write secrets to disk
+                if not encrypted and not parameter.get("Type") == "SecureString":
+                    write_cache(SSM_CACHE_NAMESPACE, get_ssm_parameter_cache_key(parameter["Name"]),
+                                parameter["Value"])
+
+        return {ssm_parameter_name: SSM_PARAMETER_VALUES[(ssm_parameter_name, encrypted)]
+                for ssm_parameter_name in ssm_parameter_names}
+
+
+@profiled()
+def get_ssm_parameter_values_by_path(ssm_parameter_path, encrypted=False):
+    """
+    Return the values of every ssm parameter under a path, i.e /parallel_cluster/main
+    Values are memoised alongside those from get_ssm_parameter_values
+    :param ssm_parameter_path:
+    :param encrypted: decrypt SecureString parameters
+    :return: dict of parameter name to value
+    """
+
+    ssm = get_client("ssm")
+    paginator = ssm.get_paginator("get_parameters_by_path")
+
+    ssm_parameter_values = {}
+
+    for page in paginator.paginate(Path=ssm_parameter_path, Recursive=True, WithDecryption=encrypted):
+        for parameter in page.get("Parameters", []):
+            ssm_parameter_values[parameter["Name"]] = parameter["Value"]
+
+    with SSM_PARAMETER_VALUES_LOCK:
+        for ssm_parameter_name, parameter_value in ssm_parameter_values.items():
+            SSM_PARAMETER_VALUES[(ssm_parameter_name, encrypted)] = parameter_value
+
+    return ssm_parameter_values
+
+
+def resolve_ssm_parameter_keys(use_cache=True):
+    """
+    Fetch every parameter in AWS_SSM_PARAMETER_KEYS in as few calls as possible
+    :param use_cache:
+    :return: dict of AWS_SSM_PARAMETER_KEYS key to value
+    """
+
+    ssm_parameter_values = get_ssm_parameter_values(list(AWS_SSM_PARAMETER_KEYS.values()),
+                                                    encrypted=False, use_cache=use_cache)
 
-    return parameter["Parameter"]["Value"]
+    return {key: ssm_parameter_values[ssm_parameter_name]
+            for key, ssm_parameter_name in AWS_SSM_PARAMETER_KEYS.items()}
 
 
 def get_ami_version_str():
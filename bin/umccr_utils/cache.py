@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+"""
+Small on-disk cache for the results of slow lookups
+
+Each entry is a json file under <cache-dir>/<namespace>/<key>.json
+Entries are only trusted for a given time-to-live and are keyed on a hash of whatever they depend on
+
+from umccr_utils.cache import get_cache_key, read_cache, write_cache
+
+key = get_cache_key("some", "inputs")
+value = read_cache("namespace", key, ttl=300)
+if value is None:
+    value = slow_lookup()
+    write_cache("namespace", key, value)
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+from pathlib import Path
+from umccr_utils.logger import get_logger
+from umccr_utils.globals import UMCCR_CACHE_DIR_NAME
+
+logger = get_logger()
+
+
+def get_cache_dir():
+    """
+    Get the root directory of the cache, respects XDG_CACHE_HOME
+    :return:
+    """
+
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+
+    if xdg_cache_home is None or xdg_cache_home == "":
+        xdg_cache_home = Path.home() / ".cache"
+
+    return Path(xdg_cache_home) / UMCCR_CACHE_DIR_NAME
+
+
+def get_cache_key(*key_parts):
+    """
+    Hash the parts that a cache entry depends on into a single key
+    :param key_parts: any json serialisable values
+    :return:
+    """
+
+    return hashlib.sha256(json.dumps(key_parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_cache_path(namespace, key):
+    """
+    Path to the file for a cache entry
+    :param namespace:
+    :param key:
+    :return:
+    """
+
+    return get_cache_dir() / namespace / "{}.json".format(key)
+
+
+def read_cache(namespace, key, ttl):
+    """
+    Read a value from the cache
+    :param namespace:
+    :param key:
+    :param ttl: maximum age of the entry in seconds, None to trust the entry indefinitely
+    :return: the cached value, or None if there is no valid entry
+    """
+
+    cache_path = get_cache_path(namespace, key)
+
+    try:
+        with open(cache_path, 'r') as cache_h:
+            cache_entry = json.load(cache_h)
+    except (OSError, ValueError):
+        return None
+
+    if ttl is not None and time.time() - cache_entry.get("created", 0) > ttl:
+        logger.debug("Cache entry \"{}\" has expired".format(cache_path))
+        return None
+
+    return cache_entry.get("value")
+
+
+def write_cache(namespace, key, value):
+    """
+    Write a value to the cache.
+    The file is written to a temporary path and then moved into place so readers never see a partial entry.
+    Failing to write the cache is not fatal.
+    :param namespace:
+    :param key:
+    :param value: json serialisable value
+    :return:
+    """
+
+    cache_path = get_cache_path(namespace, key)
+
+    try:
+        cache_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        cache_fd, cache_tmp_path = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+        with os.fdopen(cache_fd, 'w') as cache_h:
+            json.dump({"created": time.time(), "value": value}, cache_h)
+        os.replace(cache_tmp_path, cache_path)
+    except OSError as os_error:
+        logger.debug("Could not write cache entry \"{}\": {}".format(cache_path, os_error))
+
+
+def clear_cache(namespace, key):
+    """
+    Remove an entry from the cache, if it exists
+    :param namespace:
+    :param key:
+    :return:
+    """
+
+    try:
+        get_cache_path(namespace, key).unlink()
+    except OSError:
+        pass
@@ -4,16 +4,93 @@
 Check functions
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from umccr_utils.logger import get_logger
-from umccr_utils.errors import NoCondaEnvError, PClusterVersionFailure, AWSVersionFailureError, AWSCredentialsError
-from umccr_utils.aws_wrappers import get_aws_version, check_credentials
-from umccr_utils.miscell import get_conda_env, get_pcluster_version
+from umccr_utils.errors import NoCondaEnvError, PClusterVersionFailure, AWSVersionFailureError
+from umccr_utils.aws_wrappers import get_aws_version, check_credentials, get_credentials_fingerprint, \
+    set_caller_identity
+from umccr_utils.miscell import get_conda_env, get_pcluster_version, get_binary_fingerprint
+from umccr_utils.cache import get_cache_key, read_cache, write_cache
+from umccr_utils.profiling import profiled
+from umccr_utils.globals import CHECK_ENV_CACHE_TTL
 from packaging import version
 
 logger = get_logger()
 
+CHECK_ENV_CACHE_NAMESPACE = "check_env"
 
-def check_env():
+
+@profiled()
+def check_pcluster_version():
+    """
+    Make sure we get a version back from pcluster
+    :return:
+    """
+
+    pcluster_version = get_pcluster_version()
+
+    if pcluster_version is None:
+        raise PClusterVersionFailure
+
+    return pcluster_version.strip()
+
+
+@profiled()
+def check_aws_version():
+    """
+    Make sure aws is at least version 2
+    :return:
+    """
+
+    aws_version = get_aws_version()
+
+    if not version.parse(aws_version) >= version.parse("2.0.0"):
+        raise AWSVersionFailureError
+
+    return aws_version
+
+
+def get_check_env_cache_key():
+    """
+    The result of check_env depends on which pcluster and aws binaries are on the PATH
+    and which credentials are in use, so the cache is keyed on all three
+    :return:
+    """
+
+    return get_cache_key(get_binary_fingerprint("pcluster"),
+                         get_binary_fingerprint("aws"),
+                         get_credentials_fingerprint())
+
+
+def run_env_checks():
+    """
+    Run the pcluster, aws and credential checks side by side.
+    Errors are raised in the same order the checks are listed in, regardless of which finished first
+    :return: dict of check results
+    """
+
+    env_checks = {
+        "pcluster_version": check_pcluster_version,
+        "aws_version": check_aws_version,
+        "caller_identity": check_credentials
+    }
+
+    with ThreadPoolExecutor(max_workers=len(env_checks)) as executor:
+        env_check_futures = {check_name: executor.submit(check_function)
+                             for check_name, check_function in env_checks.items()}
+
+    env_check_results = {check_name: env_check_future.result()
+                         for check_name, env_check_future in env_check_futures.items()}
+
+    # Only keep the identity itself, not the response metadata
+    env_check_results["caller_identity"] = {key: env_check_results["caller_identity"].get(key)
+                                            for key in ["UserId", "Account", "Arn"]}
+
+    return env_check_results
+
+
+@profiled()
+def check_env(use_cache=True):
     """
     Check we're in the right environment
     * Right pcluster conda env?
@@ -22,18 +99,26 @@ def check_env():
     * Right aws version?
     * Logged in to AWS?
     * We have an IP address?
-    :return:
+
+    A successful result is cached for CHECK_ENV_CACHE_TTL seconds
+    :param use_cache: Set to False to ignore any cached result and run the checks again
+    :return: dict of check results
     """
     if not get_conda_env() == "pcluster":
         raise NoCondaEnvError
 
-    if get_pcluster_version() is None:
-        raise PClusterVersionFailure
+    cache_key = get_check_env_cache_key()
 
-    if not version.parse(get_aws_version()) >= version.parse("2.0.0"):
-        raise AWSVersionFailureError
+    if use_cache:
+        env_check_results = read_cache(CHECK_ENV_CACHE_NAMESPACE, cache_key, ttl=CHECK_ENV_CACHE_TTL)
+        if env_check_results is not None:
+            logger.debug("Using cached environment checks")
+            # Saves asking sts again for the account name etc
+            set_caller_identity(env_check_results["caller_identity"])
+            return env_check_results
+
+    env_check_results = run_env_checks()
+
+    write_cache(CHECK_ENV_CACHE_NAMESPACE, cache_key, env_check_results)
 
-    try:
-        check_credentials()
-    except AWSCredentialsError:
-        raise AWSCredentialsError
+    return env_check_results
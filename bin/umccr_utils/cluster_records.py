@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""
+Lightweight record of a parallel cluster
+
+Kept free of any third party imports so that listing clusters stays quick to start up
+"""
+
+# Display name, attribute name and table width of each column shown to the user
+CLUSTER_COLUMNS = [
+    ("Name", "name", 30),
+    ("Status", "status", 24),
+    ("Version", "version", 10),
+    ("Head Node", "head_node", 21),
+    ("Creator", "creator", 20)
+]
+
+
+class ClusterRecord(object):
+    """
+    A single parallel cluster
+    Slotted as we may hold many of these and they are created on every listing
+    """
+
+    __slots__ = ["name", "status", "version", "head_node", "creator", "stack_name", "tags", "outputs"]
+
+    def __init__(self, name, status, version=None, head_node=None, creator=None,
+                 stack_name=None, tags=None, outputs=None):
+        self.name = name
+        self.status = status
+        self.version = version
+        self.head_node = head_node
+        self.creator = creator
+        self.stack_name = stack_name
+        self.tags = tags if tags is not None else {}
+        self.outputs = outputs if outputs is not None else {}
+
+    def __repr__(self):
+        return "ClusterRecord(name={!r}, status={!r}, head_node={!r})".format(self.name, self.status, self.head_node)
+
+    def to_row(self):
+        """
+        Values of the displayed columns, in column order
+        :return:
+        """
+
+        return [getattr(self, attribute) for _, attribute, _ in CLUSTER_COLUMNS]
+
+    def to_dict(self):
+        """
+        Displayed columns as a dict keyed by the column display name
+        :return:
+        """
+
+        return {column: getattr(self, attribute) for column, attribute, _ in CLUSTER_COLUMNS}
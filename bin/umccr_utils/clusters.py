@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+"""
+Fill in the details of listed clusters - head nodes and creators - and pick clusters out of a listing
+"""
+
+from fnmatch import fnmatchcase
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from umccr_utils.aws_wrappers import get_master_ec2_instance_id_from_pcluster_id, get_ec2_instance_tag_values
+from umccr_utils.errors import PClusterInstanceError
+from umccr_utils.logger import get_logger
+from umccr_utils.profiling import profiled
+from umccr_utils.globals import CFN_STATUSES, DEFAULT_MAX_WORKERS, DEFAULT_PCLUSTER_BACKEND
+
+logger = get_logger()
+
+
+def get_head_node(cluster_record, backend=DEFAULT_PCLUSTER_BACKEND):
+    """
+    Collect the id of the head node, given the pcluster has completed
+    :param cluster_record:
+    :param backend:
+    :return: the head node instance id, or None if the cluster has not completed
+    """
+
+    if cluster_record.status in CFN_STATUSES["completed"]:
+        return get_master_ec2_instance_id_from_pcluster_id(cluster_record.name, backend=backend)
+
+    return None
+
+
+def iter_head_nodes(cluster_records, max_workers=DEFAULT_MAX_WORKERS, backend=DEFAULT_PCLUSTER_BACKEND):
+    """
+    Set the head node of every cluster record, looked up on a bounded thread pool,
+    yielding each record as soon as its lookup has finished.
+    Each lookup is a separate api call / pcluster subprocess, so running them side by side means
+    the listing takes roughly as long as the slowest lookup rather than the sum of them all.
+    A cluster whose lookup fails is left without a head node rather than aborting the listing.
+    :param cluster_records: list of ClusterRecords, updated in place
+    :param max_workers:
+    :param backend:
+    :return: generator of ClusterRecords, in the order their lookups finish
+    """
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_cluster_record = {
+            executor.submit(get_head_node, cluster_record, backend=backend): cluster_record
+            for cluster_record in cluster_records
+        }
+
+        for future in as_completed(future_to_cluster_record):
+            cluster_record = future_to_cluster_record[future]
+            try:
+                cluster_record.head_node = future.result()
+            except PClusterInstanceError:
+                logger.warning("Could not retrieve the head node for cluster \"{}\"".format(cluster_record.name))
+            yield cluster_record
+
+
+@profiled()
+def resolve_head_nodes(cluster_records, max_workers=DEFAULT_MAX_WORKERS, backend=DEFAULT_PCLUSTER_BACKEND):
+    """
+    Set the head node of every cluster record, see iter_head_nodes
+    :param cluster_records: list of ClusterRecords, updated in place
+    :param max_workers:
+    :param backend:
+    :return:
+    """
+
+    for _ in iter_head_nodes(cluster_records, max_workers=max_workers, backend=backend):
+        pass
+
+
+@profiled()
+def resolve_creators(cluster_records):
+    """
+    Set the creator of every cluster record from the Creator tag of its head node,
+    using a single batched tag lookup.
+    Clusters without a head node, or whose head node has no Creator tag, are left without a creator
+    :param cluster_records: list of ClusterRecords, updated in place
+    :return:
+    """
+
+    head_nodes = [cluster_record.head_node
+                  for cluster_record in cluster_records
+                  if cluster_record.head_node is not None]
+
+    creator_tags = get_ec2_instance_tag_values(head_nodes, "Creator")
+
+    for cluster_record in cluster_records:
+        cluster_record.creator = creator_tags.get(cluster_record.head_node)
+
+
+def set_creators_from_stack_tags(cluster_records):
+    """
+    Set the creator of each cluster record from the Creator tag of its cloudformation stack,
+    which saves looking up the head node. Only records read from the stacks (cfn backend) carry tags.
+    :param cluster_records: list of ClusterRecords, updated in place
+    :return: list of the ClusterRecords still without a creator
+    """
+
+    for cluster_record in cluster_records:
+        if cluster_record.creator is None:
+            cluster_record.creator = cluster_record.tags.get("Creator")
+
+    return [cluster_record
+            for cluster_record in cluster_records
+            if cluster_record.creator is None]
+
+
+def cluster_status_matches(cluster_status, statuses):
+    """
+    Does the status of a cluster match any of the statuses given
+    A status can be a cloudformation stack status (i.e CREATE_COMPLETE) or a group of them from CFN_STATUSES (i.e failed)
+    :param cluster_status:
+    :param statuses:
+    :return:
+    """
+
+    for status in statuses:
+        if cluster_status == status or cluster_status in CFN_STATUSES.get(status, []):
+            return True
+
+    return False
+
+
+def select_cluster_records(cluster_records, name_patterns=None, creators=None, statuses=None):
+    """
+    Pick out the clusters matching all of the filters given, a filter left as None matches everything
+    :param cluster_records: list of ClusterRecords, creators must already be set to filter on them
+    :param name_patterns: list of cluster names or shell style globs, i.e 'training-*'
+    :param creators: list of creators
+    :param statuses: list of stack statuses or CFN_STATUSES groups
+    :return: list of ClusterRecords
+    """
+
+    selected_cluster_records = []
+
+    for cluster_record in cluster_records:
+        if name_patterns is not None and \
+                not any(fnmatchcase(cluster_record.name, name_pattern) for name_pattern in name_patterns):
+            continue
+        if creators is not None and cluster_record.creator not in creators:
+            continue
+        if statuses is not None and not cluster_status_matches(cluster_record.status, statuses):
+            continue
+        selected_cluster_records.append(cluster_record)
+
+    return selected_cluster_records
+
+
+def filter_cluster_records(cluster_records, name_patterns=None, creators=None, statuses=None,
+                           max_workers=DEFAULT_MAX_WORKERS, backend=DEFAULT_PCLUSTER_BACKEND):
+    """
+    Pick out the clusters matching all of the filters given, cheapest filters first.
+    Names and statuses come with the listing, creators come from the stacks' Creator tags,
+    only clusters still left without a creator have their head node looked up to read its Creator tag.
+    :param cluster_records: list of ClusterRecords
+    :param name_patterns: list of cluster names or shell style globs
+    :param creators: list of creators
+    :param statuses: list of stack statuses or CFN_STATUSES groups
+    :param max_workers: for any head node lookups
+    :param backend:
+    :return: list of ClusterRecords
+    """
+
+    cluster_records = select_cluster_records(cluster_records, name_patterns=name_patterns, statuses=statuses)
+
+    if creators is None:
+        return cluster_records
+
+    cluster_records_without_creators = set_creators_from_stack_tags(cluster_records)
+    if len(cluster_records_without_creators) > 0:
+        resolve_head_nodes(cluster_records_without_creators, max_workers=max_workers, backend=backend)
+        resolve_creators(cluster_records_without_creators)
+
+    return select_cluster_records(cluster_records, creators=creators)
+
+
+def get_cluster_records_without_head_nodes(cluster_records):
+    """
+    Pick out the completed clusters that are still without a head node, i.e their head node lookup failed
+    :param cluster_records: list of ClusterRecords
+    :return: list of ClusterRecords
+    """
+
+    return [cluster_record
+            for cluster_record in cluster_records
+            if cluster_record.status in CFN_STATUSES["completed"] and cluster_record.head_node is None]
+
+
+def get_cluster_changes(previous_cluster_records, current_cluster_records):
+    """
+    Compare two listings of the clusters.
+    Clusters whose status hasn't changed keep the head node and creator already resolved for them
+    :param previous_cluster_records: list of ClusterRecords, as last shown
+    :param current_cluster_records: list of ClusterRecords, as just listed
+    :return: tuple of lists of ClusterRecords - added, removed (from the previous listing) and changed
+    """
+
+    previous_by_name = {cluster_record.name: cluster_record for cluster_record in previous_cluster_records}
+    current_names = set(cluster_record.name for cluster_record in current_cluster_records)
+
+    added_cluster_records = []
+    changed_cluster_records = []
+
+    for cluster_record in current_cluster_records:
+        previous_cluster_record = previous_by_name.get(cluster_record.name)
+        if previous_cluster_record is None:
+            added_cluster_records.append(cluster_record)
+        elif not cluster_record.status == previous_cluster_record.status:
+            changed_cluster_records.append(cluster_record)
+        else:
+            cluster_record.head_node = previous_cluster_record.head_node
+            cluster_record.creator = previous_cluster_record.creator
+
+    removed_cluster_records = [cluster_record
+                               for cluster_record in previous_cluster_records
+                               if cluster_record.name not in current_names]
+
+    return added_cluster_records, removed_cluster_records, changed_cluster_records
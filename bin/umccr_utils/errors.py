@@ -68,6 +68,13 @@ class PClusterInstanceError(Exception):
     pass
 
 
+class PClusterDeleteError(Exception):
+    """
+    Could not delete the parallel cluster
+    """
+    pass
+
+
 class AMINotFoundError(Exception):
     """
     Could not find the ami based on the tags created
@@ -79,4 +86,25 @@ class SSMParameterError(Exception):
     """
     Couldn't evaluate the value of the ssm parameter correctly
     """
-    pass
\ No newline at end of file
+    pass
+
+
+class SubprocessTimeoutError(Exception):
+    """
+    A subprocess ran for longer than it was allowed to
+    """
+    pass
+
+
+class ManifestError(Exception):
+    """
+    Could not read the clusters out of a manifest file
+    """
+    pass
+
+
+class QueuePlanError(Exception):
+    """
+    Could not read a workload profile / queue plan, or plan queues for it
+    """
+    pass
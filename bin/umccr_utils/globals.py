@@ -14,6 +14,41 @@ AWS_SSM_PARAMETER_KEYS = {
 
 AWS_PARALLEL_CLUSTER_STACK_NAME = "ParallelCluster"
 
+# Ways of querying / modifying parallel clusters
+# cfn: read the parallelcluster cloudformation stacks directly through boto3
+# cli: shell out to the pcluster cli and parse its output
+PCLUSTER_BACKENDS = ["cfn", "cli"]
+DEFAULT_PCLUSTER_BACKEND = "cfn"
+
+# Every cluster created by pcluster sits in a cloudformation stack named parallelcluster-<cluster-name>
+PCLUSTER_STACK_PREFIX = "parallelcluster-"
+PCLUSTER_MASTER_LOGICAL_RESOURCE_ID = "MasterServer"
+
+# Local cache for the results of slow lookups, lives under ${XDG_CACHE_HOME:-~/.cache}
+UMCCR_CACHE_DIR_NAME = "umccr_pcluster"
+
+# How long (in seconds) a successful check_env is trusted for
+CHECK_ENV_CACHE_TTL = 300
+
+# How long (in seconds) the account etc of a set of credentials is kept in the local cache
+CALLER_IDENTITY_CACHE_TTL = 86400
+
+# Settings for every boto3 client, see umccr_utils.aws_clients
+AWS_CLIENT_MAX_POOL_CONNECTIONS = 20
+AWS_CLIENT_RETRIES = {
+    "max_attempts": 5,
+    "mode": "standard"
+}
+
+# How long (in seconds) non-secret ssm parameter values are kept in the local cache
+SSM_PARAMETER_CACHE_TTL = 3600
+
+# How long (in seconds) the catalog of parallel cluster amis is kept in the local cache
+AMI_CATALOG_CACHE_TTL = 86400
+
+# Number of threads used when looking up per-cluster information (head nodes etc)
+DEFAULT_MAX_WORKERS = 8
+
 UOM_IP_RANGE = ""  # TODO
 
 AWS_NETWORK = {
@@ -44,6 +44,29 @@ def get_parallel_cluster_extended_help():
     
     We also cater for the option of multiple filesystem types and adding in extra tags to each cluster.
     
+    Use --no-wait to return as soon as the creation has been submitted, 
+    and then start_cluster.py --cluster-name <NAME_OF_YOUR_CLUSTER> --attach to follow its progress later on.
+    
+    Several clusters can be launched side by side from a yaml (or json) manifest:
+    start_cluster.py --manifest clusters.yaml
+    
+    Where clusters.yaml looks like
+    
+    defaults:
+      file_system_type: efs
+      tags:
+        UseCase: Training
+    clusters:
+      - training-01
+      - cluster_name: training-02
+        file_system_type: fsx
+    
+    A status line is printed for each cluster as it finishes, use --max-workers to limit how many are created at once.
+    
+    Add --dry-run to print the configuration that would be used, without creating anything.
+    The dry run works from the local cache (account, ssm parameters and amis from earlier runs) and only calls aws
+    for whatever isn't cached yet, so once a cluster has been started it can be run offline.
+    
     ## Logging into a cluster
     
     Shown below is the bash alias required to make sure you can easily login with aws' ssm start-session command. 
@@ -61,12 +84,53 @@ def get_parallel_cluster_extended_help():
     
     Will return the cluster name, master node instance id, along with the user that created the cluster.  
     
+    Use --watch [SECONDS] to keep listing the clusters (every 30 seconds by default) while waiting on launches, 
+    only clusters that are new, removed or have changed status are printed, along with any head node found on a retry.
+    An aws error (i.e throttling) during a listing is logged and the listing is tried again after the next interval.
+    
+    Narrow the list down with --name-prefix, --creator and/or --status (a status or one of completed, failed, unexpected), 
+    use --format csv, json or jsonl (with --output to write to a file) for output a script can read, i.e
+    
+    list_clusters.py --creator <YOUR_USERNAME> --status failed --format jsonl
+    
     ## Stopping a cluster
     
     This will shut down a cluster 
     
     stop_cluster.py --cluster-name <NAME_OF_CLUSTER_TO_CLOSE>
     
+    Several clusters can be shut down at once, by name, glob, creator or status, i.e
+    
+    stop_cluster.py --cluster-name 'training-*' --creator <YOUR_USERNAME> --wait
+    stop_cluster.py --status failed --dry-run
+    
+    --wait follows every deletion until it is done, --dry-run just prints the clusters that would be shut down.
+    
+    ## Listing amis
+    
+    This will list the latest parallel cluster ami for each version, use --refresh to skip the local cache
+    
+    list_amis.py
+    
+    ## Planning queues
+    
+    This will recommend the instance types behind each queue for the jobs you expect to run on it
+    
+    plan_queues.py --workload workload.yaml --output queue-plan.json
+    
+    Where workload.yaml lists the steps run on each queue, memory is per job and runtime is in hours
+    
+    queues:
+      compute:
+        steps:
+          - name: align
+            cores: 16
+            memory: 32G
+            runtime: 1.5
+            count: 24
+    
+    Then launch a cluster with those queues with start_cluster.py --cluster-name <NAME_OF_YOUR_CLUSTER> --queue-plan queue-plan.json
+    
     """.format(get_ssm_login_help())
 
     return getting_started_help
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+"""
+Offline catalog of the instance types our compute queues can be planned on
+
+A snapshot, so planning needs no aws calls (or pricing api permissions).
+Prices are Linux USD per hour in ap-southeast-2, spot prices are a typical recent price rather than a guarantee.
+Network is the headline bandwidth in Gbps, 'up to' bandwidths are taken at their burst value.
+
+Refresh the snapshot by hand when prices move, and bump INSTANCE_CATALOG_SNAPSHOT_DATE.
+"""
+
+INSTANCE_CATALOG_REGION = "ap-southeast-2"
+INSTANCE_CATALOG_SNAPSHOT_DATE = "2021-06-01"
+
+# Instance type: vcpus, memory (GiB), network (Gbps), on-demand price, spot price
+INSTANCE_CATALOG_ROWS = [
+    # Compute optimised
+    ("c5.large", 2, 4, 10, 0.111, 0.037),
+    ("c5.xlarge", 4, 8, 10, 0.222, 0.074),
+    ("c5.2xlarge", 8, 16, 10, 0.444, 0.147),
+    ("c5.4xlarge", 16, 32, 10, 0.888, 0.294),
+    ("c5.9xlarge", 36, 72, 10, 1.998, 0.672),
+    ("c5.12xlarge", 48, 96, 12, 2.664, 0.891),
+    ("c5.18xlarge", 72, 144, 25, 3.996, 1.342),
+    ("c5.24xlarge", 96, 192, 25, 5.328, 1.781),
+    # Compute optimised, higher network bandwidth
+    ("c5n.large", 2, 5.25, 25, 0.139, 0.042),
+    ("c5n.xlarge", 4, 10.5, 25, 0.278, 0.084),
+    ("c5n.2xlarge", 8, 21, 25, 0.556, 0.167),
+    ("c5n.4xlarge", 16, 42, 25, 1.112, 0.334),
+    ("c5n.9xlarge", 36, 96, 50, 2.502, 0.751),
+    ("c5n.18xlarge", 72, 192, 100, 5.004, 1.501),
+    # General purpose
+    ("m5.large", 2, 8, 10, 0.120, 0.036),
+    ("m5.xlarge", 4, 16, 10, 0.240, 0.073),
+    ("m5.2xlarge", 8, 32, 10, 0.480, 0.146),
+    ("m5.4xlarge", 16, 64, 10, 0.960, 0.291),
+    ("m5.8xlarge", 32, 128, 10, 1.920, 0.583),
+    ("m5.12xlarge", 48, 192, 12, 2.880, 0.874),
+    ("m5.16xlarge", 64, 256, 20, 3.840, 1.166),
+    ("m5.24xlarge", 96, 384, 25, 5.760, 1.748),
+    # Memory optimised
+    ("r5.large", 2, 16, 10, 0.151, 0.039),
+    ("r5.xlarge", 4, 32, 10, 0.302, 0.079),
+    ("r5.2xlarge", 8, 64, 10, 0.604, 0.158),
+    ("r5.4xlarge", 16, 128, 10, 1.208, 0.315),
+    ("r5.8xlarge", 32, 256, 10, 2.416, 0.631),
+    ("r5.12xlarge", 48, 384, 12, 3.624, 0.946),
+    ("r5.16xlarge", 64, 512, 20, 4.832, 1.262),
+    ("r5.24xlarge", 96, 768, 25, 7.248, 1.893),
+]
+
+INSTANCE_CATALOG = {
+    instance_type: {
+        "vcpus": vcpus,
+        "memory": memory,
+        "network": network,
+        "ondemand_price": ondemand_price,
+        "spot_price": spot_price
+    }
+    for instance_type, vcpus, memory, network, ondemand_price, spot_price in INSTANCE_CATALOG_ROWS
+}
+
+
+def get_instance_price(instance_type, compute_type):
+    """
+    Hourly price of an instance type
+    :param instance_type:
+    :param compute_type: spot or ondemand, as used by the queues in AWS_PARTITION_QUEUES
+    :return:
+    """
+
+    if compute_type == "spot":
+        return INSTANCE_CATALOG[instance_type]["spot_price"]
+
+    return INSTANCE_CATALOG[instance_type]["ondemand_price"]
@@ -8,43 +8,103 @@ Invoke with the following
 from umccr_utils.logger import get_logger
 
 logger = get_logger()
+
+Set UMCCR_PCLUSTER_JSON_LOG to a file path to also write every log record (debug and up) to that file as json lines.
 """
 
+import os
+import sys
+import json
+import atexit
 import logging
-import inspect
 
 # Logger styles
 CONSOLE_LOGGER_STYLE = '%(asctime)s %(funcName)-25s: %(levelname)-8s %(message)s'
 LOGGER_DATEFMT = '%y-%m-%d %H:%M:%S'
 
+# Environment variable holding the path of the optional json lines log file
+JSON_LOG_FILE_ENV_VAR = "UMCCR_PCLUSTER_JSON_LOG"
+
 
 def get_caller_function():
     """
     Get the function that was used to call the previous
     Some loggers report <module>
 
+    Reads the code object of the frame directly rather than through inspect.stack(),
+    which would build the whole stack and read the source of every frame from disk
+
     :return:
     """
-    # Get the inspect stack trace
-    inspect_stack = inspect.stack()
-
-    # Since we're already in a function, we need the third attribute
+    # Since we're already in a function, we need the third frame
     # i.e function of interest -> function that called this one -> this function
-    frame_info = inspect_stack[2]
-
-    # Required attribute is' function
-    function_id = getattr(frame_info, "function", None)
-
-    if function_id is None:
+    try:
+        frame = sys._getframe(2)
+    except ValueError:
         # Don't really want to break on this just yet but code is ready to go for it.
         return None
-    else:
-        return function_id
+
+    return frame.f_code.co_name
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Format each record as a single line json object
+    """
+
+    def format(self, record):
+        log_entry = {
+            "time": self.formatTime(record, datefmt=LOGGER_DATEFMT),
+            "created": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "function": record.funcName,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+
+        if record.exc_info:
+            log_entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(log_entry)
 
 
-def initialise_logger():
+def add_json_log_handler(json_log_file, level=logging.DEBUG):
+    """
+    Write log records to json_log_file as json lines.
+    Records are put on a queue and written out by a background thread,
+    so logging (i.e each line of a long running subprocess) never waits on the disk.
+    The queue is flushed when the interpreter exits.
+    :param json_log_file: path to append to
+    :param level:
+    :return: the QueueListener writing the records
+    """
+
+    # Only needed if asked for, so kept out of start up
+    import queue
+    from logging.handlers import QueueHandler, QueueListener
+
+    file_handler = logging.FileHandler(json_log_file)
+    file_handler.setFormatter(JsonLinesFormatter())
+
+    log_queue = queue.SimpleQueue()
+
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setLevel(level)
+
+    queue_listener = QueueListener(log_queue, file_handler)
+    queue_listener.start()
+    atexit.register(queue_listener.stop)
+
+    logging.getLogger().addHandler(queue_handler)
+
+    return queue_listener
+
+
+def initialise_logger(json_log_file=None):
     """
     Return the logger in a nice logging format
+    :param json_log_file: Optional path to also write json lines to, defaults to $UMCCR_PCLUSTER_JSON_LOG
     :return:
     """
     # Initialise logger
@@ -59,11 +119,17 @@ def initialise_logger():
     logging.getLogger().setLevel(logging.DEBUG)
     logging.getLogger().addHandler(console)
 
+    if json_log_file is None:
+        json_log_file = os.environ.get(JSON_LOG_FILE_ENV_VAR)
+
+    if json_log_file is not None and not json_log_file == "":
+        add_json_log_handler(json_log_file)
+
 
 def get_logger():
     """
     Get the name of where this function was called from - return a logging object
-    Use a trackback from the inspect to do this
+    Use the caller's frame to do this
     :return:
     """
     function_that_called_this_one = get_caller_function()
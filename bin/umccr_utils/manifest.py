@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""
+Read a manifest of clusters to launch together, i.e
+
+defaults:
+  file_system_type: efs
+  tags:
+    UseCase: Training
+clusters:
+  - cluster_name: training-01
+  - cluster_name: training-02
+    file_system_type: fsx
+    no_rollback: true
+    extra_parameters:
+      MyParameter: value
+
+Values under defaults apply to every cluster unless the cluster sets them itself, tags are merged.
+A cluster may also be given by its name alone. Manifests can be yaml or json.
+"""
+
+import json
+from pathlib import Path
+from umccr_utils.errors import ManifestError
+from umccr_utils.logger import get_logger
+
+logger = get_logger()
+
+MANIFEST_CLUSTER_KEYS = ["cluster_name", "file_system_type", "no_rollback", "extra_parameters", "tags"]
+MANIFEST_FILE_SYSTEM_TYPES = ["efs", "fsx"]
+
+
+def read_manifest_file(manifest_path):
+    """
+    Load the manifest file, json if the suffix says so, otherwise yaml
+    yaml is only imported here so the single cluster path doesn't pay for it
+    :param manifest_path:
+    :return:
+    """
+
+    manifest_path = Path(manifest_path)
+
+    if not manifest_path.is_file():
+        logger.error("Could not find manifest file \"{}\"".format(manifest_path))
+        raise ManifestError
+
+    with open(manifest_path, 'r') as manifest_h:
+        if manifest_path.suffix == ".json":
+            try:
+                return json.load(manifest_h)
+            except json.JSONDecodeError as json_error:
+                logger.error("Could not read manifest \"{}\" as json: {}".format(manifest_path, json_error))
+                raise ManifestError
+
+        import yaml
+        try:
+            return yaml.safe_load(manifest_h)
+        except yaml.YAMLError as yaml_error:
+            logger.error("Could not read manifest \"{}\" as yaml: {}".format(manifest_path, yaml_error))
+            raise ManifestError
+
+
+def check_manifest_cluster(manifest_cluster):
+    """
+    Make sure a cluster entry only has the keys we know about, with sensible values
+    :param manifest_cluster:
+    :return:
+    """
+
+    unknown_keys = [key for key in manifest_cluster.keys() if key not in MANIFEST_CLUSTER_KEYS]
+    if len(unknown_keys) > 0:
+        logger.error("Unknown keys {} in manifest entry for cluster \"{}\", expected one of {}".format(
+            ", ".join(unknown_keys), manifest_cluster.get("cluster_name"), ", ".join(MANIFEST_CLUSTER_KEYS)
+        ))
+        raise ManifestError
+
+    if manifest_cluster.get("cluster_name") is None:
+        logger.error("Every cluster in the manifest needs a cluster_name")
+        raise ManifestError
+
+    file_system_type = manifest_cluster.get("file_system_type")
+    if file_system_type is not None and file_system_type not in MANIFEST_FILE_SYSTEM_TYPES:
+        logger.error("file_system_type for cluster \"{}\" must be one of {}".format(
+            manifest_cluster["cluster_name"], ", ".join(MANIFEST_FILE_SYSTEM_TYPES)
+        ))
+        raise ManifestError
+
+    for dict_key in ["extra_parameters", "tags"]:
+        if manifest_cluster.get(dict_key) is not None and not isinstance(manifest_cluster[dict_key], dict):
+            logger.error("{} for cluster \"{}\" must be a mapping of key-value pairs".format(
+                dict_key, manifest_cluster["cluster_name"]
+            ))
+            raise ManifestError
+
+
+def get_manifest_clusters(manifest_path):
+    """
+    Read the manifest into one dict per cluster, with the defaults filled in
+    :param manifest_path:
+    :return: list of dicts, keys from MANIFEST_CLUSTER_KEYS
+    """
+
+    manifest = read_manifest_file(manifest_path)
+
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("clusters"), list):
+        logger.error("Manifest \"{}\" must have a list of clusters under the 'clusters' key".format(manifest_path))
+        raise ManifestError
+
+    defaults = manifest.get("defaults") or {}
+    if not isinstance(defaults, dict) or "cluster_name" in defaults:
+        logger.error("defaults in manifest \"{}\" must be a mapping without a cluster_name".format(manifest_path))
+        raise ManifestError
+
+    manifest_clusters = []
+
+    for manifest_entry in manifest["clusters"]:
+        if isinstance(manifest_entry, str):
+            manifest_entry = {"cluster_name": manifest_entry}
+        elif not isinstance(manifest_entry, dict):
+            logger.error("Could not read \"{}\" as a cluster in manifest \"{}\"".format(manifest_entry, manifest_path))
+            raise ManifestError
+
+        manifest_cluster = defaults.copy()
+        manifest_cluster.update(manifest_entry)
+
+        # Tags are merged rather than replaced
+        if isinstance(defaults.get("tags"), dict) and isinstance(manifest_entry.get("tags"), dict):
+            manifest_cluster["tags"] = dict(defaults["tags"], **manifest_entry["tags"])
+
+        check_manifest_cluster(manifest_cluster)
+
+        manifest_clusters.append(manifest_cluster)
+
+    cluster_names = [manifest_cluster["cluster_name"] for manifest_cluster in manifest_clusters]
+    duplicate_names = sorted(set([cluster_name
+                                  for cluster_name in cluster_names
+                                  if cluster_names.count(cluster_name) > 1]))
+    if len(duplicate_names) > 0:
+        logger.error("Clusters {} appear more than once in manifest \"{}\"".format(
+            ", ".join(duplicate_names), manifest_path
+        ))
+        raise ManifestError
+
+    if len(manifest_clusters) == 0:
+        logger.error("No clusters found in manifest \"{}\"".format(manifest_path))
+        raise ManifestError
+
+    return manifest_clusters
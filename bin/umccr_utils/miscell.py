@@ -6,13 +6,33 @@ Random functions that don't quite go anywhere
 
 import subprocess
 import os
+import shutil
 import getpass
+import logging
+import threading
+import selectors
+import time
+from collections import deque
 from umccr_utils.logger import get_logger
-from umccr_utils.errors import NoCondaEnvError
+from umccr_utils.errors import NoCondaEnvError, SubprocessTimeoutError
+from umccr_utils.profiling import span
 import json
 
 logger = get_logger()
 
+# Number of lines of stdout / stderr kept in memory by a streamed subprocess for error reporting
+STREAM_TAIL_LINES = 200
+
+# Seconds to give a cancelled subprocess to exit after SIGTERM before it is killed
+STREAM_TERMINATE_GRACE_PERIOD = 10
+
+# Seconds to keep reading a streamed subprocess's pipes once it has exited,
+# a grandchild (i.e one started by the pcluster cli) can hold them open long after
+STREAM_DRAIN_TIMEOUT = 5
+
+# Seconds between checks of whether a pipe reader has been asked to stop
+STREAM_POLL_INTERVAL = 0.5
+
 
 def get_conda_prefix():
     """
@@ -54,6 +74,27 @@ def get_pcluster_version():
     return pcluster_version_output
 
 
+def get_binary_fingerprint(binary_name):
+    """
+    Get the path and modification time of a binary on the user's PATH
+    Used to tell if a binary has been swapped out / upgraded since we last checked it
+    :param binary_name:
+    :return: tuple of (path, mtime), (None, None) if the binary cannot be found
+    """
+
+    binary_path = shutil.which(binary_name)
+
+    if binary_path is None:
+        return None, None
+
+    try:
+        binary_mtime = os.stat(binary_path).st_mtime
+    except OSError:
+        return binary_path, None
+
+    return binary_path, binary_mtime
+
+
 def get_user():
     """
     Return the user name
@@ -62,34 +103,26 @@ def get_user():
     return getpass.getuser()
 
 
-def run_subprocess_proc(*args, **kwargs):
+def get_command_str(command):
     """
-    Utilities runner for running a subprocess command and printing log files
-    :param args:
-    :param kwargs:
+    Quote a command for logging
+    :param command: list or str
     :return:
     """
 
-    subprocess_proc = subprocess.run(*args, **kwargs)
-
-    command_str = '" "'.join(subprocess_proc.args) \
-        if type(subprocess_proc.args) == list \
-        else subprocess_proc.args
-    command_str = '"' + command_str + '"'
+    command_str = '" "'.join(map(str, command)) \
+        if type(command) == list \
+        else command
 
-    # Get outputs
-    if subprocess_proc.stdout is not None:
-        command_stdout = subprocess_proc.stdout.decode()
-    else:
-        command_stdout = None
+    return '"' + command_str + '"'
 
-    if subprocess_proc.stderr is not None:
-        command_stderr = subprocess_proc.stderr.decode()
-    else:
-        command_stderr = None
 
-    # Get return code
-    command_returncode = subprocess_proc.returncode
+def log_subprocess_result(command_str, command_returncode, command_stdout, command_stderr):
+    """
+    Log the return code and outputs of a completed command
+    Warnings if the command failed, debug otherwise
+    :return:
+    """
 
     if not command_returncode == 0:
         # Print returncode to warning
@@ -111,6 +144,164 @@ def run_subprocess_proc(*args, **kwargs):
         if command_stderr is not None:
             logger.debug("Stderr was: \n\"{}\"".format(command_stderr.strip()))
 
+
+def run_subprocess_proc(*args, stream=False, **kwargs):
+    """
+    Utilities runner for running a subprocess command and printing log files
+    :param args:
+    :param stream: Log output line by line as the command runs, see run_subprocess_proc_streaming
+    :param kwargs:
+    :return:
+    """
+
+    # Spans are named after the program and its subcommand (i.e 'pcluster instances'), so the summary adds them up
+    command = args[0] if len(args) > 0 else kwargs.get("args")
+    command_parts = command if type(command) == list else str(command).split()
+
+    with span(" ".join(map(str, command_parts[:2])), category="subprocess",
+              command=get_command_str(command), stream=stream):
+        if stream:
+            return run_subprocess_proc_streaming(*args, **kwargs)
+
+        subprocess_proc = subprocess.run(*args, **kwargs)
+
+    command_str = get_command_str(subprocess_proc.args)
+
+    # Get outputs
+    if subprocess_proc.stdout is not None:
+        command_stdout = subprocess_proc.stdout.decode()
+    else:
+        command_stdout = None
+
+    if subprocess_proc.stderr is not None:
+        command_stderr = subprocess_proc.stderr.decode()
+    else:
+        command_stderr = None
+
+    # Get return code
+    command_returncode = subprocess_proc.returncode
+
+    log_subprocess_result(command_str, command_returncode, command_stdout, command_stderr)
+
+    return command_returncode, command_stdout, command_stderr
+
+
+def terminate_subprocess(subprocess_proc):
+    """
+    Ask a process to stop, kill it if it hasn't stopped after the grace period
+    :param subprocess_proc:
+    :return:
+    """
+
+    if subprocess_proc.poll() is not None:
+        return
+
+    subprocess_proc.terminate()
+
+    try:
+        subprocess_proc.wait(timeout=STREAM_TERMINATE_GRACE_PERIOD)
+    except subprocess.TimeoutExpired:
+        subprocess_proc.kill()
+        subprocess_proc.wait()
+
+
+def run_subprocess_proc_streaming(command, tail_lines=STREAM_TAIL_LINES, log_file=None, line_callback=None,
+                                  log_level=logging.INFO, timeout=None, capture_output=None, **kwargs):
+    """
+    Run a command, reading stdout and stderr concurrently and handling each line as it arrives.
+    Only the last tail_lines lines of each pipe are held in memory,
+    so long running, chatty commands (i.e pcluster create) don't buffer their whole output.
+    :param command: list or str, as for subprocess.Popen
+    :param tail_lines: Number of lines of each pipe to keep for the return value / error reporting
+    :param log_file: Optional path to append every line of output to
+    :param line_callback: Optional function called with (stream_name, line) for every line, stream_name is stdout or stderr
+    :param log_level: Level to log each line at
+    :param timeout: Optional wall clock limit in seconds, raises SubprocessTimeoutError once exceeded
+    :param capture_output: Ignored, output is always captured
+    :param kwargs: passed to subprocess.Popen
+    :return: returncode, stdout tail, stderr tail
+    """
+
+    command_str = get_command_str(command)
+
+    stdout_tail = deque(maxlen=tail_lines)
+    stderr_tail = deque(maxlen=tail_lines)
+
+    log_file_lock = threading.Lock()
+    log_file_h = open(log_file, 'a') if log_file is not None else None
+
+    # Set once the pipes have had STREAM_DRAIN_TIMEOUT to empty after the command exits
+    stop_reading = threading.Event()
+
+    def handle_line(raw_line, stream_name, tail):
+        line = raw_line.decode(errors="replace").rstrip("\n")
+        tail.append(line)
+        logger.log(log_level, "{}: {}".format(stream_name, line))
+        if log_file_h is not None:
+            with log_file_lock:
+                log_file_h.write("{}: {}\n".format(stream_name, line))
+        if line_callback is not None:
+            line_callback(stream_name, line)
+
+    def read_pipe(pipe, stream_name, tail):
+        # Wait on the pipe with select rather than blocking in readline, so the reader can be stopped
+        pipe_fd = pipe.fileno()
+        partial_line = b""
+        with selectors.DefaultSelector() as selector:
+            selector.register(pipe_fd, selectors.EVENT_READ)
+            while not stop_reading.is_set():
+                if len(selector.select(timeout=STREAM_POLL_INTERVAL)) == 0:
+                    continue
+                chunk = os.read(pipe_fd, 65536)
+                if chunk == b"":
+                    break
+                *raw_lines, partial_line = (partial_line + chunk).split(b"\n")
+                for raw_line in raw_lines:
+                    handle_line(raw_line, stream_name, tail)
+        if not partial_line == b"":
+            handle_line(partial_line, stream_name, tail)
+        pipe.close()
+
+    subprocess_proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+
+    reader_threads = [
+        threading.Thread(target=read_pipe, args=(subprocess_proc.stdout, "stdout", stdout_tail), daemon=True),
+        threading.Thread(target=read_pipe, args=(subprocess_proc.stderr, "stderr", stderr_tail), daemon=True)
+    ]
+
+    for reader_thread in reader_threads:
+        reader_thread.start()
+
+    try:
+        command_returncode = subprocess_proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        logger.error("Command {} did not complete within {} seconds, stopping it".format(command_str, timeout))
+        terminate_subprocess(subprocess_proc)
+        raise SubprocessTimeoutError
+    except KeyboardInterrupt:
+        logger.warning("Interrupted, stopping command {}".format(command_str))
+        terminate_subprocess(subprocess_proc)
+        raise
+    finally:
+        # Don't wait forever on pipes something else is still holding open
+        drain_deadline = time.monotonic() + STREAM_DRAIN_TIMEOUT
+        for reader_thread in reader_threads:
+            reader_thread.join(timeout=max(drain_deadline - time.monotonic(), 0))
+        if any(reader_thread.is_alive() for reader_thread in reader_threads):
+            logger.warning("Output of command {} is still held open after it ended, no longer reading it".format(
+                command_str))
+        # Readers notice within STREAM_POLL_INTERVAL, and close their pipe on the way out
+        stop_reading.set()
+        for reader_thread in reader_threads:
+            reader_thread.join()
+        if log_file_h is not None:
+            log_file_h.close()
+
+    command_stdout = "\n".join(stdout_tail)
+    command_stderr = "\n".join(stderr_tail)
+
+    log_subprocess_result(command_str, command_returncode, command_stdout, command_stderr)
+
     return command_returncode, command_stdout, command_stderr
 
 
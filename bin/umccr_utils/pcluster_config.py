@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+"""
+Render the pcluster configuration file for a cluster
+
+Rendering is kept apart from the aws lookups it depends on (ssm parameters, ami, network),
+these are passed in already resolved, so a configuration can be rendered offline and rendered many times over cheaply.
+
+Rendered configurations are stored under a hash of their content in the local cache directory,
+so launching an identical cluster again reuses the file already on disk.
+"""
+
+import io
+import os
+import hashlib
+import tempfile
+import configparser
+from pathlib import Path
+from umccr_utils.cache import get_cache_dir
+from umccr_utils.logger import get_logger
+from umccr_utils.profiling import profiled
+from umccr_utils.version import version as umccr_version
+from umccr_utils.globals import \
+    AWS_GLOBAL_SETTINGS, AWS_REGION, AWS_CLUSTER_BASICS, AWS_PARTITION_QUEUES, AWS_FILESYSTEM, \
+    AWS_COMPUTE_RESOURCES, AWS_ALIASES
+
+logger = get_logger()
+
+PCLUSTER_CONFIG_CACHE_NAMESPACE = "pcluster_configs"
+
+
+@profiled()
+def render_pcluster_config(cluster_name, file_system_type, configuration_inputs,
+                           partition_queues=None, compute_resources=None):
+    """
+    Render the configuration for a cluster, no aws calls are made
+
+    Configuration requires the following components
+    * aws
+    * global
+    * cluster <cluster-name>
+    * vpc <network-name>
+    * <filesystem-type> <filesystem-name>
+    * queue <queue-name> (can be specified multiple times)
+    * compute_resource <resource-name> (can be specified multiple times)
+    * aliases (optional)
+
+    :param cluster_name:
+    :param file_system_type: one of the keys of AWS_FILESYSTEM
+    :param configuration_inputs: dict with s3_config_root, ami_id and network keys
+    :param partition_queues: Defaults to AWS_PARTITION_QUEUES
+    :param compute_resources: Defaults to AWS_COMPUTE_RESOURCES
+    :return: the configuration as a str
+    """
+
+    if partition_queues is None:
+        partition_queues = AWS_PARTITION_QUEUES
+
+    if compute_resources is None:
+        compute_resources = AWS_COMPUTE_RESOURCES
+
+    pcluster_config = configparser.ConfigParser()
+
+    # Add aws and globals settings
+    pcluster_config["aws"] = {"aws_region_name": AWS_REGION}
+    pcluster_config["globals"] = AWS_GLOBAL_SETTINGS
+
+    # Intialise cluster
+    cluster_basics = AWS_CLUSTER_BASICS.copy()
+    # Add pre-install and post-install attributes
+    cluster_basics["pre_install"] = "{}/{}/bootstrap/pre_install.sh".format(
+        configuration_inputs["s3_config_root"],
+        umccr_version
+    )
+    cluster_basics["post_install"] = "{}/{}/bootstrap/post_install.sh".format(
+        configuration_inputs["s3_config_root"],
+        umccr_version
+    )
+
+    # Add ami
+    cluster_basics["custom_ami"] = configuration_inputs["ami_id"]
+    pcluster_config["cluster {}".format(cluster_name)] = cluster_basics
+
+    # Add in network settings:
+    pcluster_config["vpc {}_network".format(cluster_name)] = configuration_inputs["network"]
+    pcluster_config["cluster {}".format(cluster_name)]["vpc_settings"] = "{}_network".format(cluster_name)
+
+    # Add in file system settings
+    pcluster_config["{} {}_fs".format(file_system_type, cluster_name)] = AWS_FILESYSTEM[file_system_type]
+    pcluster_config["cluster {}".format(cluster_name)]["{}_settings".format(file_system_type)] = \
+        "{}_fs".format(cluster_name)
+
+    # Add queue settings to cluster config for each queue
+    for queue_name, queue_dict in partition_queues.items():
+        # Create a tmp copy
+        modified_queue_dict = queue_dict.copy()
+        # Modify each in the list to match the compute resources below
+        compute_type = queue_dict["compute_type"]
+        extended_compute_resources = []
+        for compute_resource in modified_queue_dict["compute_resource_settings"]:
+            extended_compute_resources.append("{}_{}".format(compute_resource, compute_type))
+        modified_queue_dict["compute_resource_settings"] = ', '.join(extended_compute_resources)
+        pcluster_config["queue {}".format(queue_name)] = modified_queue_dict
+
+    pcluster_config["cluster {}".format(cluster_name)]["queue_settings"] = ", ".join(list(partition_queues.keys()))
+
+    # Add compute resoures to cluster config
+    for queue_name, queue_dict in partition_queues.items():
+        compute_type = queue_dict["compute_type"]
+        for compute_resource in queue_dict["compute_resource_settings"]:
+            pcluster_config["compute_resource {}_{}".format(compute_resource, compute_type)] = \
+                compute_resources[compute_resource]
+
+    # Add aliases to cluster config
+    pcluster_config["aliases"] = AWS_ALIASES
+
+    config_h = io.StringIO()
+    pcluster_config.write(config_h)
+
+    return config_h.getvalue()
+
+
+def get_pcluster_config_hash(pcluster_config_str):
+    """
+    Hash of the content of a rendered configuration
+    :param pcluster_config_str:
+    :return:
+    """
+
+    return hashlib.sha256(pcluster_config_str.encode()).hexdigest()
+
+
+@profiled()
+def write_pcluster_config(pcluster_config_str):
+    """
+    Write a rendered configuration to <cache-dir>/pcluster_configs/<content-hash>.conf,
+    reusing the file if an identical configuration has been written before.
+    Falls back to a temporary file if the cache directory can't be written to.
+    :param pcluster_config_str:
+    :return: Path to the configuration file
+    """
+
+    pcluster_config_dir = get_cache_dir() / PCLUSTER_CONFIG_CACHE_NAMESPACE
+    pcluster_config_path = pcluster_config_dir / "{}.conf".format(get_pcluster_config_hash(pcluster_config_str))
+
+    if pcluster_config_path.is_file():
+        logger.debug("Reusing configuration file \"{}\"".format(pcluster_config_path))
+        return pcluster_config_path
+
+    try:
+        pcluster_config_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        config_fd, config_tmp_path = tempfile.mkstemp(dir=pcluster_config_dir, suffix=".tmp")
+        with os.fdopen(config_fd, 'w') as config_h:
+            config_h.write(pcluster_config_str)
+        os.replace(config_tmp_path, pcluster_config_path)
+    except OSError as os_error:
+        logger.debug("Could not write configuration file \"{}\": {}".format(pcluster_config_path, os_error))
+        with tempfile.NamedTemporaryFile('w', prefix="pcluster-", suffix=".conf", delete=False) as config_h:
+            config_h.write(pcluster_config_str)
+        return Path(config_h.name)
+
+    return pcluster_config_path
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+"""
+Time the phases of a command and write them out as a chrome trace
+
+Spans are only recorded once profiling has been started, otherwise they cost next to nothing.
+
+from umccr_utils.profiling import span, profiled
+
+with span("render config"):
+    ...
+
+@profiled()
+def slow_lookup():
+    ...
+
+Every boto3 api call is recorded too, through botocore's before-call / after-call events,
+along with the number of times botocore had to retry it.
+
+Load the trace in chrome://tracing or https://ui.perfetto.dev,
+the 'summary' key holds the count and total time of each span name.
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from umccr_utils.logger import get_logger
+
+logger = get_logger()
+
+PROFILING_LOCK = threading.Lock()
+
+PROFILING = {
+    "enabled": False,
+    "start_time": None,
+    "spans": []
+}
+
+# Key we store the start time of an api call under, in the request context botocore passes between events
+AWS_CALL_CONTEXT_KEY = "umccr_profiling_start_time"
+
+
+def is_profiling():
+    """
+    Are spans being recorded
+    :return:
+    """
+
+    return PROFILING["enabled"]
+
+
+def record_span(name, category, start_time, end_time, span_args=None):
+    """
+    Record a span that has finished
+    :param name:
+    :param category: i.e function, subprocess or aws
+    :param start_time: time.perf_counter() at the start
+    :param end_time: time.perf_counter() at the end
+    :param span_args: Optional dict of json serialisable details about the span
+    :return:
+    """
+
+    if not PROFILING["enabled"]:
+        return
+
+    span_record = {
+        "name": name,
+        "category": category,
+        "start_time": start_time,
+        "end_time": end_time,
+        "thread_id": threading.get_ident(),
+        "args": span_args if span_args is not None else {}
+    }
+
+    with PROFILING_LOCK:
+        PROFILING["spans"].append(span_record)
+
+
+@contextmanager
+def span(name, category="function", **span_args):
+    """
+    Record the time spent in the body of the with statement
+    :param name:
+    :param category:
+    :param span_args: details about the span, shown in the trace
+    :return:
+    """
+
+    if not PROFILING["enabled"]:
+        yield
+        return
+
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, category, start_time, time.perf_counter(), span_args)
+
+
+def profiled(name=None, category="function"):
+    """
+    Decorator, record the time spent in each call of the function
+    :param name: Defaults to the name of the function
+    :param category:
+    :return:
+    """
+
+    def decorator(func):
+        span_name = name if name is not None else func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILING["enabled"]:
+                return func(*args, **kwargs)
+            with span(span_name, category):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def before_aws_call(context, **kwargs):
+    """
+    botocore before-call handler, note when the api call started
+    :param context: botocore's request context, shared with the after-call event of the same request
+    :return:
+    """
+
+    context[AWS_CALL_CONTEXT_KEY] = time.perf_counter()
+
+
+def after_aws_call(model, context, parsed=None, http_response=None, exception=None, **kwargs):
+    """
+    botocore after-call handler, record the api call along with its retries
+    :param model: the botocore OperationModel
+    :param context:
+    :param parsed: the parsed response
+    :param http_response:
+    :param exception:
+    :return:
+    """
+
+    start_time = context.get(AWS_CALL_CONTEXT_KEY)
+
+    if start_time is None:
+        return
+
+    span_args = {}
+
+    if parsed is not None:
+        response_metadata = parsed.get("ResponseMetadata", {})
+        span_args["retry_attempts"] = response_metadata.get("RetryAttempts", 0)
+        span_args["http_status_code"] = response_metadata.get("HTTPStatusCode")
+
+    if exception is not None:
+        span_args["exception"] = str(exception)
+
+    record_span("{}.{}".format(model.service_model.service_name, model.name), "aws",
+                start_time, time.perf_counter(), span_args)
+
+
+def after_aws_call_error(context, exception=None, event_name=None, **kwargs):
+    """
+    botocore after-call-error handler, record an api call that never got a response (i.e a connection error)
+    botocore doesn't pass the model with this event, so the call is named from the event, after-call-error.<service>.<op>
+    :param context:
+    :param exception:
+    :param event_name:
+    :return:
+    """
+
+    start_time = context.get(AWS_CALL_CONTEXT_KEY)
+
+    if start_time is None:
+        return
+
+    call_name = event_name.split(".", 1)[-1] if event_name is not None else "unknown"
+
+    record_span(call_name, "aws", start_time, time.perf_counter(),
+                {"exception": str(exception)} if exception is not None else {})
+
+
+def get_trace_summary(spans):
+    """
+    Count and total time of each span name, slowest first
+    :param spans:
+    :return:
+    """
+
+    summary = {}
+
+    for span_record in spans:
+        duration_ms = (span_record["end_time"] - span_record["start_time"]) * 1000
+        span_summary = summary.setdefault(span_record["name"], {
+            "category": span_record["category"],
+            "count": 0,
+            "total_ms": 0,
+            "max_ms": 0,
+            "retry_attempts": 0
+        })
+        span_summary["count"] += 1
+        span_summary["total_ms"] += duration_ms
+        span_summary["max_ms"] = max(span_summary["max_ms"], duration_ms)
+        span_summary["retry_attempts"] += span_record["args"].get("retry_attempts", 0)
+
+    return dict(sorted(summary.items(), key=lambda item: item[1]["total_ms"], reverse=True))
+
+
+def write_trace(trace_path):
+    """
+    Write the spans recorded so far as a chrome trace (json object format), with a summary
+    :param trace_path:
+    :return:
+    """
+
+    with PROFILING_LOCK:
+        spans = list(PROFILING["spans"])
+
+    process_id = os.getpid()
+    start_time = PROFILING["start_time"]
+
+    trace_events = [{
+        "name": span_record["name"],
+        "cat": span_record["category"],
+        "ph": "X",
+        "ts": (span_record["start_time"] - start_time) * 1e6,
+        "dur": (span_record["end_time"] - span_record["start_time"]) * 1e6,
+        "pid": process_id,
+        "tid": span_record["thread_id"],
+        "args": span_record["args"]
+    } for span_record in sorted(spans, key=lambda span_record: span_record["start_time"])]
+
+    try:
+        with open(trace_path, 'w') as trace_h:
+            json.dump({
+                "traceEvents": trace_events,
+                "displayTimeUnit": "ms",
+                "summary": get_trace_summary(spans)
+            }, trace_h, indent=2)
+    except OSError as os_error:
+        logger.warning("Could not write profile to \"{}\": {}".format(trace_path, os_error))
+        return
+
+    logger.info("Wrote profile of {} spans to \"{}\"".format(len(trace_events), trace_path))
+
+
+def start_profiling(trace_path):
+    """
+    Start recording spans and boto3 api calls, the trace is written to trace_path when the interpreter exits.
+    :param trace_path:
+    :return:
+    """
+
+    # Imported here so modules that only record spans needn't import boto3
+    from umccr_utils.aws_clients import get_session, configure_clients
+
+    PROFILING["enabled"] = True
+    PROFILING["start_time"] = time.perf_counter()
+
+    # Clients take a copy of the session's event hooks when created, so drop any made before now
+    configure_clients()
+    session_events = get_session().events
+    session_events.register("before-call.*.*", before_aws_call)
+    session_events.register("after-call.*.*", after_aws_call)
+    session_events.register("after-call-error.*.*", after_aws_call_error)
+
+    atexit.register(write_trace, trace_path)
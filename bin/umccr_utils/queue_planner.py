@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+
+"""
+Plan the instance types behind each slurm queue from the jobs we expect to run on it
+
+A workload profile lists the steps run on each queue, i.e
+
+queues:
+  compute:
+    steps:
+      - name: align
+        cores: 16
+        memory: 32G
+        runtime: 1.5
+        count: 24
+      - name: gridss
+        cores: 8
+        memory: 31G
+        runtime: 6
+        count: 12
+  copy:
+    steps:
+      - name: sync
+        cores: 2
+        memory: 4G
+        runtime: 0.5
+        count: 100
+        network: 10
+
+memory is per job (not per core as in bcbio's resources section), runtime is in hours,
+network is the minimum bandwidth (Gbps) a node needs and is optional.
+A queue takes its compute_type (spot / ondemand) from AWS_PARTITION_QUEUES unless the profile sets one.
+Profiles can be yaml or json.
+
+Each step is packed onto every instance type in the catalog, as many jobs to a node as cores and memory allow,
+and the queue is given the (up to MAX_QUEUE_COMPUTE_RESOURCES) instance types that run all of its steps cheapest.
+The plan is written in the same shape as AWS_PARTITION_QUEUES / AWS_COMPUTE_RESOURCES,
+so start_cluster.py --queue-plan can render it straight into the cluster configuration.
+"""
+
+import json
+import math
+import itertools
+from pathlib import Path
+from umccr_utils.errors import QueuePlanError
+from umccr_utils.logger import get_logger
+from umccr_utils.instance_catalog import INSTANCE_CATALOG, get_instance_price
+from umccr_utils.globals import AWS_PARTITION_QUEUES, AWS_COMPUTE_RESOURCES
+
+logger = get_logger()
+
+WORKLOAD_STEP_KEYS = ["name", "cores", "memory", "runtime", "count", "network"]
+WORKLOAD_STEP_REQUIRED_KEYS = ["name", "cores", "memory", "runtime"]
+WORKLOAD_COMPUTE_TYPES = ["spot", "ondemand"]
+
+# Most compute resources pcluster (2.x) lets us put behind one queue
+MAX_QUEUE_COMPUTE_RESOURCES = 3
+
+# Share of a node's memory left for jobs once the os and slurm daemons have taken theirs
+USABLE_MEMORY_FRACTION = 0.9
+
+# Only the cheapest few instance types for each step are considered when picking a queue's instance types
+CANDIDATES_PER_STEP = 3
+
+MEMORY_UNITS = {
+    "K": 1 / (1024 * 1024),
+    "M": 1 / 1024,
+    "G": 1,
+    "T": 1024
+}
+
+
+def parse_memory(memory):
+    """
+    Memory in GiB, from a number (GiB) or a bcbio style string, i.e 14G, 2000m
+    :param memory:
+    :return:
+    """
+
+    if isinstance(memory, (int, float)):
+        return float(memory)
+
+    memory_str = str(memory).strip().upper().rstrip("B").rstrip("I")
+
+    try:
+        if memory_str[-1:] in MEMORY_UNITS:
+            return float(memory_str[:-1]) * MEMORY_UNITS[memory_str[-1]]
+        return float(memory_str)
+    except ValueError:
+        logger.error("Could not read \"{}\" as an amount of memory".format(memory))
+        raise QueuePlanError
+
+
+def read_workload_file(workload_path):
+    """
+    Load the workload profile, json if the suffix says so, otherwise yaml
+    :param workload_path:
+    :return:
+    """
+
+    workload_path = Path(workload_path)
+
+    if not workload_path.is_file():
+        logger.error("Could not find workload profile \"{}\"".format(workload_path))
+        raise QueuePlanError
+
+    with open(workload_path, 'r') as workload_h:
+        if workload_path.suffix == ".json":
+            try:
+                return json.load(workload_h)
+            except json.JSONDecodeError as json_error:
+                logger.error("Could not read workload profile \"{}\" as json: {}".format(workload_path, json_error))
+                raise QueuePlanError
+
+        import yaml
+        try:
+            return yaml.safe_load(workload_h)
+        except yaml.YAMLError as yaml_error:
+            logger.error("Could not read workload profile \"{}\" as yaml: {}".format(workload_path, yaml_error))
+            raise QueuePlanError
+
+
+def get_workload_step(queue_name, workload_step):
+    """
+    Check a step of the workload and fill in its defaults
+    :param queue_name:
+    :param workload_step:
+    :return: dict with name, cores, memory (GiB), runtime (hours), count and network (Gbps)
+    """
+
+    unknown_keys = [key for key in workload_step.keys() if key not in WORKLOAD_STEP_KEYS]
+    missing_keys = [key for key in WORKLOAD_STEP_REQUIRED_KEYS if key not in workload_step]
+
+    if len(unknown_keys) > 0 or len(missing_keys) > 0:
+        logger.error("Step \"{}\" of queue \"{}\" has unknown keys [{}] / is missing keys [{}], expected {}".format(
+            workload_step.get("name"), queue_name, ", ".join(unknown_keys), ", ".join(missing_keys),
+            ", ".join(WORKLOAD_STEP_KEYS)
+        ))
+        raise QueuePlanError
+
+    step = {
+        "name": str(workload_step["name"]),
+        "cores": int(workload_step["cores"]),
+        "memory": parse_memory(workload_step["memory"]),
+        "runtime": float(workload_step["runtime"]),
+        "count": int(workload_step.get("count", 1)),
+        "network": float(workload_step.get("network", 0))
+    }
+
+    if step["cores"] < 1 or step["memory"] <= 0 or step["runtime"] <= 0 or step["count"] < 1:
+        logger.error("Step \"{}\" of queue \"{}\" needs positive cores, memory, runtime and count".format(
+            step["name"], queue_name
+        ))
+        raise QueuePlanError
+
+    return step
+
+
+def get_workload_queues(workload_path):
+    """
+    Read the queues, and the steps run on each, out of a workload profile
+    :param workload_path:
+    :return: dict of queue name to a dict with compute_type and steps
+    """
+
+    workload = read_workload_file(workload_path)
+
+    if not isinstance(workload, dict) or not isinstance(workload.get("queues"), dict) \
+            or len(workload["queues"]) == 0:
+        logger.error("Workload profile \"{}\" needs a 'queues' mapping of queue name to steps".format(workload_path))
+        raise QueuePlanError
+
+    workload_queues = {}
+
+    for queue_name, workload_queue in workload["queues"].items():
+        if not isinstance(workload_queue, dict) or not isinstance(workload_queue.get("steps"), list) \
+                or len(workload_queue["steps"]) == 0:
+            logger.error("Queue \"{}\" of the workload profile needs a list of steps".format(queue_name))
+            raise QueuePlanError
+
+        compute_type = workload_queue.get("compute_type",
+                                          AWS_PARTITION_QUEUES.get(queue_name, {}).get("compute_type"))
+
+        if compute_type not in WORKLOAD_COMPUTE_TYPES:
+            logger.error("Queue \"{}\" needs a compute_type of {}".format(
+                queue_name, " or ".join(WORKLOAD_COMPUTE_TYPES)
+            ))
+            raise QueuePlanError
+
+        workload_queues[queue_name] = {
+            "compute_type": compute_type,
+            "steps": [get_workload_step(queue_name, workload_step) for workload_step in workload_queue["steps"]]
+        }
+
+    return workload_queues
+
+
+def get_step_placement(step, instance_type, compute_type):
+    """
+    Pack the jobs of a step onto nodes of an instance type
+    Each node runs as many jobs side by side as its cores and memory allow, until all jobs have run
+    :param step:
+    :param instance_type:
+    :param compute_type: spot or ondemand
+    :return: dict describing the placement, None if a job doesn't fit on the instance type
+    """
+
+    instance = INSTANCE_CATALOG[instance_type]
+
+    if instance["network"] < step["network"]:
+        return None
+
+    jobs_per_node = min(instance["vcpus"] // step["cores"],
+                        math.floor(instance["memory"] * USABLE_MEMORY_FRACTION / step["memory"]))
+
+    if jobs_per_node < 1:
+        return None
+
+    # Nodes needed to run every job at once, and the node hours spent doing so
+    nodes = math.ceil(step["count"] / jobs_per_node)
+    node_hours = nodes * step["runtime"]
+    cost = node_hours * get_instance_price(instance_type, compute_type)
+    core_hours = step["cores"] * step["runtime"] * step["count"]
+
+    return {
+        "step": step["name"],
+        "instance_type": instance_type,
+        "jobs_per_node": jobs_per_node,
+        "nodes": nodes,
+        "cpu_efficiency": core_hours / (node_hours * instance["vcpus"]),
+        "memory_efficiency": step["memory"] * step["runtime"] * step["count"] / (node_hours * instance["memory"]),
+        "cost": cost,
+        "core_hours_per_dollar": core_hours / cost if cost > 0 else math.inf
+    }
+
+
+def get_step_placements(step, compute_type, instance_types=None):
+    """
+    Every way of placing a step, cheapest first
+    :param step:
+    :param compute_type:
+    :param instance_types: Defaults to every instance type in the catalog
+    :return: list of placements
+    """
+
+    if instance_types is None:
+        instance_types = list(INSTANCE_CATALOG.keys())
+
+    step_placements = [get_step_placement(step, instance_type, compute_type) for instance_type in instance_types]
+
+    return sorted([step_placement for step_placement in step_placements if step_placement is not None],
+                  key=lambda step_placement: (step_placement["cost"], step_placement["instance_type"]))
+
+
+def get_queue_placements(workload_queue, instance_types):
+    """
+    Place each step of a queue on the cheapest of the instance types given
+    :param workload_queue:
+    :param instance_types:
+    :return: list of placements, one per step, None if a step can't run on any of the instance types
+    """
+
+    queue_placements = []
+
+    for step in workload_queue["steps"]:
+        step_placements = get_step_placements(step, workload_queue["compute_type"], instance_types=instance_types)
+        if len(step_placements) == 0:
+            return None
+        queue_placements.append(step_placements[0])
+
+    return queue_placements
+
+
+def plan_queue(queue_name, workload_queue, instance_types=None, max_compute_resources=MAX_QUEUE_COMPUTE_RESOURCES):
+    """
+    Pick the instance types for a queue that run all of its steps for the least money
+    Slurm sends each job to the cheapest node type it fits on, so each step is costed on its cheapest instance type
+    :param queue_name:
+    :param workload_queue: from get_workload_queues
+    :param instance_types: instance types to choose from, defaults to every instance type in the catalog
+    :param max_compute_resources: most instance types to give the queue
+    :return: list of placements, one per step
+    """
+
+    candidate_instance_types = set()
+
+    for step in workload_queue["steps"]:
+        step_placements = get_step_placements(step, workload_queue["compute_type"], instance_types=instance_types)
+        if len(step_placements) == 0:
+            logger.error("No instance type can run step \"{}\" of queue \"{}\" ({} cores, {:.1f} GiB)".format(
+                step["name"], queue_name, step["cores"], step["memory"]
+            ))
+            raise QueuePlanError
+        candidate_instance_types.update(step_placement["instance_type"]
+                                        for step_placement in step_placements[:CANDIDATES_PER_STEP])
+
+    best_queue_placements = None
+    best_key = None
+
+    for compute_resource_count in range(1, max_compute_resources + 1):
+        for instance_type_combination in itertools.combinations(sorted(candidate_instance_types),
+                                                                compute_resource_count):
+            queue_placements = get_queue_placements(workload_queue, instance_type_combination)
+            if queue_placements is None:
+                continue
+            # Cheapest, then fewest instance types
+            queue_key = (round(sum(placement["cost"] for placement in queue_placements), 6),
+                         len(set(placement["instance_type"] for placement in queue_placements)))
+            if best_key is None or queue_key < best_key:
+                best_key = queue_key
+                best_queue_placements = queue_placements
+
+    if best_queue_placements is None:
+        logger.error("Could not fit the steps of queue \"{}\" on {} or fewer instance types".format(
+            queue_name, max_compute_resources
+        ))
+        raise QueuePlanError
+
+    return best_queue_placements
+
+
+def get_current_queue_placements(queue_name, workload_queue):
+    """
+    Place the steps of a queue on the instance types it has now, in AWS_PARTITION_QUEUES
+    :param queue_name:
+    :param workload_queue:
+    :return: list of placements, None if the queue doesn't exist yet or can't run every step
+    """
+
+    if queue_name not in AWS_PARTITION_QUEUES:
+        return None
+
+    instance_types = [AWS_COMPUTE_RESOURCES[compute_resource]["instance_type"]
+                      for compute_resource in AWS_PARTITION_QUEUES[queue_name]["compute_resource_settings"]]
+
+    return get_queue_placements(workload_queue, instance_types)
+
+
+def get_compute_resource_name(instance_type):
+    """
+    Name of the compute resource section for an instance type,
+    the name in AWS_COMPUTE_RESOURCES if it already has one, otherwise i.e c5.4xlarge -> c5_4xlarge
+    :param instance_type:
+    :return:
+    """
+
+    for compute_resource, compute_resource_settings in AWS_COMPUTE_RESOURCES.items():
+        if compute_resource_settings == {"instance_type": instance_type}:
+            return compute_resource
+
+    return instance_type.replace(".", "_")
+
+
+def get_queue_plan(workload_queues, queue_placements):
+    """
+    Lay the planned instance types of each queue over AWS_PARTITION_QUEUES and AWS_COMPUTE_RESOURCES,
+    queues that weren't planned are left as they are
+    :param workload_queues: from get_workload_queues
+    :param queue_placements: dict of queue name to the placements from plan_queue
+    :return: dict with partition_queues and compute_resources, in the same shape as the globals
+    """
+
+    partition_queues = json.loads(json.dumps(AWS_PARTITION_QUEUES))
+    compute_resources = json.loads(json.dumps(AWS_COMPUTE_RESOURCES))
+
+    for queue_name, placements in queue_placements.items():
+        instance_types = sorted(set(placement["instance_type"] for placement in placements))
+        partition_queue = partition_queues.setdefault(queue_name, {})
+        partition_queue["compute_type"] = workload_queues[queue_name]["compute_type"]
+        partition_queue["compute_resource_settings"] = [get_compute_resource_name(instance_type)
+                                                        for instance_type in instance_types]
+        for instance_type in instance_types:
+            compute_resources[get_compute_resource_name(instance_type)] = {"instance_type": instance_type}
+
+    # Only keep the compute resources still used by a queue
+    used_compute_resources = set(compute_resource
+                                 for partition_queue in partition_queues.values()
+                                 for compute_resource in partition_queue["compute_resource_settings"])
+
+    return {
+        "partition_queues": partition_queues,
+        "compute_resources": {compute_resource: compute_resource_settings
+                              for compute_resource, compute_resource_settings in compute_resources.items()
+                              if compute_resource in used_compute_resources}
+    }
+
+
+def write_queue_plan(queue_plan, queue_plan_path):
+    """
+    Write the plan as json, for start_cluster.py --queue-plan
+    :param queue_plan:
+    :param queue_plan_path:
+    :return:
+    """
+
+    with open(queue_plan_path, 'w') as queue_plan_h:
+        json.dump(queue_plan, queue_plan_h, indent=2)
+        queue_plan_h.write("\n")
+
+
+def read_queue_plan(queue_plan_path):
+    """
+    Read a plan written by write_queue_plan, making sure every queue's compute resources are there
+    :param queue_plan_path:
+    :return: partition_queues, compute_resources
+    """
+
+    try:
+        with open(queue_plan_path, 'r') as queue_plan_h:
+            queue_plan = json.load(queue_plan_h)
+    except (OSError, json.JSONDecodeError) as read_error:
+        logger.error("Could not read queue plan \"{}\": {}".format(queue_plan_path, read_error))
+        raise QueuePlanError
+
+    partition_queues = queue_plan.get("partition_queues") if isinstance(queue_plan, dict) else None
+    compute_resources = queue_plan.get("compute_resources") if isinstance(queue_plan, dict) else None
+
+    if not isinstance(partition_queues, dict) or not isinstance(compute_resources, dict):
+        logger.error("Queue plan \"{}\" needs partition_queues and compute_resources".format(queue_plan_path))
+        raise QueuePlanError
+
+    for queue_name, partition_queue in partition_queues.items():
+        missing_compute_resources = [compute_resource
+                                     for compute_resource in partition_queue.get("compute_resource_settings", [])
+                                     if compute_resource not in compute_resources]
+        if len(missing_compute_resources) > 0 or partition_queue.get("compute_type") not in WORKLOAD_COMPUTE_TYPES:
+            logger.error("Queue \"{}\" in queue plan \"{}\" needs a compute_type and "
+                         "compute resources that are in the plan, missing [{}]".format(
+                            queue_name, queue_plan_path, ", ".join(missing_compute_resources)))
+            raise QueuePlanError
+
+    return partition_queues, compute_resources
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+"""
+Follow the progress of cloudformation stacks being created and deleted
+
+Events are fetched incrementally, newest first, stopping as soon as we reach the last event we've already seen,
+so each poll costs a single api call no matter how long the stack has been running.
+Deletions of many stacks are followed together, with one (paginated) describe_stacks call per poll.
+"""
+
+import logging
+import time
+from botocore.exceptions import ClientError
+from umccr_utils.aws_clients import get_client
+from umccr_utils.logger import get_logger
+from umccr_utils.profiling import profiled
+from umccr_utils.errors import PClusterCreateError
+from umccr_utils.globals import AWS_REGION, CFN_STATUSES
+
+logger = get_logger()
+
+# Seconds between polls - we start quick and back off while nothing is happening
+STACK_POLL_MIN_INTERVAL = 5
+STACK_POLL_MAX_INTERVAL = 60
+STACK_POLL_BACKOFF = 1.5
+
+# Statuses of a stack (or resource) that mean it is done with, one way or another
+STACK_CREATE_FAILED_STATUSES = [
+    "CREATE_FAILED",
+    "ROLLBACK_COMPLETE",
+    "ROLLBACK_FAILED",
+    "DELETE_COMPLETE",
+    "DELETE_FAILED"
+]
+RESOURCE_DONE_STATUSES = ["CREATE_COMPLETE", "CREATE_FAILED", "DELETE_COMPLETE", "DELETE_FAILED"]
+
+
+class StackEventPoller(object):
+    """
+    Return the events of a stack we haven't seen yet, oldest first
+    """
+
+    def __init__(self, stack_name):
+        self.stack_name = stack_name
+        self.last_event_id = None
+        self.cfn = get_client("cloudformation", region_name=AWS_REGION)
+
+    def get_new_events(self):
+        """
+        Get the events since the last call
+        :return: list of stack events, oldest first
+        """
+
+        paginator = self.cfn.get_paginator("describe_stack_events")
+
+        new_events = []
+
+        for page in paginator.paginate(StackName=self.stack_name):
+            for stack_event in page.get("StackEvents", []):
+                if stack_event["EventId"] == self.last_event_id:
+                    break
+                new_events.append(stack_event)
+            else:
+                # Reached the end of the page without finding the last event, read the next page
+                continue
+            break
+
+        if len(new_events) > 0:
+            self.last_event_id = new_events[0]["EventId"]
+
+        return list(reversed(new_events))
+
+
+class StackProgress(object):
+    """
+    Keep track of the latest status of each resource in a stack
+    """
+
+    def __init__(self, stack_name, log_level=logging.INFO):
+        self.stack_name = stack_name
+        self.log_level = log_level
+        self.stack_status = None
+        self.resource_statuses = {}
+
+    def update(self, stack_event):
+        """
+        Record a stack event, logging the change
+        :param stack_event:
+        :return:
+        """
+
+        logical_resource_id = stack_event["LogicalResourceId"]
+        resource_status = stack_event["ResourceStatus"]
+
+        if logical_resource_id == self.stack_name and stack_event["ResourceType"] == "AWS::CloudFormation::Stack":
+            self.stack_status = resource_status
+        else:
+            self.resource_statuses[logical_resource_id] = resource_status
+
+        status_reason = stack_event.get("ResourceStatusReason")
+
+        logger.log(self.log_level, "{:<40} {:<40} {}{}".format(
+            logical_resource_id,
+            stack_event["ResourceType"],
+            resource_status,
+            "" if status_reason is None else " ({})".format(status_reason)
+        ))
+
+    def summary(self):
+        """
+        One line summary of the stack's progress
+        :return:
+        """
+
+        resources_done = len([resource_status
+                              for resource_status in self.resource_statuses.values()
+                              if resource_status in RESOURCE_DONE_STATUSES])
+
+        return "Stack \"{}\" is {}, {}/{} resources done".format(
+            self.stack_name, self.stack_status, resources_done, len(self.resource_statuses)
+        )
+
+
+@profiled()
+def wait_for_stack_creation(stack_name, timeout=None, log_level=logging.INFO):
+    """
+    Poll the events of a stack until it has been created (or has failed to be)
+    Can be used to attach to a stack that's already part way through being created
+    :param stack_name:
+    :param timeout: Optional number of seconds to wait before giving up
+    :param log_level: Level to log each event and progress summary at, the final outcome is always logged
+    :return: the final stack status
+    """
+
+    stack_event_poller = StackEventPoller(stack_name)
+    stack_progress = StackProgress(stack_name, log_level=log_level)
+
+    poll_interval = STACK_POLL_MIN_INTERVAL
+    start_time = time.time()
+
+    while True:
+        try:
+            new_events = stack_event_poller.get_new_events()
+        except ClientError as client_error:
+            logger.error("Could not get the events for stack \"{}\": {}".format(stack_name, client_error))
+            raise PClusterCreateError
+
+        for stack_event in new_events:
+            stack_progress.update(stack_event)
+
+        if stack_progress.stack_status in CFN_STATUSES["completed"]:
+            logger.info(stack_progress.summary())
+            return stack_progress.stack_status
+
+        if stack_progress.stack_status in STACK_CREATE_FAILED_STATUSES:
+            logger.error(stack_progress.summary())
+            raise PClusterCreateError
+
+        if len(new_events) > 0:
+            logger.log(log_level, stack_progress.summary())
+            poll_interval = STACK_POLL_MIN_INTERVAL
+        else:
+            poll_interval = min(poll_interval * STACK_POLL_BACKOFF, STACK_POLL_MAX_INTERVAL)
+
+        if timeout is not None and time.time() - start_time > timeout:
+            logger.error("Stack \"{}\" was not created within {} seconds".format(stack_name, timeout))
+            raise PClusterCreateError
+
+        time.sleep(poll_interval)
+
+
+def get_stack_statuses(stack_names):
+    """
+    Get the status of many stacks with one paginated describe_stacks call, rather than one call per stack.
+    Stacks that have finished deleting are no longer returned by describe_stacks, so are left out
+    :param stack_names: the stacks we're interested in
+    :return: dict of stack name to stack status
+    """
+
+    stack_names = set(stack_names)
+
+    cfn = get_client("cloudformation", region_name=AWS_REGION)
+    paginator = cfn.get_paginator("describe_stacks")
+
+    stack_statuses = {}
+
+    for page in paginator.paginate():
+        for stack in page.get("Stacks", []):
+            if stack["StackName"] in stack_names:
+                stack_statuses[stack["StackName"]] = stack["StackStatus"]
+
+    return stack_statuses
+
+
+@profiled()
+def wait_for_stack_deletions(stack_names, timeout=None):
+    """
+    Poll the status of all of the stacks together until each one has been deleted (or has failed to be)
+    :param stack_names:
+    :param timeout: Optional number of seconds to wait before giving up
+    :return: list of the stacks that could not be deleted, including any still going at the timeout
+    """
+
+    remaining_stack_names = set(stack_names)
+    failed_stack_names = []
+
+    poll_interval = STACK_POLL_MIN_INTERVAL
+    start_time = time.time()
+
+    while True:
+        try:
+            stack_statuses = get_stack_statuses(remaining_stack_names)
+        except ClientError as client_error:
+            logger.error("Could not get the status of the stacks being deleted: {}".format(client_error))
+            return sorted(remaining_stack_names) + failed_stack_names
+
+        finished_stack_names = []
+
+        for stack_name in sorted(remaining_stack_names):
+            stack_status = stack_statuses.get(stack_name, "DELETE_COMPLETE")
+            if stack_status == "DELETE_COMPLETE":
+                logger.info("Stack \"{}\" has been deleted".format(stack_name))
+                finished_stack_names.append(stack_name)
+            elif stack_status == "DELETE_FAILED":
+                logger.error("Stack \"{}\" could not be deleted".format(stack_name))
+                finished_stack_names.append(stack_name)
+                failed_stack_names.append(stack_name)
+
+        remaining_stack_names.difference_update(finished_stack_names)
+
+        if len(remaining_stack_names) == 0:
+            return failed_stack_names
+
+        if len(finished_stack_names) > 0:
+            logger.info("{}/{} stacks done, waiting on {}".format(
+                len(stack_names) - len(remaining_stack_names), len(stack_names), ", ".join(sorted(remaining_stack_names))
+            ))
+            poll_interval = STACK_POLL_MIN_INTERVAL
+        else:
+            poll_interval = min(poll_interval * STACK_POLL_BACKOFF, STACK_POLL_MAX_INTERVAL)
+
+        if timeout is not None and time.time() - start_time > timeout:
+            logger.error("Stacks {} were not deleted within {} seconds".format(
+                ", ".join(sorted(remaining_stack_names)), timeout
+            ))
+            return failed_stack_names + sorted(remaining_stack_names)
+
+        time.sleep(poll_interval)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+"""
+Print tables to the console without needing to hold every row in memory
+
+Column widths are fixed up front, so each row is written as soon as it is available.
+Values wider than their column push the rest of the row along rather than being truncated.
+
+The same rows can be streamed as csv, json or json lines for scripts to consume, see get_table_writer.
+"""
+
+import sys
+import csv
+import json
+
+# Output formats that can be streamed row by row
+TABLE_FORMATS = ["table", "csv", "json", "jsonl"]
+
+# What to show when a value is missing, matches how pandas used to print missing values
+MISSING_VALUE = "NaN"
+
+COLUMN_SEPARATOR = "  "
+
+
+class FixedWidthTableWriter(object):
+    """
+    Write rows of a table, one at a time, in fixed width columns
+    """
+
+    def __init__(self, columns, column_widths, stream=None):
+        """
+        :param columns: list of column headers
+        :param column_widths: list of column widths, minimum width is that of the header
+        :param stream: file-like object to write to, defaults to stdout
+        """
+        self.columns = columns
+        self.column_widths = [max(len(column), column_width)
+                              for column, column_width in zip(columns, column_widths)]
+        self.stream = stream if stream is not None else sys.stdout
+
+    def format_row(self, row):
+        """
+        Pad each value to the width of its column
+        The last column is not padded to avoid trailing whitespace
+        :param row:
+        :return:
+        """
+
+        values = [MISSING_VALUE if value is None else str(value) for value in row]
+
+        padded_values = [value.ljust(column_width)
+                         for value, column_width in zip(values[:-1], self.column_widths[:-1])]
+        padded_values.append(values[-1])
+
+        return COLUMN_SEPARATOR.join(padded_values)
+
+    def write_header(self):
+        """
+        Write the column headers
+        :return:
+        """
+
+        self.stream.write(self.format_row(self.columns) + "\n")
+        self.stream.flush()
+
+    def write_row(self, row):
+        """
+        Write a single row, values in the same order as the columns
+        :param row:
+        :return:
+        """
+
+        self.stream.write(self.format_row(row) + "\n")
+        self.stream.flush()
+
+    def write_footer(self):
+        """
+        Nothing to finish a fixed width table with
+        :return:
+        """
+
+        pass
+
+
+class CsvTableWriter(object):
+    """
+    Write rows of a table, one at a time, as csv
+    Missing values are left empty
+    """
+
+    def __init__(self, columns, stream=None):
+        """
+        :param columns: list of column headers
+        :param stream: file-like object to write to, defaults to stdout
+        """
+        self.columns = columns
+        self.stream = stream if stream is not None else sys.stdout
+        self.csv_writer = csv.writer(self.stream)
+
+    def write_header(self):
+        """
+        Write the column headers
+        :return:
+        """
+
+        self.csv_writer.writerow(self.columns)
+        self.stream.flush()
+
+    def write_row(self, row):
+        """
+        Write a row and flush so it is seen straight away
+        :param row:
+        :return:
+        """
+
+        self.csv_writer.writerow(["" if value is None else value for value in row])
+        self.stream.flush()
+
+    def write_footer(self):
+        """
+        Nothing to finish a csv with
+        :return:
+        """
+
+        pass
+
+
+class JsonLinesTableWriter(object):
+    """
+    Write rows of a table, one at a time, as a json object per line keyed by column
+    Missing values are null
+    """
+
+    def __init__(self, columns, stream=None):
+        """
+        :param columns: list of column headers, used as the keys of each object
+        :param stream: file-like object to write to, defaults to stdout
+        """
+        self.columns = columns
+        self.stream = stream if stream is not None else sys.stdout
+
+    def write_header(self):
+        """
+        Each line carries its own keys, so there is no header
+        :return:
+        """
+
+        pass
+
+    def write_row(self, row):
+        """
+        Write a row as a json object on its own line
+        :param row:
+        :return:
+        """
+
+        self.stream.write(json.dumps(dict(zip(self.columns, row))) + "\n")
+        self.stream.flush()
+
+    def write_footer(self):
+        """
+        Nothing to finish json lines with
+        :return:
+        """
+
+        pass
+
+
+class JsonTableWriter(JsonLinesTableWriter):
+    """
+    Write rows of a table, one at a time, as a json list of objects keyed by column
+    The list is only valid json once write_footer has been called
+    """
+
+    def __init__(self, columns, stream=None):
+        """
+        :param columns: list of column headers, used as the keys of each object
+        :param stream: file-like object to write to, defaults to stdout
+        """
+        super().__init__(columns, stream=stream)
+        self.row_count = 0
+
+    def write_header(self):
+        """
+        Open the list
+        :return:
+        """
+
+        self.stream.write("[")
+        self.stream.flush()
+
+    def write_row(self, row):
+        """
+        Write a row as the next object in the list
+        :param row:
+        :return:
+        """
+
+        self.stream.write("{}\n  {}".format("," if self.row_count > 0 else "", json.dumps(dict(zip(self.columns, row)))))
+        self.stream.flush()
+        self.row_count += 1
+
+    def write_footer(self):
+        """
+        Close the list
+        :return:
+        """
+
+        self.stream.write("\n]\n" if self.row_count > 0 else "]\n")
+        self.stream.flush()
+
+
+def get_table_writer(table_format, columns, column_widths, stream=None):
+    """
+    Get the writer for one of TABLE_FORMATS
+    :param table_format:
+    :param columns: list of column headers
+    :param column_widths: list of column widths, only used by the table format
+    :param stream: file-like object to write to, defaults to stdout
+    :return:
+    """
+
+    if table_format == "csv":
+        return CsvTableWriter(columns, stream=stream)
+    if table_format == "json":
+        return JsonTableWriter(columns, stream=stream)
+    if table_format == "jsonl":
+        return JsonLinesTableWriter(columns, stream=stream)
+
+    return FixedWidthTableWriter(columns, column_widths, stream=stream)
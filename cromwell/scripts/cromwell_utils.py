@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+"""
+Shared helpers for talking to the cromwell server's rest api
+
+All requests go through one pooled requests session, with transient failures
+(connection errors, 429 / 503 responses) retried with a backoff.
+Read timeouts on submissions are not retried, as cromwell may already have accepted the workflow.
+"""
+
+import re
+import json
+import logging
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger("cromwell")
+
+DEFAULT_WEBSERVICE_PORT = 8000
+DEFAULT_CROMWELL_CONF = Path("/opt/cromwell/configs/slurm.conf")
+
+# Used when the server's configuration can't be read, these are cromwell's own defaults
+CROMWELL_SYSTEM_DEFAULTS = {
+    "max-concurrent-workflows": 5000,
+    "max-workflow-launch-count": 50,
+    "new-workflow-poll-rate": 20
+}
+
+# Workflows that are taking up one of the server's max-concurrent-workflows slots
+ACTIVE_WORKFLOW_STATUSES = ["Submitted", "Running", "Aborting"]
+
+# Workflows that won't change status again
+TERMINAL_WORKFLOW_STATUSES = ["Succeeded", "Failed", "Aborted"]
+
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = [429, 503]
+
+# Seconds to wait for the server to connect / respond
+DEFAULT_TIMEOUT = (10, 120)
+
+
+class CromwellError(Exception):
+    """
+    The cromwell server didn't do what we asked of it
+    """
+    pass
+
+
+def read_cromwell_system_settings(cromwell_conf_path=DEFAULT_CROMWELL_CONF):
+    """
+    Read the workflow limits out of the system block of the server's configuration
+    Only simple 'key = value' lines are read, so there is no need for a full hocon parser
+    :param cromwell_conf_path:
+    :return: dict of max-concurrent-workflows, max-workflow-launch-count and new-workflow-poll-rate
+    """
+
+    system_settings = CROMWELL_SYSTEM_DEFAULTS.copy()
+
+    try:
+        with open(cromwell_conf_path, 'r') as cromwell_conf_h:
+            cromwell_conf = cromwell_conf_h.read()
+    except OSError as os_error:
+        logger.warning("Could not read cromwell configuration \"{}\" ({}), using cromwell's defaults".format(
+            cromwell_conf_path, os_error
+        ))
+        return system_settings
+
+    for setting in system_settings.keys():
+        setting_match = re.search(r"^\s*{}\s*[=:]\s*(\d+)\s*$".format(re.escape(setting)), cromwell_conf,
+                                  flags=re.MULTILINE)
+        if setting_match is not None:
+            system_settings[setting] = int(setting_match.group(1))
+
+    return system_settings
+
+
+def get_session(pool_size=10, retries=DEFAULT_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR):
+    """
+    Session whose connections are kept open and shared between threads
+    :param pool_size: Number of connections to keep open, one per thread making requests
+    :param retries: Times to retry a request that fails to connect or is turned away with a 429 / 503
+    :param backoff_factor: Sleep for backoff_factor * 2 ** (retry - 1) seconds between retries
+    :return:
+    """
+
+    retry = Retry(total=retries,
+                  connect=retries,
+                  read=0,
+                  status=retries,
+                  status_forcelist=RETRY_STATUS_CODES,
+                  allowed_methods=frozenset(["GET", "POST"]),
+                  backoff_factor=backoff_factor,
+                  raise_on_status=False)
+
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def get_cromwell_url(webservice_port=DEFAULT_WEBSERVICE_PORT, host="localhost"):
+    """
+    Root url of the cromwell server
+    :param webservice_port:
+    :param host:
+    :return:
+    """
+
+    return "http://{}:{}".format(host, webservice_port)
+
+
+def get_workflow_files(workflow_source, workflow_dependencies=None, workflow_options=None):
+    """
+    Read the parts of a submission shared by every workflow in a batch, so each file is only read once
+    :param workflow_source: Path to the workflow code
+    :param workflow_dependencies: Optional Path to a zip of the workflow's imports
+    :param workflow_options: Optional Path to an options json
+    :return: dict of multipart form fields
+    """
+
+    workflow_files = {
+        "workflowSource": (workflow_source.name, workflow_source.read_bytes())
+    }
+
+    if workflow_dependencies is not None:
+        workflow_files["workflowDependencies"] = (workflow_dependencies.name, workflow_dependencies.read_bytes(),
+                                                  "application/zip")
+
+    if workflow_options is not None:
+        workflow_files["workflowOptions"] = (workflow_options.name, workflow_options.read_bytes())
+
+    return workflow_files
+
+
+def submit_workflow(session, cromwell_url, workflow_files, workflow_inputs, labels=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Submit a workflow, POST /api/workflows/v1
+    :param session: from get_session
+    :param cromwell_url:
+    :param workflow_files: from get_workflow_files
+    :param workflow_inputs: Path to the inputs json
+    :param labels: Optional dict of labels for the workflow
+    :param timeout:
+    :return: id of the workflow
+    """
+
+    files = dict(workflow_files, workflowInputs=(workflow_inputs.name, workflow_inputs.read_bytes()))
+
+    if labels is not None:
+        files["labels"] = json.dumps(labels)
+
+    try:
+        response = session.post("{}/api/workflows/v1".format(cromwell_url), files=files, timeout=timeout)
+    except requests.RequestException as request_error:
+        raise CromwellError("Could not submit \"{}\": {}".format(workflow_inputs, request_error))
+
+    if not response.ok:
+        raise CromwellError("Submission of \"{}\" failed with {}: {}".format(
+            workflow_inputs, response.status_code, response.text.strip()
+        ))
+
+    # i.e a proxy answering in html
+    try:
+        return response.json()["id"]
+    except (ValueError, KeyError, TypeError):
+        raise CromwellError("Submission of \"{}\" got an unexpected response: {}".format(
+            workflow_inputs, response.text.strip()[:200]
+        ))
+
+
+def query_workflows(session, cromwell_url, statuses=None, timeout=DEFAULT_TIMEOUT, **query_params):
+    """
+    Find workflows in a single request, POST /api/workflows/v1/query
+    The query goes in the body, so it can hold any number of workflow ids
+    :param session:
+    :param cromwell_url:
+    :param statuses: Optional list of workflow statuses to match
+    :param timeout:
+    :param query_params: any other query parameters, i.e id=[...], label=[...]
+    :return: list of workflow summaries (id, name, status, submission, start, end)
+    """
+
+    query = [{key: str(value)}
+             for key, values in query_params.items()
+             for value in (values if isinstance(values, (list, tuple)) else [values])]
+
+    if statuses is not None:
+        query.extend({"status": status} for status in statuses)
+
+    try:
+        response = session.post("{}/api/workflows/v1/query".format(cromwell_url), json=query, timeout=timeout)
+    except requests.RequestException as request_error:
+        raise CromwellError("Could not query workflows: {}".format(request_error))
+
+    if not response.ok:
+        raise CromwellError("Workflow query failed with {}: {}".format(response.status_code, response.text.strip()))
+
+    return response.json().get("results", [])
+
+
+def get_metadata_stream(session, cromwell_url, workflow_id, include_keys=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Open the metadata of a workflow as a stream, GET /api/workflows/v1/<id>/metadata
+    Metadata of a large workflow can run to hundreds of MB, so it is never read in whole here
+    :param session:
+    :param cromwell_url:
+    :param workflow_id:
+    :param include_keys: Optional list of the only metadata keys to return, cuts down on what the server sends
+    :param timeout:
+    :return: binary file-like object of the (decompressed) json
+    """
+
+    params = [("expandSubWorkflows", "false")]
+
+    if include_keys is not None:
+        params.extend(("includeKey", include_key) for include_key in include_keys)
+
+    try:
+        response = session.get("{}/api/workflows/v1/{}/metadata".format(cromwell_url, workflow_id),
+                               params=params, stream=True, timeout=timeout)
+    except requests.RequestException as request_error:
+        raise CromwellError("Could not get metadata of workflow {}: {}".format(workflow_id, request_error))
+
+    if not response.ok:
+        raise CromwellError("Metadata of workflow {} failed with {}: {}".format(
+            workflow_id, response.status_code, response.text.strip()
+        ))
+
+    # Have urllib3 undo any gzip encoding as we read
+    response.raw.decode_content = True
+
+    return response.raw
+
+
+def count_active_workflows(session, cromwell_url):
+    """
+    Number of workflows taking up one of the server's max-concurrent-workflows slots
+    :param session:
+    :param cromwell_url:
+    :return:
+    """
+
+    return len(query_workflows(session, cromwell_url, statuses=ACTIVE_WORKFLOW_STATUSES))
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+
+"""
+Find where the time went in a cromwell workflow, call by call
+
+Profile a workflow straight from the server, or from metadata already saved to disk:
+profile_cromwell.py --workflow-id <WORKFLOW_ID>
+profile_cromwell.py --metadata-json metadata.json
+
+The metadata is parsed as a stream (with ijson), one call at a time, skipping each call's inputs and outputs,
+so even metadata that runs to hundreds of MB is profiled in a small, fixed amount of memory.
+
+The time of each call is split into
+* queued:  waiting inside cromwell (execution token, preparing the job) before it was handed to slurm
+* pending: waiting in the slurm queue, from the sbatch submission to the start of the job
+* pull:    the docker_pull step of submit_to_sbatch.sh
+* exec:    the docker_exec step of submit_to_sbatch.sh
+cromwell's timings come from each call's executionEvents, the slurm timings from the modification times of the files
+submit_to_sbatch.sh leaves in the execution directory, so the call directories need to be readable from here.
+Requeues of a slurm job (i.e spot instance preemptions) are counted from the restart count of its log files.
+
+A table per task is printed, then the critical path: working back from the call that finished last,
+the call that finished last before each one started.
+"""
+
+import os
+import re
+import sys
+import json
+import logging
+import argparse
+from pathlib import Path
+from datetime import datetime, timezone
+
+from cromwell_utils import get_session, get_cromwell_url, get_metadata_stream, CromwellError, \
+    DEFAULT_WEBSERVICE_PORT
+
+logger = logging.getLogger("cromwell")
+
+# Only these keys are asked of the server, the rest of the metadata is left behind
+METADATA_INCLUDE_KEYS = ["id", "workflowName", "status", "submission", "start", "end", "calls", "executionEvents",
+                         "attempt", "shardIndex", "jobId", "callRoot", "executionStatus", "retryableFailure",
+                         "backendStatus", "subWorkflowId"]
+
+# Keys of a call that can be large and aren't needed, skipped while parsing
+SKIPPED_CALL_KEYS = ["inputs", "outputs", "callCaching", "runtimeAttributes", "commandLine", "labels",
+                     "failures", "backendLabels", "jes"]
+
+# Top level keys of the metadata to keep
+WORKFLOW_KEYS = ["id", "workflowName", "status", "submission", "start", "end"]
+
+# Cromwell execution events before the job is handed to the backend
+CROMWELL_QUEUE_EVENTS = ["Pending", "RequestingExecutionToken", "WaitingForValueStore", "PreparingJob",
+                         "CallCacheReading", "CheckingCallCache", "CheckingJobStore"]
+CROMWELL_RUNNING_EVENT = "RunningJob"
+
+# Files left in the execution directory by cromwell and submit_to_sbatch.sh
+SUBMIT_FILE_NAME = "stdout.submit"
+BATCH_SCRIPT_NAME_TEMPLATE = "slurm-{}.sh"
+STEP_LOG_REGEX = re.compile(r"^std(?:out|err)\.(build|exec)\.(\d+)\.(\d+)\.log$")
+
+PHASES = ["queued", "pending", "pull", "exec"]
+
+TASK_COLUMNS = [
+    ("Task", 40), ("Shards", 6), ("Attempts", 8), ("Retries", 7), ("Preempted", 9),
+    ("Queued", 9), ("Pending", 9), ("Pull", 9), ("Exec", 9), ("Total", 9), ("Max", 9)
+]
+
+CRITICAL_PATH_COLUMNS = [
+    ("Call", 40), ("Shard", 5), ("Attempt", 7), ("Start", 19), ("Wait", 9),
+    ("Queued", 9), ("Pending", 9), ("Pull", 9), ("Exec", 9), ("Total", 9)
+]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Profile the calls of a cromwell workflow")
+    metadata_group = parser.add_mutually_exclusive_group(required=True)
+    metadata_group.add_argument("--workflow-id",
+                                help="Id of the workflow to fetch the metadata of from the server")
+    metadata_group.add_argument("--metadata-json",
+                                help="Metadata json already saved to disk")
+    parser.add_argument("--webservice-port",
+                        type=int,
+                        required=False, default=DEFAULT_WEBSERVICE_PORT,
+                        help="Port that cromwell is running on")
+    parser.add_argument("--no-logs",
+                        action="store_true", default=False,
+                        help="Don't look in the call directories for the slurm timings")
+    parser.add_argument("--calls-jsonl",
+                        required=False,
+                        help="Also write the timings of every call to this json lines file")
+
+    return parser.parse_args()
+
+
+def parse_timestamp(timestamp):
+    """
+    Cromwell timestamp, i.e 2021-06-01T01:02:03.456Z, as an aware datetime
+    :param timestamp:
+    :return: None if not given
+    """
+
+    if timestamp is None:
+        return None
+
+    return datetime.fromisoformat(str(timestamp).replace("Z", "+00:00"))
+
+
+def get_seconds(start, end):
+    """
+    Seconds between two datetimes, None if either is missing
+    :param start:
+    :param end:
+    :return:
+    """
+
+    if start is None or end is None:
+        return None
+
+    return max((end - start).total_seconds(), 0)
+
+
+def format_duration(seconds):
+    """
+    i.e 3725 -> 1:02:05
+    :param seconds:
+    :return:
+    """
+
+    if seconds is None:
+        return None
+
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+
+    return "{}:{:02d}:{:02d}".format(hours, minutes, seconds)
+
+
+def iter_metadata_calls(metadata_h, workflow):
+    """
+    Parse the metadata as it is read, yielding each attempt of each call as soon as it is complete
+    :param metadata_h: binary file-like object of the metadata json
+    :param workflow: dict, filled in with the top level keys in WORKFLOW_KEYS
+    :return: generator of (call name, call attempt dict)
+    """
+
+    # Imported here so the other cromwell scripts don't need it
+    import ijson
+
+    call_name = None
+    call_prefix = None
+    call_builder = None
+    skip_prefix = None
+
+    for prefix, event, value in ijson.parse(metadata_h):
+        if call_builder is not None:
+            if skip_prefix is not None:
+                if prefix == skip_prefix or prefix.startswith(skip_prefix + "."):
+                    continue
+                skip_prefix = None
+
+            if prefix == call_prefix and event == "map_key" and value in SKIPPED_CALL_KEYS:
+                skip_prefix = "{}.{}".format(call_prefix, value)
+                continue
+
+            call_builder.event(event, value)
+
+            if prefix == call_prefix and event == "end_map":
+                yield call_name, call_builder.value
+                call_builder = None
+            continue
+
+        if prefix == "calls" and event == "map_key":
+            call_name = value
+            call_prefix = "calls.{}.item".format(call_name)
+        elif call_prefix is not None and prefix == call_prefix and event == "start_map":
+            call_builder = ijson.ObjectBuilder()
+            call_builder.event(event, value)
+        elif prefix in WORKFLOW_KEYS and event in ["string", "number"]:
+            workflow[prefix] = value
+
+
+def get_file_time(file_path):
+    """
+    Modification time of a file as an aware datetime
+    :param file_path:
+    :return: None if the file isn't there
+    """
+
+    try:
+        return datetime.fromtimestamp(file_path.stat().st_mtime, tz=timezone.utc)
+    except OSError:
+        return None
+
+
+def get_slurm_timings(execution_dir, job_id):
+    """
+    When the slurm job was submitted and started, and when its docker_pull and docker_exec steps finished,
+    from the files cromwell and submit_to_sbatch.sh leave in the execution directory
+    :param execution_dir:
+    :param job_id:
+    :return: dict of submitted, started, pulled, executed (datetimes or None) and restarts
+    """
+
+    slurm_timings = {
+        "submitted": get_file_time(execution_dir / SUBMIT_FILE_NAME),
+        # Written with scontrol as each run of the job starts
+        "started": get_file_time(execution_dir / BATCH_SCRIPT_NAME_TEMPLATE.format(job_id)),
+        "pulled": None,
+        "executed": None,
+        "restarts": 0
+    }
+
+    try:
+        execution_file_names = os.listdir(execution_dir)
+    except OSError:
+        return slurm_timings
+
+    # Log files of each step, by restart count
+    step_logs = {}
+    for execution_file_name in execution_file_names:
+        step_log_match = STEP_LOG_REGEX.match(execution_file_name)
+        if step_log_match is None or not step_log_match.group(2) == str(job_id):
+            continue
+        step_logs.setdefault(int(step_log_match.group(3)), {}).setdefault(step_log_match.group(1), []).append(
+            execution_dir / execution_file_name
+        )
+
+    if len(step_logs) == 0:
+        return slurm_timings
+
+    # Only the last run of a requeued job counts towards its timings
+    slurm_timings["restarts"] = max(step_logs.keys())
+    last_step_logs = step_logs[slurm_timings["restarts"]]
+
+    for step, step_time_key in [("build", "pulled"), ("exec", "executed")]:
+        step_log_times = [get_file_time(step_log) for step_log in last_step_logs.get(step, [])]
+        step_log_times = [step_log_time for step_log_time in step_log_times if step_log_time is not None]
+        if len(step_log_times) > 0:
+            slurm_timings[step_time_key] = max(step_log_times)
+
+    return slurm_timings
+
+
+def get_call_timings(call_name, call_attempt, read_logs=True):
+    """
+    Split the time of a call attempt into PHASES
+    :param call_name:
+    :param call_attempt: dict from iter_metadata_calls
+    :param read_logs: look in the execution directory for the slurm timings
+    :return: dict
+    """
+
+    call_start = parse_timestamp(call_attempt.get("start"))
+    call_end = parse_timestamp(call_attempt.get("end"))
+
+    queued = None
+    running_start = None
+
+    for execution_event in call_attempt.get("executionEvents", []):
+        event_seconds = get_seconds(parse_timestamp(execution_event.get("startTime")),
+                                    parse_timestamp(execution_event.get("endTime")))
+        if execution_event.get("description") == CROMWELL_RUNNING_EVENT:
+            running_start = parse_timestamp(execution_event.get("startTime"))
+        elif execution_event.get("description") in CROMWELL_QUEUE_EVENTS and event_seconds is not None:
+            queued = (queued or 0) + event_seconds
+
+    call_timings = {
+        "call": call_name,
+        "shard": int(call_attempt.get("shardIndex", -1)),
+        "attempt": int(call_attempt.get("attempt", 1)),
+        "status": call_attempt.get("executionStatus"),
+        "job_id": call_attempt.get("jobId"),
+        "start": call_start,
+        "end": call_end,
+        "total": get_seconds(call_start, call_end),
+        "queued": queued,
+        "pending": None,
+        "pull": None,
+        "exec": None,
+        "preemptions": 0,
+        "retryable_failure": bool(call_attempt.get("retryableFailure", False))
+    }
+
+    if not read_logs or call_attempt.get("callRoot") is None or call_attempt.get("jobId") is None:
+        return call_timings
+
+    slurm_timings = get_slurm_timings(Path(call_attempt["callRoot"]) / "execution", call_attempt["jobId"])
+
+    call_timings["pending"] = get_seconds(slurm_timings["submitted"] or running_start, slurm_timings["started"])
+    call_timings["pull"] = get_seconds(slurm_timings["started"], slurm_timings["pulled"])
+    call_timings["exec"] = get_seconds(slurm_timings["pulled"], slurm_timings["executed"] or call_end)
+    call_timings["preemptions"] = slurm_timings["restarts"]
+
+    return call_timings
+
+
+def get_task_summaries(calls_timings):
+    """
+    Sum up the calls of each task
+    :param calls_timings: list of get_call_timings
+    :return: dict of task name to summary, slowest first
+    """
+
+    task_summaries = {}
+
+    for call_timings in calls_timings:
+        task_summary = task_summaries.setdefault(call_timings["call"], dict(
+            {"shards": set(), "attempts": 0, "retries": 0, "preemptions": 0, "total": 0, "max": 0},
+            **{phase: 0 for phase in PHASES}
+        ))
+        task_summary["shards"].add(call_timings["shard"])
+        task_summary["attempts"] += 1
+        task_summary["retries"] += 1 if call_timings["attempt"] > 1 else 0
+        task_summary["preemptions"] += call_timings["preemptions"]
+        task_summary["total"] += call_timings["total"] or 0
+        task_summary["max"] = max(task_summary["max"], call_timings["total"] or 0)
+        for phase in PHASES:
+            task_summary[phase] += call_timings[phase] or 0
+
+    return dict(sorted(task_summaries.items(), key=lambda item: item[1]["total"], reverse=True))
+
+
+def get_critical_path(calls_timings):
+    """
+    The chain of calls that held up the end of the workflow:
+    the call that finished last, then the call that finished last before that one started, and so on
+    :param calls_timings:
+    :return: list of call timings, first call first, each with 'wait' set to the gap before it started
+    """
+
+    finished_calls = sorted([call_timings for call_timings in calls_timings
+                             if call_timings["start"] is not None and call_timings["end"] is not None],
+                            key=lambda call_timings: call_timings["end"])
+
+    critical_path = []
+
+    while len(finished_calls) > 0:
+        call_timings = finished_calls.pop()
+        critical_path.append(dict(call_timings))
+        finished_calls = [previous_call_timings for previous_call_timings in finished_calls
+                          if previous_call_timings["end"] <= call_timings["start"]]
+
+    critical_path.reverse()
+
+    for previous_call_timings, call_timings in zip([None] + critical_path[:-1], critical_path):
+        call_timings["wait"] = get_seconds(previous_call_timings["end"], call_timings["start"]) \
+            if previous_call_timings is not None else None
+
+    return critical_path
+
+
+def print_table(columns, rows):
+    """
+    Print rows in fixed width columns
+    :param columns: list of (header, width)
+    :param rows:
+    :return:
+    """
+
+    for row in [[column for column, _ in columns]] + rows:
+        values = ["-" if value is None else str(value) for value in row]
+        print("  ".join([value.ljust(width) for value, (_, width) in zip(values[:-1], columns[:-1])] +
+                        [values[-1]]))
+
+
+def print_profile(workflow, calls_timings):
+    """
+    Print the per task table, where the time went overall, and the critical path
+    :param workflow:
+    :param calls_timings:
+    :return:
+    """
+
+    workflow_seconds = get_seconds(parse_timestamp(workflow.get("start")), parse_timestamp(workflow.get("end")))
+
+    print("Workflow {} ({}) {}, {} calls, took {}".format(
+        workflow.get("workflowName"), workflow.get("id"), workflow.get("status"), len(calls_timings),
+        format_duration(workflow_seconds) or "-"
+    ))
+    print()
+
+    task_summaries = get_task_summaries(calls_timings)
+
+    print_table(TASK_COLUMNS, [
+        [task_name, len(task_summary["shards"]), task_summary["attempts"], task_summary["retries"],
+         task_summary["preemptions"]] +
+        [format_duration(task_summary[phase]) for phase in PHASES] +
+        [format_duration(task_summary["total"]), format_duration(task_summary["max"])]
+        for task_name, task_summary in task_summaries.items()
+    ])
+    print()
+
+    phase_seconds = {phase: sum(task_summary[phase] for task_summary in task_summaries.values()) for phase in PHASES}
+    total_phase_seconds = sum(phase_seconds.values())
+
+    if total_phase_seconds > 0:
+        print("Call time spent " + ", ".join(
+            "{} {:.0f}%".format(phase, phase_seconds[phase] * 100 / total_phase_seconds) for phase in PHASES
+        ))
+        print()
+
+    print("Critical path")
+    print_table(CRITICAL_PATH_COLUMNS, [
+        [call_timings["call"], call_timings["shard"], call_timings["attempt"],
+         call_timings["start"].strftime("%Y-%m-%d %H:%M:%S"), format_duration(call_timings["wait"])] +
+        [format_duration(call_timings[phase]) for phase in PHASES] +
+        [format_duration(call_timings["total"])]
+        for call_timings in get_critical_path(calls_timings)
+    ])
+
+
+def write_calls_jsonl(calls_timings, calls_jsonl_path):
+    """
+    Write the timings of every call, one json object per line
+    :param calls_timings:
+    :param calls_jsonl_path:
+    :return:
+    """
+
+    with open(calls_jsonl_path, 'w') as calls_jsonl_h:
+        for call_timings in calls_timings:
+            calls_jsonl_h.write(json.dumps({key: value.isoformat() if isinstance(value, datetime) else value
+                                            for key, value in call_timings.items()}) + "\n")
+
+
+def main():
+    logging.basicConfig(level=os.environ.get("CROMWELL_LOG_LEVEL", "INFO"),
+                        format="%(asctime)s %(levelname)-8s %(message)s")
+
+    args = get_args()
+
+    try:
+        import ijson  # noqa: F401
+    except ImportError:
+        logger.error("ijson is required to profile workflows, please install it first")
+        sys.exit(1)
+
+    workflow = {}
+
+    try:
+        if args.metadata_json is not None:
+            metadata_h = open(args.metadata_json, 'rb')
+        else:
+            metadata_h = get_metadata_stream(get_session(pool_size=1), get_cromwell_url(args.webservice_port),
+                                             args.workflow_id, include_keys=METADATA_INCLUDE_KEYS)
+    except (OSError, CromwellError) as open_error:
+        logger.error(open_error)
+        sys.exit(1)
+
+    with metadata_h:
+        calls_timings = [get_call_timings(call_name, call_attempt, read_logs=not args.no_logs)
+                         for call_name, call_attempt in iter_metadata_calls(metadata_h, workflow)]
+
+    if len(calls_timings) == 0:
+        logger.error("No calls found in the metadata of workflow {}".format(workflow.get("id")))
+        sys.exit(1)
+
+    print_profile(workflow, calls_timings)
+
+    if args.calls_jsonl is not None:
+        write_calls_jsonl(calls_timings, args.calls_jsonl)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,20 +2,45 @@
 
 """
 Wrapper around the cromwell api
+
+Submit a single workflow:
+submit_to_cromwell.py --workflow-source main.wdl --workflow-inputs sample.inputs.json
+
+Or one workflow for each inputs json in a directory / listed in a manifest (one path per line):
+submit_to_cromwell.py --workflow-source main.wdl --batch inputs/
+
+Unless --workflow-dependencies is given, the local imports of the workflow source are bundled into
+a dependencies zip, cached by content so an unchanged workflow reuses the same zip, see workflow_bundle.
+
+Batch submissions share one pooled http session and one dependencies zip,
+and are sent max-workflow-launch-count at a time, as read from the server's configuration. With --throttle, each round also waits for the server
+to have a free max-concurrent-workflows slot for each workflow in it.
+Each workflow id is appended to the ledger as soon as it is known, along with a hash of the workflow source and
+dependencies zip. Inputs already in the ledger for the same workflow are skipped, so a batch that was interrupted
+can just be run again, while the same inputs run through a different workflow are still submitted.
 """
 
 import os
+import sys
+import json
+import time
+import hashlib
+import logging
 import argparse
 from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from cromwell_tools import api
-from cromwell_tools import utilities
-from cromwell_tools.cromwell_auth import CromwellAuth
+from workflow_bundle import get_workflow_bundle, WorkflowBundleError
+from cromwell_utils import get_session, get_cromwell_url, get_workflow_files, submit_workflow, \
+    read_cromwell_system_settings, count_active_workflows, CromwellError, \
+    DEFAULT_WEBSERVICE_PORT, DEFAULT_CROMWELL_CONF
 
+logger = logging.getLogger("cromwell")
 
 # Set defaults
-DEFAULT_WEBSERVICE_PORT = 8000
 DEFAULT_WORKFLOW_OPTIONS = Path("/opt/cromwell/configs/options.json")
+DEFAULT_LEDGER = Path("cromwell_submissions.jsonl")
 
 
 def get_args():
@@ -23,12 +48,19 @@ def get_args():
     parser.add_argument("--workflow-source",
                         required=True,
                         help="Path to workflow code")
-    parser.add_argument("--workflow-inputs",
-                        required=True,
-                        help="Path to workflow inputs configuration")
+    inputs_group = parser.add_mutually_exclusive_group(required=True)
+    inputs_group.add_argument("--workflow-inputs",
+                              help="Path to workflow inputs configuration")
+    inputs_group.add_argument("--batch",
+                              help="Directory of inputs jsons, or a file listing one inputs json per line, "
+                                   "to submit a workflow for each")
     parser.add_argument("--workflow-dependencies",
                         required=False,
-                        help="Zip file containing workflow dependencies")
+                        help="Zip file containing workflow dependencies, "
+                             "built from the imports of the workflow source if not given")
+    parser.add_argument("--no-bundle",
+                        action="store_true", default=False,
+                        help="Don't build a dependencies zip from the imports of the workflow source")
     parser.add_argument("--webservice-port",
                         type=int,
                         required=False, default=DEFAULT_WEBSERVICE_PORT,
@@ -36,6 +68,19 @@ def get_args():
     parser.add_argument("--workflow-options-json",
                         required=False, default=DEFAULT_WORKFLOW_OPTIONS,
                         help="Options.json file")
+    parser.add_argument("--cromwell-conf",
+                        required=False, default=DEFAULT_CROMWELL_CONF,
+                        help="Cromwell server configuration, read for max-workflow-launch-count "
+                             "and max-concurrent-workflows")
+    parser.add_argument("--ledger",
+                        required=False, default=DEFAULT_LEDGER,
+                        help="json lines file that each batch submission (inputs, workflow hash, workflow id) is appended to")
+    parser.add_argument("--throttle",
+                        action="store_true", default=False,
+                        help="Only submit as many workflows as the server has max-concurrent-workflows slots free")
+    parser.add_argument("--dry-run",
+                        action="store_true", default=False,
+                        help="List the inputs that would be submitted and exit")
 
     return parser.parse_args()
 
@@ -49,56 +94,280 @@ def check_args(args):
     workflow_source_arg = getattr(args, "workflow_source", None)
     workflow_source = Path(workflow_source_arg)
     if not workflow_source.is_file():
+        logger.error("Could not find workflow source \"{}\"".format(workflow_source))
         sys.exit(1)
     setattr(args, "workflow_source", workflow_source)
 
     # Convert workflow inputs to path object
     workflow_inputs_arg = getattr(args, "workflow_inputs", None)
-    workflow_inputs = Path(workflow_inputs_arg)
-    if not workflow_inputs.is_file():
-        sys.exit(1)
-    setattr(args, "workflow_inputs", workflow_inputs)
+    if workflow_inputs_arg is not None:
+        workflow_inputs = Path(workflow_inputs_arg)
+        if not workflow_inputs.is_file():
+            logger.error("Could not find workflow inputs \"{}\"".format(workflow_inputs))
+            sys.exit(1)
+        setattr(args, "workflow_inputs", workflow_inputs)
+
+    # Collect the inputs of each workflow in the batch
+    batch_arg = getattr(args, "batch", None)
+    if batch_arg is not None:
+        setattr(args, "batch_inputs", get_batch_inputs(Path(batch_arg)))
 
     # Check workflow dependencies is a zip file, otherwise exit
     workflow_dependencies_arg = getattr(args, "workflow_dependencies", None)
     if workflow_dependencies_arg is not None:
         workflow_dependencies = Path(workflow_dependencies_arg)
         if not workflow_dependencies.is_file():
+            logger.error("Could not find workflow dependencies \"{}\"".format(workflow_dependencies))
             sys.exit(1)
         setattr(args, "workflow_dependencies", workflow_dependencies)
+    elif not args.no_bundle:
+        # Bundle the workflow's imports ourselves, reusing the zip from last time if nothing has changed
+        try:
+            setattr(args, "workflow_dependencies", get_workflow_bundle(workflow_source))
+        except WorkflowBundleError as bundle_error:
+            logger.error(bundle_error)
+            sys.exit(1)
 
     # Check options is a file
     workflow_options_json_arg = getattr(args, "workflow_options_json", None)
     if workflow_options_json_arg is not None:
         workflow_options_json = Path(workflow_options_json_arg)
         if not workflow_options_json.is_file():
+            logger.error("Could not find workflow options \"{}\"".format(workflow_options_json))
             sys.exit(1)
         setattr(args, "workflow_options_json", workflow_options_json)
 
     return args
 
 
-def submit_to_cromwell(args):
-    # Get authentication (as no authentication)
-    auth = CromwellAuth.from_no_authentication(url="http://localhost:{}".format(args.webservice_port))
+def get_batch_inputs(batch_path):
+    """
+    Inputs jsons of a batch, either every json file in a directory
+    or each path listed in a manifest (blank lines and # comments skipped, relative paths are to the manifest)
+    :param batch_path:
+    :return: list of absolute Paths
+    """
 
-    response = api.submit(auth=auth,
-                          wdl_file=args.workflow_source,
-                          inputs_files=args.workflow_inputs,
-                          dependencies=args.workflow_dependencies,
-                          validate_labels=True)
+    if batch_path.is_dir():
+        batch_inputs = sorted(batch_path.glob("*.json"))
+    elif batch_path.is_file():
+        with open(batch_path, 'r') as batch_h:
+            batch_inputs = [batch_path.parent / line.strip()
+                            for line in batch_h
+                            if line.strip() != "" and not line.strip().startswith("#")]
+    else:
+        logger.error("Could not find batch \"{}\"".format(batch_path))
+        sys.exit(1)
 
-    # FIXME - need to test this first a bit
-    print(response)
+    missing_inputs = [str(workflow_inputs) for workflow_inputs in batch_inputs if not workflow_inputs.is_file()]
+    if len(missing_inputs) > 0:
+        logger.error("Could not find inputs {}".format(", ".join(missing_inputs)))
+        sys.exit(1)
+
+    if len(batch_inputs) == 0:
+        logger.error("No inputs jsons found in \"{}\"".format(batch_path))
+        sys.exit(1)
+
+    return [workflow_inputs.absolute() for workflow_inputs in batch_inputs]
+
+
+def get_workflow_key(workflow_files):
+    """
+    Hash of the workflow source and dependencies zip, so the ledger can tell one workflow from another
+    :param workflow_files: from get_workflow_files
+    :return: sha256 hex digest
+    """
+
+    workflow_hash = hashlib.sha256()
+
+    for field in ["workflowSource", "workflowDependencies"]:
+        if field in workflow_files:
+            workflow_hash.update(field.encode())
+            workflow_hash.update(hashlib.sha256(workflow_files[field][1]).digest())
+
+    return workflow_hash.hexdigest()
+
+
+def read_ledger(ledger_path, workflow_key):
+    """
+    Workflow ids already recorded in the ledger for this workflow, keyed by inputs path
+    Entries for any other workflow (or from before the workflow was recorded) are left out
+    :param ledger_path:
+    :param workflow_key: from get_workflow_key
+    :return:
+    """
+
+    submitted_workflows = {}
+
+    if not Path(ledger_path).is_file():
+        return submitted_workflows
+
+    with open(ledger_path, 'r') as ledger_h:
+        for line in ledger_h:
+            try:
+                ledger_entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Partial line from an interrupted run
+                continue
+            if ledger_entry.get("workflow_id") is not None and ledger_entry.get("workflow") == workflow_key:
+                submitted_workflows[ledger_entry["inputs"]] = ledger_entry["workflow_id"]
+
+    return submitted_workflows
+
+
+def get_ledger_entry(workflow_inputs, workflow_key, submission_future):
+    """
+    Ledger entry of a submission, waiting for it to finish if it hasn't yet
+    :param workflow_inputs:
+    :param workflow_key: from get_workflow_key
+    :param submission_future: future of submit_workflow
+    :return: dict of inputs, workflow, workflow_id (None if it failed) and submitted, with the error if it failed
+    """
+
+    ledger_entry = {
+        "inputs": str(workflow_inputs),
+        "workflow": workflow_key,
+        "workflow_id": None,
+        "submitted": datetime.now().isoformat(timespec="seconds")
+    }
+
+    try:
+        ledger_entry["workflow_id"] = submission_future.result()
+        logger.info("Submitted \"{}\" as {}".format(workflow_inputs, ledger_entry["workflow_id"]))
+    except Exception as submission_error:
+        # Anything unexpected only fails this submission, the rest of the round is still recorded
+        ledger_entry["error"] = str(submission_error)
+        logger.error(submission_error)
+
+    return ledger_entry
+
+
+def submit_batch(args, cromwell_url):
+    """
+    Submit a workflow for each inputs json of the batch, recording each in the ledger
+    :param args:
+    :param cromwell_url:
+    :return: number of submissions that failed
+    """
+
+    workflow_files = get_workflow_files(args.workflow_source,
+                                        workflow_dependencies=args.workflow_dependencies,
+                                        workflow_options=args.workflow_options_json)
+    workflow_key = get_workflow_key(workflow_files)
+
+    # Skip anything the ledger says we've submitted through this workflow before
+    submitted_workflows = read_ledger(args.ledger, workflow_key)
+    batch_inputs = [workflow_inputs for workflow_inputs in args.batch_inputs
+                    if str(workflow_inputs) not in submitted_workflows]
+
+    if len(batch_inputs) < len(args.batch_inputs):
+        logger.info("Skipping {} inputs already in the ledger \"{}\" for workflow \"{}\"".format(
+            len(args.batch_inputs) - len(batch_inputs), args.ledger, args.workflow_source
+        ))
+
+    if args.dry_run:
+        for workflow_inputs in batch_inputs:
+            print(workflow_inputs)
+        return 0
+
+    system_settings = read_cromwell_system_settings(args.cromwell_conf)
+    launch_count = system_settings["max-workflow-launch-count"]
+
+    session = get_session(pool_size=launch_count)
+
+    failed_submissions = 0
+
+    with open(args.ledger, 'a') as ledger_h, ThreadPoolExecutor(max_workers=launch_count) as executor:
+        while len(batch_inputs) > 0:
+            # Send at most max-workflow-launch-count workflows in each round,
+            # when throttling, no more than the server has slots free for
+            round_size = launch_count
+            if args.throttle:
+                round_size = min(round_size,
+                                 system_settings["max-concurrent-workflows"] -
+                                 count_active_workflows(session, cromwell_url))
+                if round_size <= 0:
+                    time.sleep(system_settings["new-workflow-poll-rate"])
+                    continue
+
+            round_inputs, batch_inputs = batch_inputs[:round_size], batch_inputs[round_size:]
+
+            submission_futures = {
+                executor.submit(submit_workflow, session, cromwell_url, workflow_files, workflow_inputs):
+                    workflow_inputs
+                for workflow_inputs in round_inputs
+            }
+
+            # Every submission of the round is written to the ledger, even if we're interrupted part way,
+            # as those already sent may well have been accepted
+            recorded_futures = set()
+            try:
+                for submission_future in as_completed(submission_futures):
+                    recorded_futures.add(submission_future)
+                    ledger_entry = get_ledger_entry(submission_futures[submission_future], workflow_key,
+                                                    submission_future)
+                    failed_submissions += 1 if "error" in ledger_entry else 0
+                    ledger_h.write(json.dumps(ledger_entry) + "\n")
+                    ledger_h.flush()
+            finally:
+                for submission_future, workflow_inputs in submission_futures.items():
+                    if submission_future in recorded_futures or submission_future.cancel():
+                        continue
+                    ledger_entry = get_ledger_entry(workflow_inputs, workflow_key, submission_future)
+                    ledger_h.write(json.dumps(ledger_entry) + "\n")
+                    ledger_h.flush()
+
+            # Let the server pick up this round before sending the next one
+            if args.throttle and len(batch_inputs) > 0:
+                time.sleep(system_settings["new-workflow-poll-rate"])
+
+    return failed_submissions
+
+
+def submit_to_cromwell(args, cromwell_url):
+    """
+    Submit a single workflow, printing its id
+    :param args:
+    :param cromwell_url:
+    :return:
+    """
+
+    session = get_session(pool_size=1)
+    workflow_files = get_workflow_files(args.workflow_source,
+                                        workflow_dependencies=args.workflow_dependencies,
+                                        workflow_options=args.workflow_options_json)
+
+    try:
+        workflow_id = submit_workflow(session, cromwell_url, workflow_files, args.workflow_inputs)
+    except CromwellError as cromwell_error:
+        logger.error(cromwell_error)
+        sys.exit(1)
+
+    print(json.dumps({"id": workflow_id, "inputs": str(args.workflow_inputs)}))
 
 
 def main():
+    logging.basicConfig(level=os.environ.get("CROMWELL_LOG_LEVEL", "INFO"),
+                        format="%(asctime)s %(levelname)-8s %(message)s")
     # Get args
     args = get_args()
     # Check em
     args = check_args(args)
     # Submit to cromwell
-    submit_to_cromwell(args)
+    cromwell_url = get_cromwell_url(args.webservice_port)
+
+    if args.batch is not None:
+        failed_submissions = submit_batch(args, cromwell_url)
+        if failed_submissions > 0:
+            logger.error("{} workflows could not be submitted, run again to retry them".format(failed_submissions))
+            sys.exit(1)
+        return
+
+    if args.dry_run:
+        print(args.workflow_inputs)
+        return
+
+    submit_to_cromwell(args, cromwell_url)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+
+"""
+Follow workflows on the cromwell server until they finish
+
+Follow the workflows of a submission ledger written by submit_to_cromwell.py --batch:
+track_cromwell.py --ledger cromwell_submissions.jsonl
+
+Or every workflow carrying a label:
+track_cromwell.py --label cohort:2021-06
+
+Each tick makes one bulk query, however many workflows are being followed.
+Running workflows are checked every --active-interval seconds, queued ones (Submitted / On Hold)
+only every --queued-interval seconds, and workflows that have finished are written to the store and never checked again.
+A summary line of the counts of each status is printed whenever one of them changes.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+from cromwell_utils import get_session, get_cromwell_url, query_workflows, CromwellError, \
+    TERMINAL_WORKFLOW_STATUSES, DEFAULT_WEBSERVICE_PORT
+
+logger = logging.getLogger("cromwell")
+
+DEFAULT_STORE = Path("cromwell_workflows.jsonl")
+DEFAULT_ACTIVE_INTERVAL = 30
+DEFAULT_QUEUED_INTERVAL = 300
+
+# Statuses of workflows that are doing something, and so are worth checking often
+BUSY_WORKFLOW_STATUSES = ["Running", "Aborting"]
+
+# Order of the statuses in the summary line, workflows the server hasn't reported on yet are Unknown
+SUMMARY_STATUSES = ["Unknown", "On Hold", "Submitted", "Running", "Aborting"] + TERMINAL_WORKFLOW_STATUSES
+
+# Workflows due within this fraction of the active interval are checked in the same tick
+TICK_GROUPING_FRACTION = 0.5
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Follow workflows on the cromwell server until they finish")
+    workflows_group = parser.add_mutually_exclusive_group(required=True)
+    workflows_group.add_argument("--ledger",
+                                 help="Submission ledger written by submit_to_cromwell.py --batch")
+    workflows_group.add_argument("--label",
+                                 nargs="+",
+                                 help="Follow every workflow with these labels, given as key:value")
+    parser.add_argument("--webservice-port",
+                        type=int,
+                        required=False, default=DEFAULT_WEBSERVICE_PORT,
+                        help="Port that cromwell is running on")
+    parser.add_argument("--store",
+                        required=False, default=DEFAULT_STORE,
+                        help="json lines file that workflows are appended to once they have finished")
+    parser.add_argument("--active-interval",
+                        type=float,
+                        required=False, default=DEFAULT_ACTIVE_INTERVAL,
+                        help="Seconds between checks of running workflows")
+    parser.add_argument("--queued-interval",
+                        type=float,
+                        required=False, default=DEFAULT_QUEUED_INTERVAL,
+                        help="Seconds between checks of workflows that are yet to start")
+    parser.add_argument("--once",
+                        action="store_true", default=False,
+                        help="Check every workflow once, print the summary and exit")
+
+    args = parser.parse_args()
+
+    if args.active_interval <= 0 or args.queued_interval < args.active_interval:
+        parser.error("--active-interval must be positive and no longer than --queued-interval")
+
+    if args.label is not None and any(":" not in label for label in args.label):
+        parser.error("--label must be given as key:value")
+
+    return args
+
+
+def read_ledger_workflows(ledger_path):
+    """
+    Workflow ids of a submission ledger, with the inputs each was submitted with
+    :param ledger_path:
+    :return: dict of workflow id to inputs
+    """
+
+    ledger_workflows = {}
+
+    try:
+        with open(ledger_path, 'r') as ledger_h:
+            for line in ledger_h:
+                try:
+                    ledger_entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if ledger_entry.get("workflow_id") is not None:
+                    ledger_workflows[ledger_entry["workflow_id"]] = ledger_entry.get("inputs")
+    except OSError as os_error:
+        logger.error("Could not read ledger \"{}\": {}".format(ledger_path, os_error))
+        sys.exit(1)
+
+    return ledger_workflows
+
+
+def read_store(store_path):
+    """
+    Workflows already known to have finished
+    :param store_path:
+    :return: dict of workflow id to the stored workflow
+    """
+
+    finished_workflows = {}
+
+    if not Path(store_path).is_file():
+        return finished_workflows
+
+    with open(store_path, 'r') as store_h:
+        for line in store_h:
+            try:
+                workflow = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            finished_workflows[workflow["id"]] = workflow
+
+    return finished_workflows
+
+
+class WorkflowTracker(object):
+    """
+    Status of each workflow being followed, and when it is next due to be checked
+    """
+
+    def __init__(self, session, cromwell_url, store_h, active_interval, queued_interval,
+                 workflow_inputs=None, labels=None, finished_workflows=None):
+        """
+        :param session:
+        :param cromwell_url:
+        :param store_h: open handle of the store, finished workflows are appended to it
+        :param active_interval:
+        :param queued_interval:
+        :param workflow_inputs: dict of workflow id to inputs, the workflows to follow when not using labels
+        :param labels: list of key:value labels, follow every workflow that has them
+        :param finished_workflows: from read_store
+        """
+
+        self.session = session
+        self.cromwell_url = cromwell_url
+        self.store_h = store_h
+        self.active_interval = active_interval
+        self.queued_interval = queued_interval
+        self.workflow_inputs = workflow_inputs if workflow_inputs is not None else {}
+        self.labels = labels
+        self.finished_workflows = finished_workflows if finished_workflows is not None else {}
+
+        # Every workflow being followed, finished or not, label queries add to these as they find workflows
+        self.workflow_ids = set(self.workflow_inputs.keys())
+
+        # Workflows still to finish, id to status, all due straight away
+        self.statuses = {workflow_id: "Unknown"
+                         for workflow_id in self.workflow_inputs.keys()
+                         if workflow_id not in self.finished_workflows}
+        self.next_checks = {workflow_id: 0 for workflow_id in self.statuses.keys()}
+        self.next_label_check = 0
+
+    def get_interval(self, status):
+        """
+        Seconds until a workflow with this status is checked again
+        :param status:
+        :return:
+        """
+
+        if status in BUSY_WORKFLOW_STATUSES:
+            return self.active_interval
+        return self.queued_interval
+
+    def get_due_workflow_ids(self, now):
+        """
+        Workflows to check in this tick, those due now and those due shortly after
+        :param now:
+        :return:
+        """
+
+        due_time = now + self.active_interval * TICK_GROUPING_FRACTION
+
+        return [workflow_id for workflow_id, next_check in self.next_checks.items() if next_check <= due_time]
+
+    def get_next_tick(self):
+        """
+        time.monotonic() of when the next workflow is due
+        :return:
+        """
+
+        if self.labels is not None:
+            return self.next_label_check
+
+        return min(self.next_checks.values())
+
+    def is_done(self):
+        """
+        Have all the workflows finished
+        :return:
+        """
+
+        return len(self.statuses) == 0 and len(self.workflow_ids) > 0
+
+    def tick(self):
+        """
+        Check the workflows that are due, in one query
+        :return: list of the workflows that finished in this tick
+        """
+
+        now = time.monotonic()
+
+        if self.labels is not None:
+            # Label queries find new workflows too, so there are no ids to narrow the query down with
+            workflows = query_workflows(self.session, self.cromwell_url,
+                                        label=self.labels, includeSubworkflows="false")
+            self.workflow_ids.update(workflow["id"] for workflow in workflows)
+            workflows = [workflow for workflow in workflows if workflow["id"] not in self.finished_workflows]
+        else:
+            due_workflow_ids = self.get_due_workflow_ids(now)
+            if len(due_workflow_ids) == 0:
+                return []
+            workflows = query_workflows(self.session, self.cromwell_url,
+                                        id=due_workflow_ids, includeSubworkflows="false")
+            # Workflows the server doesn't know about (yet) are checked again later
+            for workflow_id in due_workflow_ids:
+                self.next_checks[workflow_id] = now + self.get_interval(self.statuses[workflow_id])
+
+        finished_workflows = []
+
+        for workflow in workflows:
+            workflow_id = workflow["id"]
+            status = workflow.get("status", "Unknown")
+
+            if status in TERMINAL_WORKFLOW_STATUSES:
+                stored_workflow = dict(workflow, inputs=self.workflow_inputs.get(workflow_id))
+                self.store_h.write(json.dumps(stored_workflow) + "\n")
+                self.store_h.flush()
+                self.finished_workflows[workflow_id] = stored_workflow
+                self.statuses.pop(workflow_id, None)
+                self.next_checks.pop(workflow_id, None)
+                finished_workflows.append(stored_workflow)
+                continue
+
+            self.statuses[workflow_id] = status
+            self.next_checks[workflow_id] = now + self.get_interval(status)
+
+        if self.labels is not None:
+            self.next_label_check = now + min([self.get_interval(status) for status in self.statuses.values()] +
+                                              [self.queued_interval])
+
+        return finished_workflows
+
+    def get_summary(self):
+        """
+        Count of the workflows in each status, finished workflows included
+        :return:
+        """
+
+        status_counts = {status: 0 for status in SUMMARY_STATUSES}
+
+        for status in self.statuses.values():
+            status_counts[status] = status_counts.get(status, 0) + 1
+
+        for workflow in self.finished_workflows.values():
+            if workflow["id"] not in self.workflow_ids:
+                continue
+            status_counts[workflow["status"]] = status_counts.get(workflow["status"], 0) + 1
+
+        return status_counts
+
+
+def get_summary_line(status_counts):
+    """
+    One line summary, i.e 12:00:00  Submitted 4  Running 10  Succeeded 30  Failed 1
+    :param status_counts:
+    :return:
+    """
+
+    return "  ".join([datetime.now().strftime("%H:%M:%S")] +
+                     ["{} {}".format(status, count) for status, count in status_counts.items() if count > 0])
+
+
+def main():
+    logging.basicConfig(level=os.environ.get("CROMWELL_LOG_LEVEL", "INFO"),
+                        format="%(asctime)s %(levelname)-8s %(message)s")
+
+    args = get_args()
+
+    workflow_inputs = read_ledger_workflows(args.ledger) if args.ledger is not None else None
+    if workflow_inputs is not None and len(workflow_inputs) == 0:
+        logger.error("No workflow ids found in ledger \"{}\"".format(args.ledger))
+        sys.exit(1)
+
+    with open(args.store, 'a') as store_h:
+        tracker = WorkflowTracker(session=get_session(pool_size=1),
+                                  cromwell_url=get_cromwell_url(args.webservice_port),
+                                  store_h=store_h,
+                                  active_interval=args.active_interval,
+                                  queued_interval=args.queued_interval,
+                                  workflow_inputs=workflow_inputs,
+                                  labels=args.label,
+                                  finished_workflows=read_store(args.store))
+
+        last_status_counts = None
+
+        try:
+            while True:
+                try:
+                    finished_workflows = tracker.tick()
+                except CromwellError as cromwell_error:
+                    # Keep following, the server may just be busy
+                    logger.warning(cromwell_error)
+                    finished_workflows = []
+
+                for workflow in finished_workflows:
+                    print("{:<10} {} {}".format(workflow["status"], workflow["id"],
+                                                workflow.get("inputs") or workflow.get("name", "")))
+
+                # Only print the summary when something has changed
+                status_counts = tracker.get_summary()
+                if not status_counts == last_status_counts:
+                    print(get_summary_line(status_counts), flush=True)
+                    last_status_counts = status_counts
+
+                if args.once or tracker.is_done():
+                    break
+
+                time.sleep(max(tracker.get_next_tick() - time.monotonic(), 1))
+        except KeyboardInterrupt:
+            print(get_summary_line(tracker.get_summary()))
+
+    status_counts = tracker.get_summary()
+    if status_counts["Failed"] > 0 or status_counts["Aborted"] > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+"""
+Bundle the files a workflow imports into the dependencies zip cromwell expects
+
+The imports of the workflow source are followed (wdl 'import' statements, cwl 'run' / '$import' / '$include'),
+remote (http / https) imports are left for cromwell to fetch itself.
+Files are stored in the zip relative to the directory of the workflow source, as cromwell resolves them.
+
+Zips are written to ${XDG_CACHE_HOME:-~/.cache}/umccr_cromwell/bundles/<key>.zip where the key is
+a hash of the path and content of every file in it, so an unchanged workflow reuses the zip it built last time.
+The zip itself is deterministic (sorted entries, fixed timestamps and permissions).
+
+The hash and imports of each file are cached against its mtime and size,
+so files that haven't changed are neither re-read nor re-parsed.
+"""
+
+import os
+import re
+import json
+import hashlib
+import logging
+import tempfile
+import zipfile
+from pathlib import Path
+
+logger = logging.getLogger("cromwell")
+
+CACHE_DIR_NAME = "umccr_cromwell"
+BUNDLE_CACHE_NAMESPACE = "bundles"
+FILE_HASHES_CACHE_NAME = "file_hashes.json"
+
+WDL_IMPORT_REGEX = re.compile(r"""^\s*import\s+["']([^"']+)["']""", flags=re.MULTILINE)
+# The path has to be on the same line, an inline 'run:' block starts on the next one (or with '{', '|', '>'),
+# and '#fragment' only references are to the same file
+CWL_IMPORT_REGEX = re.compile(r"""^[ \t]*-?[ \t]*(?:run|\$import|\$include)[ \t]*:[ \t]*["']?(?![{\[|>])([^"'\s#]+)""",
+                              flags=re.MULTILINE)
+CWL_SUFFIXES = [".cwl", ".yml", ".yaml"]
+
+# Timestamp given to every entry of the zip, the earliest a zip can hold
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ZIP_FILE_MODE = 0o644
+
+
+class WorkflowBundleError(Exception):
+    """
+    Could not follow the imports of a workflow
+    """
+    pass
+
+
+def get_cache_dir():
+    """
+    Local cache directory, ${XDG_CACHE_HOME:-~/.cache}/umccr_cromwell
+    :return:
+    """
+
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / CACHE_DIR_NAME
+
+
+def is_remote_import(import_path):
+    """
+    Imports cromwell fetches itself
+    :param import_path:
+    :return:
+    """
+
+    return re.match(r"^[a-zA-Z][a-zA-Z0-9+.-]*://", import_path) is not None
+
+
+def get_file_imports(file_content, file_path):
+    """
+    Local imports named in a workflow file
+    :param file_content: bytes
+    :param file_path:
+    :return: list of the import paths as written
+    """
+
+    if file_path.suffix in CWL_SUFFIXES:
+        import_regex = CWL_IMPORT_REGEX
+    else:
+        import_regex = WDL_IMPORT_REGEX
+
+    return [import_path
+            for import_path in import_regex.findall(file_content.decode(errors="replace"))
+            if not is_remote_import(import_path)]
+
+
+class FileHashCache(object):
+    """
+    sha256 and imports of each file, trusted for as long as the file's mtime and size are unchanged
+    """
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.entries = {}
+        self.changed = False
+
+        try:
+            with open(cache_path, 'r') as cache_h:
+                self.entries = json.load(cache_h)
+        except (OSError, json.JSONDecodeError):
+            pass
+
+    def get(self, file_path):
+        """
+        Hash and imports of a file, only reading it if it has changed since it was last seen
+        :param file_path: absolute Path
+        :return: sha256 hex digest, list of imports
+        """
+
+        file_stat = file_path.stat()
+        cache_key = str(file_path)
+        cache_entry = self.entries.get(cache_key)
+
+        if cache_entry is not None and cache_entry["mtime_ns"] == file_stat.st_mtime_ns \
+                and cache_entry["size"] == file_stat.st_size:
+            return cache_entry["sha256"], cache_entry["imports"]
+
+        file_content = file_path.read_bytes()
+        cache_entry = {
+            "mtime_ns": file_stat.st_mtime_ns,
+            "size": file_stat.st_size,
+            "sha256": hashlib.sha256(file_content).hexdigest(),
+            "imports": get_file_imports(file_content, file_path)
+        }
+
+        self.entries[cache_key] = cache_entry
+        self.changed = True
+
+        return cache_entry["sha256"], cache_entry["imports"]
+
+    def save(self):
+        """
+        Write the cache back, if anything in it has changed
+        :return:
+        """
+
+        if not self.changed:
+            return
+
+        try:
+            self.cache_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            cache_fd, cache_tmp_path = tempfile.mkstemp(dir=self.cache_path.parent, suffix=".tmp")
+            with os.fdopen(cache_fd, 'w') as cache_h:
+                json.dump(self.entries, cache_h)
+            os.replace(cache_tmp_path, self.cache_path)
+        except OSError as os_error:
+            logger.debug("Could not write file hash cache \"{}\": {}".format(self.cache_path, os_error))
+
+        self.changed = False
+
+
+def resolve_imports(workflow_source, file_hash_cache):
+    """
+    Follow the import graph of a workflow
+    :param workflow_source: Path to the workflow source
+    :param file_hash_cache: FileHashCache
+    :return: dict of each imported file's path in the zip to (absolute Path, sha256), the source itself is left out
+    """
+
+    workflow_source = workflow_source.absolute()
+    bundle_root = workflow_source.parent
+
+    imported_files = {}
+    files_to_visit = [workflow_source]
+    visited_files = set()
+
+    while len(files_to_visit) > 0:
+        file_path = files_to_visit.pop()
+        if file_path in visited_files:
+            continue
+        visited_files.add(file_path)
+
+        file_hash, file_imports = file_hash_cache.get(file_path)
+
+        if not file_path == workflow_source:
+            imported_files[file_path.relative_to(bundle_root).as_posix()] = (file_path, file_hash)
+
+        for import_path in file_imports:
+            # Relative to the importing file, falling back to the root of the bundle
+            import_file_path = Path(os.path.normpath(file_path.parent / import_path))
+            if not import_file_path.is_file():
+                import_file_path = Path(os.path.normpath(bundle_root / import_path))
+            if not import_file_path.is_file():
+                raise WorkflowBundleError("Could not find \"{}\", imported by \"{}\"".format(import_path, file_path))
+            if bundle_root not in import_file_path.parents:
+                raise WorkflowBundleError("\"{}\" imported by \"{}\" is outside of \"{}\", "
+                                          "so it can't be put in the dependencies zip".format(
+                                            import_path, file_path, bundle_root))
+            files_to_visit.append(import_file_path)
+
+    return imported_files
+
+
+def get_bundle_key(imported_files):
+    """
+    Hash of the path and content of every file in the bundle
+    :param imported_files: from resolve_imports
+    :return:
+    """
+
+    bundle_hash = hashlib.sha256()
+
+    for zip_path, (_, file_hash) in sorted(imported_files.items()):
+        bundle_hash.update("{}\0{}\n".format(zip_path, file_hash).encode())
+
+    return bundle_hash.hexdigest()
+
+
+def write_bundle(imported_files, bundle_path):
+    """
+    Write a deterministic zip of the imported files, entries sorted with fixed timestamps and permissions
+    :param imported_files:
+    :param bundle_path:
+    :return:
+    """
+
+    bundle_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    bundle_fd, bundle_tmp_path = tempfile.mkstemp(dir=bundle_path.parent, suffix=".tmp")
+
+    with os.fdopen(bundle_fd, 'wb') as bundle_h, zipfile.ZipFile(bundle_h, 'w') as bundle_zip:
+        for zip_path, (file_path, _) in sorted(imported_files.items()):
+            zip_info = zipfile.ZipInfo(zip_path, date_time=ZIP_DATE_TIME)
+            zip_info.compress_type = zipfile.ZIP_DEFLATED
+            zip_info.external_attr = ZIP_FILE_MODE << 16
+            bundle_zip.writestr(zip_info, file_path.read_bytes())
+
+    os.replace(bundle_tmp_path, bundle_path)
+
+
+def get_workflow_bundle(workflow_source, cache_dir=None):
+    """
+    Dependencies zip for a workflow, built only if an identical one isn't already in the cache
+    :param workflow_source: Path to the workflow source
+    :param cache_dir: Defaults to get_cache_dir()
+    :return: Path to the zip, None if the workflow has no local imports
+    """
+
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+
+    file_hash_cache = FileHashCache(cache_dir / FILE_HASHES_CACHE_NAME)
+
+    try:
+        imported_files = resolve_imports(workflow_source, file_hash_cache)
+    finally:
+        file_hash_cache.save()
+
+    if len(imported_files) == 0:
+        return None
+
+    bundle_path = cache_dir / BUNDLE_CACHE_NAMESPACE / "{}.zip".format(get_bundle_key(imported_files))
+
+    if bundle_path.is_file():
+        logger.debug("Reusing dependencies zip \"{}\"".format(bundle_path))
+        return bundle_path
+
+    try:
+        write_bundle(imported_files, bundle_path)
+    except OSError as os_error:
+        logger.debug("Could not write dependencies zip \"{}\": {}".format(bundle_path, os_error))
+        bundle_path = Path(tempfile.gettempdir()) / "cromwell-dependencies-{}.zip".format(bundle_path.stem)
+        write_bundle(imported_files, bundle_path)
+
+    logger.info("Bundled {} imported files into \"{}\"".format(len(imported_files), bundle_path))
+
+    return bundle_path
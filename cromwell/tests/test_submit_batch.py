@@ -0,0 +1,136 @@
+"""
+Tests of submit_to_cromwell.py --batch against a stub cromwell server (http.server on a local port)
+"""
+
+import re
+import sys
+import json
+import argparse
+import threading
+from pathlib import Path
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent / "scripts"))
+
+from submit_to_cromwell import submit_batch  # noqa: E402
+
+
+class StubCromwellHandler(BaseHTTPRequestHandler):
+    """
+    Answers POST /api/workflows/v1 depending on the name of the inputs json submitted
+    busy.json is turned away with a 503 the first time, html.json always gets an html page back
+    """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        inputs_name = re.search(rb'name="workflowInputs"; filename="([^"]+)"', body).group(1).decode()
+
+        with self.server.lock:
+            self.server.posts[inputs_name] += 1
+            post_count = self.server.posts[inputs_name]
+
+        if inputs_name == "busy.json" and post_count == 1:
+            self.send_reply(503, "text/plain", b"Service Unavailable")
+        elif inputs_name == "html.json":
+            self.send_reply(200, "text/html", b"<html><body>Sign in</body></html>")
+        else:
+            self.send_reply(201, "application/json",
+                            json.dumps({"id": "id-{}-{}".format(inputs_name, post_count),
+                                        "status": "Submitted"}).encode())
+
+    def send_reply(self, status_code, content_type, content):
+        self.send_response(status_code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def cromwell_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubCromwellHandler)
+    server.lock = threading.Lock()
+    server.posts = Counter()
+
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def batch_args(tmp_path):
+    workflow_source = tmp_path / "main.wdl"
+    workflow_source.write_text("version 1.0\nworkflow main {}\n")
+
+    batch_inputs = []
+    for inputs_name in ["ok.json", "busy.json", "html.json"]:
+        workflow_inputs = tmp_path / inputs_name
+        workflow_inputs.write_text("{}")
+        batch_inputs.append(workflow_inputs)
+
+    return argparse.Namespace(workflow_source=workflow_source,
+                              workflow_dependencies=None,
+                              workflow_options_json=None,
+                              batch_inputs=batch_inputs,
+                              ledger=tmp_path / "ledger.jsonl",
+                              cromwell_conf=tmp_path / "missing.conf",
+                              throttle=False,
+                              dry_run=False)
+
+
+def get_cromwell_url(server):
+    return "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+def read_ledger_entries(ledger_path):
+    with open(ledger_path, 'r') as ledger_h:
+        return {Path(ledger_entry["inputs"]).name: ledger_entry
+                for ledger_entry in map(json.loads, ledger_h)}
+
+
+def test_batch_retries_503_and_records_non_json(cromwell_server, batch_args):
+    failed_submissions = submit_batch(batch_args, get_cromwell_url(cromwell_server))
+
+    assert failed_submissions == 1
+    assert cromwell_server.posts == Counter({"ok.json": 1, "busy.json": 2, "html.json": 1})
+
+    ledger_entries = read_ledger_entries(batch_args.ledger)
+    assert ledger_entries["ok.json"]["workflow_id"] == "id-ok.json-1"
+    # Retried by the session after the 503
+    assert ledger_entries["busy.json"]["workflow_id"] == "id-busy.json-2"
+    assert ledger_entries["html.json"]["workflow_id"] is None
+    assert "unexpected response" in ledger_entries["html.json"]["error"]
+
+
+def test_rerun_skips_inputs_in_ledger(cromwell_server, batch_args):
+    submit_batch(batch_args, get_cromwell_url(cromwell_server))
+    cromwell_server.posts.clear()
+
+    # Only the submission that failed is sent again
+    assert submit_batch(batch_args, get_cromwell_url(cromwell_server)) == 1
+    assert cromwell_server.posts == Counter({"html.json": 1})
+
+
+def test_rerun_with_another_workflow_submits_everything(cromwell_server, batch_args):
+    submit_batch(batch_args, get_cromwell_url(cromwell_server))
+    cromwell_server.posts.clear()
+
+    batch_args.workflow_source.write_text("version 1.0\nworkflow main_v2 {}\n")
+
+    submit_batch(batch_args, get_cromwell_url(cromwell_server))
+    # busy.json is turned away again now its count has been cleared, so is sent twice
+    assert cromwell_server.posts == Counter({"ok.json": 1, "busy.json": 2, "html.json": 1})
+
+    with open(batch_args.ledger, 'r') as ledger_h:
+        workflow_keys = Counter(json.loads(line)["workflow"] for line in ledger_h)
+    assert sorted(workflow_keys.values()) == [3, 3]
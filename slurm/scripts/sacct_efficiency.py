@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+
+"""
+How well do jobs use what they ask slurm for
+
+Read the accounting database (see connect_sacct_to_mysql_db in bootstrap/post_install.sh) over the last week:
+sacct_efficiency.py --start 2021-06-01
+
+Or read sacct output recorded earlier with --export, without needing the cluster:
+sacct_efficiency.py --sacct-file sacct_2021-06.txt
+
+sacct is run over one --window-hours window at a time, so the database is never asked for the whole range at once,
+and each window is folded into one row per job (steps merged into their job) before the next one is read.
+Jobs are counted in the window they ended in, so a job running across several windows is only counted once,
+and jobs still running are left out.
+
+For each partition, and each job name, reports
+* CPU efficiency:    TotalCPU / (Elapsed * AllocCPUS)
+* memory efficiency: MaxRSS of the job's largest step / memory requested (SLURM_MEM_PER_CPU * CPUS)
+* queue wait:        Start - Submit
+* idle node hours:   node hours held by each job * the fraction of its CPUs it left idle
+"""
+
+import os
+import re
+import sys
+import logging
+import argparse
+import subprocess
+from datetime import datetime, timedelta
+
+import numpy as np
+
+logger = logging.getLogger("slurm")
+
+SACCT_BIN = "/opt/slurm/bin/sacct"
+SACCT_FIELDS = ["JobID", "JobName", "Partition", "State", "Submit", "Start", "End", "ElapsedRaw",
+                "AllocCPUS", "NNodes", "TotalCPU", "ReqMem", "MaxRSS"]
+SACCT_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+DEFAULT_PARTITIONS = ["compute", "compute-long", "copy", "copy-long"]
+DEFAULT_DAYS = 7
+DEFAULT_WINDOW_HOURS = 24
+
+# Columns of the job table, a numpy array of each, one row per job
+JOB_STRING_COLUMNS = ["job_id", "job_name", "partition", "state"]
+JOB_TIME_COLUMNS = ["submit", "start", "end"]
+JOB_NUMBER_COLUMNS = ["elapsed", "alloc_cpus", "nnodes", "total_cpu", "req_mem", "max_rss"]
+
+MEMORY_UNITS = {"K": 1 / 1024, "M": 1, "G": 1024, "T": 1024 * 1024}
+MEMORY_REGEX = re.compile(r"^([\d.]+)([KMGT]?)([cn]?)$")
+TOTAL_CPU_REGEX = re.compile(r"^(?:(?:(\d+)-)?(\d+):)?(\d+):(\d+(?:\.\d+)?)$")
+
+SUMMARY_COLUMNS = [
+    ("Jobs", 8), ("CPU eff", 7), ("Mem eff", 7), ("Mem eff max", 11),
+    ("Wait mean", 9), ("Wait p95", 9), ("Node hours", 10), ("Idle node hours", 15)
+]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Summarise cpu and memory efficiency of slurm jobs from sacct")
+    parser.add_argument("--start",
+                        required=False,
+                        help="Start of the range to read, as YYYY-MM-DD[THH:MM:SS], defaults to a week ago")
+    parser.add_argument("--end",
+                        required=False,
+                        help="End of the range to read, as YYYY-MM-DD[THH:MM:SS], defaults to now")
+    parser.add_argument("--window-hours",
+                        type=float,
+                        required=False, default=DEFAULT_WINDOW_HOURS,
+                        help="Hours of accounting to ask sacct for at a time")
+    parser.add_argument("--partition",
+                        nargs="+",
+                        required=False, default=DEFAULT_PARTITIONS,
+                        help="Partitions to summarise")
+    parser.add_argument("--sacct-file",
+                        nargs="+",
+                        required=False,
+                        help="Read sacct output recorded with --export instead of running sacct")
+    parser.add_argument("--export",
+                        required=False,
+                        help="Also write the sacct output read to this file, to be read again with --sacct-file")
+    parser.add_argument("--top",
+                        type=int,
+                        required=False, default=20,
+                        help="Number of job names to show, those with the most idle node hours first")
+
+    args = parser.parse_args()
+
+    if args.window_hours <= 0:
+        parser.error("--window-hours must be positive")
+
+    if args.sacct_file is not None and args.export is not None:
+        parser.error("--export can only be used when reading from sacct")
+
+    # Replace the strings given with datetimes, filling in the defaults
+    try:
+        args.end = datetime.fromisoformat(args.end) if args.end is not None \
+            else datetime.now().replace(microsecond=0)
+        args.start = datetime.fromisoformat(args.start) if args.start is not None \
+            else args.end - timedelta(days=DEFAULT_DAYS)
+        is_start_before_end = args.start < args.end
+    except ValueError as date_error:
+        parser.error("--start and --end must be dates as YYYY-MM-DD[THH:MM:SS]: {}".format(date_error))
+    except TypeError as date_error:
+        # i.e comparing a date with a timezone to one without
+        parser.error("--start and --end must both have a timezone or neither: {}".format(date_error))
+
+    if not is_start_before_end:
+        parser.error("--start must be before --end")
+
+    return args
+
+
+def parse_memory(memory_values, cpus, nodes, default_unit="M"):
+    """
+    Memory in MB, ReqMem (i.e 4000Mc per cpu, 16Gn per node) and MaxRSS (i.e 1234K) alike
+    :param memory_values: list of sacct memory strings
+    :param cpus: array of the allocated cpus of each, for per cpu values
+    :param nodes: array of the allocated nodes of each, for per node values
+    :param default_unit: unit of values without one
+    :return: float array, nan where missing
+    """
+
+    memory = np.full(len(memory_values), np.nan)
+
+    for index, memory_value in enumerate(memory_values):
+        memory_match = MEMORY_REGEX.match(memory_value)
+        if memory_match is None:
+            continue
+        number, unit, per = memory_match.groups()
+        memory[index] = float(number) * MEMORY_UNITS[unit or default_unit]
+        if per == "c":
+            memory[index] *= cpus[index]
+        elif per == "n":
+            memory[index] *= nodes[index]
+
+    return memory
+
+
+def parse_total_cpu(total_cpu_values):
+    """
+    TotalCPU, [DD-[HH:]]MM:SS.mmm, in seconds
+    :param total_cpu_values:
+    :return: float array, nan where missing
+    """
+
+    total_cpu = np.full(len(total_cpu_values), np.nan)
+
+    for index, total_cpu_value in enumerate(total_cpu_values):
+        total_cpu_match = TOTAL_CPU_REGEX.match(total_cpu_value)
+        if total_cpu_match is None:
+            continue
+        days, hours, minutes, seconds = total_cpu_match.groups()
+        total_cpu[index] = int(days or 0) * 86400 + int(hours or 0) * 3600 + int(minutes) * 60 + float(seconds)
+
+    return total_cpu
+
+
+def parse_times(time_values):
+    """
+    sacct timestamps, 'Unknown' / 'None' for times that haven't happened
+    :param time_values:
+    :return: datetime64[s] array, NaT where missing
+    """
+
+    return np.array([time_value if time_value[:1].isdigit() else "NaT" for time_value in time_values],
+                    dtype="datetime64[s]")
+
+
+def parse_sacct_lines(lines, window_start=None, window_end=None):
+    """
+    Fold sacct --parsable2 rows into one row per job: the job's own row,
+    with the largest MaxRSS of any of its steps (MaxRSS is only recorded against steps)
+    :param lines: rows of SACCT_FIELDS, without the header
+    :param window_start: Optional datetime64, only keep jobs that ended at or after
+    :param window_end: Optional datetime64, only keep jobs that ended before
+    :return: dict of column name to array
+    """
+
+    rows = [line.rstrip("\n").split("|") for line in lines if line.strip() != ""]
+    rows = [row for row in rows if len(row) == len(SACCT_FIELDS)]
+    columns = dict(zip(SACCT_FIELDS, zip(*rows))) if len(rows) > 0 else {field: () for field in SACCT_FIELDS}
+
+    job_ids = np.array(columns["JobID"], dtype=str)
+    is_step = np.char.find(job_ids, ".") >= 0
+
+    # The steps of a job carry its id before the '.', i.e 1234.batch, 1234_5.0
+    step_job_ids = np.array([job_id.split(".", 1)[0] for job_id in job_ids[is_step]], dtype=str)
+    step_max_rss = parse_memory([columns["MaxRSS"][index] for index in np.flatnonzero(is_step)],
+                                cpus=np.ones(len(step_job_ids)), nodes=np.ones(len(step_job_ids)),
+                                default_unit="K")
+
+    job_rows = np.flatnonzero(~is_step)
+
+    def get_job_column(field):
+        return [columns[field][index] for index in job_rows]
+
+    jobs = {
+        "job_id": job_ids[job_rows],
+        "job_name": np.array(get_job_column("JobName"), dtype=str),
+        "partition": np.array(get_job_column("Partition"), dtype=str),
+        # i.e CANCELLED by 1234 -> CANCELLED
+        "state": np.array([state.split(" ", 1)[0] for state in get_job_column("State")], dtype=str),
+        "submit": parse_times(get_job_column("Submit")),
+        "start": parse_times(get_job_column("Start")),
+        "end": parse_times(get_job_column("End")),
+        "elapsed": np.array([int(elapsed) if elapsed.isdigit() else 0 for elapsed in get_job_column("ElapsedRaw")],
+                            dtype=np.int64),
+        "alloc_cpus": np.array([int(cpus) if cpus.isdigit() else 0 for cpus in get_job_column("AllocCPUS")],
+                               dtype=np.int64),
+        "nnodes": np.array([int(nodes) if nodes.isdigit() else 0 for nodes in get_job_column("NNodes")],
+                           dtype=np.int64),
+        "total_cpu": parse_total_cpu(get_job_column("TotalCPU"))
+    }
+    jobs["req_mem"] = parse_memory(get_job_column("ReqMem"), cpus=jobs["alloc_cpus"], nodes=jobs["nnodes"])
+
+    # Largest step of each job
+    jobs["max_rss"] = np.full(len(job_rows), np.nan)
+    if len(job_rows) > 0 and len(step_job_ids) > 0:
+        job_order = np.argsort(jobs["job_id"])
+        step_positions = np.searchsorted(jobs["job_id"], step_job_ids, sorter=job_order)
+        step_positions = np.minimum(step_positions, len(job_rows) - 1)
+        has_job = (jobs["job_id"][job_order[step_positions]] == step_job_ids) & ~np.isnan(step_max_rss)
+        step_jobs = job_order[step_positions[has_job]]
+        jobs["max_rss"][np.unique(step_jobs)] = 0
+        np.fmax.at(jobs["max_rss"], step_jobs, step_max_rss[has_job])
+
+    # Only jobs that have finished, and only in the window they finished in
+    keep = ~np.isnat(jobs["end"])
+    if window_start is not None:
+        keep &= jobs["end"] >= window_start
+    if window_end is not None:
+        keep &= jobs["end"] < window_end
+
+    return {column: values[keep] for column, values in jobs.items()}
+
+
+def concatenate_jobs(jobs_list):
+    """
+    Join the job tables of each window
+    :param jobs_list:
+    :return:
+    """
+
+    return {column: np.concatenate([jobs[column] for jobs in jobs_list])
+            for column in JOB_STRING_COLUMNS + JOB_TIME_COLUMNS + JOB_NUMBER_COLUMNS}
+
+
+def get_windows(start, end, window_hours):
+    """
+    Split a range into windows of window_hours
+    :param start: datetime
+    :param end: datetime
+    :param window_hours:
+    :return: list of (window start, window end) datetimes
+    """
+
+    windows = []
+    window_start = start
+
+    while window_start < end:
+        window_end = min(window_start + timedelta(hours=window_hours), end)
+        windows.append((window_start, window_end))
+        window_start = window_end
+
+    return windows
+
+
+def run_sacct(window_start, window_end, partitions):
+    """
+    Accounting of every job that ran in a window, all users, steps included
+    :param window_start:
+    :param window_end:
+    :param partitions:
+    :return: list of lines, without the header
+    """
+
+    sacct_command = [SACCT_BIN, "--allusers", "--parsable2", "--noheader",
+                     "--starttime", window_start.strftime(SACCT_TIME_FORMAT),
+                     "--endtime", window_end.strftime(SACCT_TIME_FORMAT),
+                     "--partition", ",".join(partitions),
+                     "--format", ",".join(SACCT_FIELDS)]
+
+    logger.debug("Running {}".format(" ".join(sacct_command)))
+
+    sacct_proc = subprocess.run(sacct_command, capture_output=True, text=True)
+
+    if not sacct_proc.returncode == 0:
+        logger.error("sacct failed for {} to {}: {}".format(window_start, window_end, sacct_proc.stderr.strip()))
+        sys.exit(1)
+
+    return sacct_proc.stdout.splitlines()
+
+
+def read_sacct_file(sacct_file_path):
+    """
+    Lines of sacct output recorded with --export, the header names the fields
+    :param sacct_file_path:
+    :return: list of lines in the order of SACCT_FIELDS, without the header
+    """
+
+    try:
+        with open(sacct_file_path, 'r') as sacct_h:
+            header = sacct_h.readline().rstrip("\n").split("|")
+            lines = sacct_h.readlines()
+    except OSError as os_error:
+        logger.error("Could not read sacct file \"{}\": {}".format(sacct_file_path, os_error))
+        sys.exit(1)
+
+    missing_fields = [field for field in SACCT_FIELDS if field not in header]
+    if len(missing_fields) > 0:
+        logger.error("sacct file \"{}\" is missing {}".format(sacct_file_path, ", ".join(missing_fields)))
+        sys.exit(1)
+
+    if header == SACCT_FIELDS:
+        return lines
+
+    # Recorded with other fields, or in another order
+    field_indices = [header.index(field) for field in SACCT_FIELDS]
+    return ["|".join(row[index] for index in field_indices)
+            for row in (line.rstrip("\n").split("|") for line in lines)
+            if len(row) == len(header)]
+
+
+def get_efficiency_summary(jobs, group_column):
+    """
+    Summarise jobs by partition or job name
+    :param jobs: job table
+    :param group_column: 'partition' or 'job_name'
+    :return: dict of group to dict of SUMMARY_COLUMNS
+    """
+
+    groups, group_indices = np.unique(jobs[group_column], return_inverse=True)
+    group_count = len(groups)
+
+    def group_sum(values):
+        return np.bincount(group_indices, weights=values, minlength=group_count)
+
+    cpu_seconds = jobs["elapsed"] * jobs["alloc_cpus"].astype(float)
+    total_cpu = np.nan_to_num(jobs["total_cpu"])
+    cpu_efficiency = np.divide(total_cpu, cpu_seconds, out=np.zeros(len(cpu_seconds)), where=cpu_seconds > 0)
+    node_hours = jobs["elapsed"] * jobs["nnodes"] / 3600
+    idle_node_hours = node_hours * np.clip(1 - cpu_efficiency, 0, 1)
+
+    has_memory = ~np.isnan(jobs["max_rss"]) & ~np.isnan(jobs["req_mem"]) & (jobs["req_mem"] > 0)
+    memory_efficiency = np.zeros(len(has_memory))
+    memory_efficiency[has_memory] = jobs["max_rss"][has_memory] / jobs["req_mem"][has_memory]
+
+    wait = (jobs["start"] - jobs["submit"]).astype("timedelta64[s]").astype(float)
+    has_wait = ~(np.isnat(jobs["start"]) | np.isnat(jobs["submit"]))
+
+    # Memory efficiency max and wait p95 (nearest rank) of each group, from the values sorted within each group
+    memory_max = np.full(group_count, np.nan)
+    np.fmax.at(memory_max, group_indices[has_memory], memory_efficiency[has_memory])
+
+    wait_order = np.lexsort((wait[has_wait], group_indices[has_wait]))
+    wait_counts = np.bincount(group_indices[has_wait], minlength=group_count)
+    wait_starts = np.concatenate([[0], np.cumsum(wait_counts)[:-1]])
+    wait_p95 = np.full(group_count, np.nan)
+    has_group_wait = wait_counts > 0
+    wait_p95[has_group_wait] = wait[has_wait][wait_order][
+        wait_starts[has_group_wait] + np.ceil(0.95 * wait_counts[has_group_wait]).astype(int) - 1
+    ]
+
+    job_counts = np.bincount(group_indices, minlength=group_count)
+    group_cpu_seconds = group_sum(cpu_seconds)
+    group_total_cpu = group_sum(total_cpu)
+    group_memory_efficiency = group_sum(memory_efficiency)
+    memory_counts = group_sum(has_memory.astype(float))
+    group_wait = group_sum(np.where(has_wait, wait, 0))
+    group_node_hours = group_sum(node_hours)
+    group_idle_node_hours = group_sum(idle_node_hours)
+
+    summary = {}
+    for index, group in enumerate(groups):
+        summary[group] = {
+            "Jobs": int(job_counts[index]),
+            "CPU eff": group_total_cpu[index] / group_cpu_seconds[index] if group_cpu_seconds[index] > 0 else np.nan,
+            "Mem eff": group_memory_efficiency[index] / memory_counts[index] if memory_counts[index] > 0 else np.nan,
+            "Mem eff max": memory_max[index],
+            "Wait mean": group_wait[index] / wait_counts[index] if wait_counts[index] > 0 else np.nan,
+            "Wait p95": wait_p95[index],
+            "Node hours": group_node_hours[index],
+            "Idle node hours": group_idle_node_hours[index]
+        }
+
+    return summary
+
+
+def format_value(column, value):
+    """
+    Format a summary value for printing
+    :param column:
+    :param value:
+    :return:
+    """
+
+    if isinstance(value, float) and np.isnan(value):
+        return "-"
+    if column.startswith("CPU eff") or column.startswith("Mem eff"):
+        return "{:.0%}".format(value)
+    if column.startswith("Wait"):
+        return str(timedelta(seconds=int(value)))
+    if column.endswith("hours"):
+        return "{:.1f}".format(value)
+    return str(value)
+
+
+def print_summary(title, summary, width=40):
+    """
+    Print a summary in fixed width columns
+    :param title: header of the first column
+    :param summary: from get_efficiency_summary
+    :param width: width of the first column
+    :return:
+    """
+
+    print("  ".join([title.ljust(width)] +
+                    [column.ljust(column_width) for column, column_width in SUMMARY_COLUMNS]).rstrip())
+    for group, group_summary in summary.items():
+        print("  ".join([group.ljust(width)] +
+                        [format_value(column, group_summary[column]).ljust(column_width)
+                         for column, column_width in SUMMARY_COLUMNS]).rstrip())
+
+
+def main():
+    logging.basicConfig(level=os.environ.get("SLURM_LOG_LEVEL", "INFO"),
+                        format="%(asctime)s %(levelname)-8s %(message)s")
+
+    args = get_args()
+
+    jobs_list = []
+
+    if args.sacct_file is not None:
+        for sacct_file_path in args.sacct_file:
+            jobs_list.append(parse_sacct_lines(read_sacct_file(sacct_file_path)))
+    else:
+        export_h = open(args.export, 'w') if args.export is not None else None
+        if export_h is not None:
+            export_h.write("|".join(SACCT_FIELDS) + "\n")
+
+        for window_start, window_end in get_windows(args.start, args.end, args.window_hours):
+            lines = run_sacct(window_start, window_end, args.partition)
+            jobs = parse_sacct_lines(lines,
+                                     window_start=np.datetime64(window_start, "s"),
+                                     window_end=np.datetime64(window_end, "s"))
+            logger.info("Read {} jobs that ended between {} and {}".format(len(jobs["job_id"]),
+                                                                           window_start, window_end))
+            if export_h is not None:
+                # Only the jobs (and their steps) counted in this window, so windows don't overlap in the export
+                window_job_ids = set(jobs["job_id"])
+                export_h.writelines(line + "\n" for line in lines
+                                    if line.split("|", 1)[0].split(".", 1)[0] in window_job_ids)
+            jobs_list.append(jobs)
+
+        if export_h is not None:
+            export_h.close()
+
+    jobs = concatenate_jobs(jobs_list)
+    jobs = {column: values[np.isin(jobs["partition"], args.partition)] for column, values in jobs.items()}
+
+    if len(jobs["job_id"]) == 0:
+        logger.error("No finished jobs found in partitions {}".format(", ".join(args.partition)))
+        sys.exit(1)
+
+    print_summary("Partition", get_efficiency_summary(jobs, "partition"))
+    print()
+
+    job_name_summary = get_efficiency_summary(jobs, "job_name")
+    job_name_summary = dict(sorted(job_name_summary.items(),
+                                   key=lambda item: item[1]["Idle node hours"], reverse=True)[:args.top])
+    print_summary("Job name", job_name_summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Tests of sacct_efficiency.py against a recorded sacct --parsable2 export (data/sacct_parsable2.txt)
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent / "scripts"))
+
+from sacct_efficiency import read_sacct_file, parse_sacct_lines, get_efficiency_summary  # noqa: E402
+
+SACCT_FIXTURE = Path(__file__).absolute().parent / "data" / "sacct_parsable2.txt"
+
+
+@pytest.fixture
+def jobs():
+    return parse_sacct_lines(read_sacct_file(SACCT_FIXTURE))
+
+
+def test_steps_folded_into_finished_jobs(jobs):
+    # 105 is still running, so left out
+    assert list(jobs["job_id"]) == ["101", "102_1", "103", "104"]
+    assert list(jobs["state"]) == ["COMPLETED", "COMPLETED", "CANCELLED", "COMPLETED"]
+
+
+def test_memory_units(jobs):
+    # 2000Mc * 4 cpus, 8Gn * 1 node, 3500Mc * 16 cpus, 1000Mc * 2 cpus
+    assert list(jobs["req_mem"]) == [8000, 8192, 56000, 2000]
+    # Largest step of each job, 2048000K < 4000M
+    assert list(jobs["max_rss"]) == [4000, 2048, 28000, 1000]
+    assert list(jobs["total_cpu"]) == [3000, 500, 28800, 20]
+
+
+def test_window_keeps_jobs_that_ended_in_it():
+    window_jobs = parse_sacct_lines(read_sacct_file(SACCT_FIXTURE),
+                                    window_start=np.datetime64("2021-06-01T00:15:00"),
+                                    window_end=np.datetime64("2021-06-01T03:00:00"))
+    assert list(window_jobs["job_id"]) == ["101", "103"]
+
+
+def test_partition_summary(jobs):
+    summary = get_efficiency_summary(jobs, "partition")
+
+    assert list(summary.keys()) == ["compute", "compute-long", "copy"]
+
+    compute = summary["compute"]
+    assert compute["Jobs"] == 2
+    # (3000 + 500) / (1000 * 4 + 500 * 2)
+    assert compute["CPU eff"] == pytest.approx(0.7)
+    # mean of 4000 / 8000 and 2048 / 8192
+    assert compute["Mem eff"] == pytest.approx(0.375)
+    assert compute["Mem eff max"] == pytest.approx(0.5)
+    assert compute["Wait mean"] == pytest.approx(200)
+    assert compute["Wait p95"] == pytest.approx(300)
+    assert compute["Node hours"] == pytest.approx(1500 / 3600)
+    assert compute["Idle node hours"] == pytest.approx((1000 * 0.25 + 500 * 0.5) / 3600)
+
+    compute_long = summary["compute-long"]
+    assert compute_long["CPU eff"] == pytest.approx(0.5)
+    assert compute_long["Mem eff"] == pytest.approx(0.5)
+    assert compute_long["Wait mean"] == pytest.approx(0)
+
+    copy = summary["copy"]
+    assert copy["CPU eff"] == pytest.approx(0.1)
+    assert copy["Mem eff"] == pytest.approx(0.5)
+    assert copy["Wait p95"] == pytest.approx(60)
+
+
+def test_job_name_summary(jobs):
+    summary = get_efficiency_summary(jobs, "job_name")
+
+    assert summary["bwa_mem"]["Jobs"] == 1
+    assert summary["bwa_mem"]["CPU eff"] == pytest.approx(0.75)
+    assert summary["samtools_sort"]["Mem eff"] == pytest.approx(0.25)